@@ -0,0 +1,428 @@
+from pathlib import Path
+import sys
+import json
+import math
+import time
+import random
+import resource
+import subprocess
+import multiprocessing
+import graph
+import dotparse
+import process
+import synth
+
+# Benchmarks for the Python stages of the pipeline (parse -> merge -> compare).
+# Usage: python3 src/bench.py [STAGE ...] [--sizes 1000,2000,...] [--repeat N]
+#                             [--baseline FILE] [--threshold 0.25] [--save-baseline]
+# Every measurement runs in a fresh process so its peak RSS is its own. Stages on stored
+# samples read the tool outputs of the last --micro run under data/microbenchmarks, the
+# synth stage runs the same builders on synthetic outputs of every tool (see synth.py).
+# Results are written to data/bench/latest.json; with a baseline present the run fails
+# (exit code 1) when a measurement is slower than baseline * (1 + threshold). The startup
+# stage also fails when a cheap subcommand takes longer than its budget in BUDGETS.
+
+DEFAULT_SIZES = [2000, 4000, 8000, 16000]
+BENCH_PATH = process.DATA_PATH / "bench"
+BASELINE_FILE = BENCH_PATH / "baseline.json"
+LATEST_FILE = BENCH_PATH / "latest.json"
+THRESHOLD = 0.25
+# Absolute slack so timer noise on sub-millisecond measurements is not reported
+MIN_SLACK = 0.005
+REPEAT = 3
+# Stages with an absolute limit in seconds, reported like a regression when exceeded
+BUDGETS = {"startup": 0.1}
+# Stages whose runs are short enough to repeat more often, so a single slow run is not reported
+REPEATS = {"startup": 10}
+MAIN_SCRIPT = Path(__file__).resolve().with_name("main.py")
+
+
+def local_chain_graph(n, chain=None, seed=0):
+    # local.get/local.set chains of length chain (default: one chain over the whole graph)
+    # ending in a non-local instruction, with extra fan-out edges so every node also has
+    # several successors, like wassail/wasma graphs of big functions
+    rng = random.Random(seed)
+    chain = chain or n
+    g = graph.Graph(n)
+    for i in range(n):
+        if i % chain == chain - 1:
+            g.add_node(i, "i32.add")
+        else:
+            g.add_node(i, "local.get {}".format(i % 7) if i % 2 else "local.set {}".format(i % 7))
+    for i in range(n - 1):
+        g.add_edge(i, i + 1)
+        for _ in range(2):
+            g.add_edge(i, rng.randrange(n))
+    return g
+
+
+def dependence_graph(n, seed=0, degree=3, window=32, loops=0.01):
+    # Mostly forward edges to nearby instructions plus a few back edges (loops), the
+    # shape of the dependence graphs the tools report for straight-line code with loops
+    rng = random.Random(seed)
+    g = graph.Graph(n)
+    for i in range(n):
+        g.add_node(i, "i32.add")
+    for i in range(n - 1):
+        for _ in range(degree):
+            g.add_edge(i, min(n - 1, i + 1 + rng.randrange(window)))
+        if rng.random() < loops:
+            g.add_edge(i, rng.randrange(i + 1))
+    return g
+
+
+def perturbed(g, seed, rate=0.05):
+    # Copy of g with a fraction of the edges dropped and as many random edges added,
+    # standing in for the output of another tool on the same function
+    rng = random.Random(seed)
+    n = g.node_count
+    ret = graph.Graph(n, g.orignate)
+    for node_id, (label, _) in g.adj_list.items():
+        ret.add_node(node_id, label)
+    for from_id, (_, to_ids) in g.adj_list.items():
+        for to_id in to_ids:
+            if rng.random() >= rate:
+                ret.add_edge(from_id, to_id)
+            else:
+                ret.add_edge(rng.randrange(n), rng.randrange(n))
+    return ret
+
+
+def debug_graph(n, seed=0, located=0.1):
+    # wasm-opt style graph before the debug-location collapse: diamonds of flattened
+    # locals between debug-located instructions, with phi cycles
+    rng = random.Random(seed)
+    tmp = graph.Graph()
+    debugLocMap = {}
+    for i in range(n):
+        tmp.add_node(str(i), "local.get")
+        if i == 0 or rng.random() < located:
+            debugLocMap[str(i)] = str(i + 1)
+    for i in range(n - 2):
+        tmp.add_edge(str(i), str(i + 1))
+        tmp.add_edge(str(i), str(i + 2))
+        if rng.random() < 0.01:
+            tmp.add_edge(str(i + 2), str(rng.randrange(i + 1)))
+    return tmp, debugLocMap
+
+
+def reference_merge(g):
+    # The previous list-based implementation, kept to check results
+    local_map = {}
+    for node_id in g.adj_list:
+        path = []
+        current = node_id
+        while True:
+            if current in path:
+                for node in path:
+                    local_map[node] = node
+            label, successors = g.adj_list[current]
+            if "local.get" not in label and "local.set" not in label:
+                break
+            if current in local_map:
+                current = local_map[current]
+                break
+            path.append(current)
+            if not successors:
+                break
+            current = next(iter(successors))
+        for node in path:
+            local_map[node] = current
+    res = graph.Graph(g.node_count, g.orignate)
+    for node_id, (label, _) in g.adj_list.items():
+        if node_id not in local_map or local_map[node_id] == node_id:
+            res.add_node(node_id, label)
+    for node_id, (_, to_ids) in g.adj_list.items():
+        if node_id in res.adj_list:
+            for to_id in to_ids:
+                if to_id in local_map:
+                    res.add_edge(node_id, local_map[to_id])
+                res.add_edge(node_id, to_id)
+    return res
+
+
+def sampleFiles(tool):
+    # (path, instruction count) of every stored output of tool, in a stable order
+    files = []
+    if not process.DATA_MICRO_BENCHMARKS_PATH.is_dir():
+        return files
+    for caseDir in sorted(process.DATA_MICRO_BENCHMARKS_PATH.iterdir()):
+        metadataFile = process.MICRO_BENCHMARKS_PATH / caseDir.name / "metadata.json"
+        if not (caseDir / tool).is_dir() or not metadataFile.exists():
+            continue
+        metadata = process.readMetadata(metadataFile)
+        for i, function in enumerate(metadata["functions"]):
+            funcIndex = i if tool == "binaryen" else function["index"]
+            path = caseDir / tool / process.toolRegister[tool][1](funcIndex, caseDir.name)
+            if path.exists():
+                files.append((path, function["count"]))
+    return files
+
+
+# Workload setups: each returns a thunk timed by the benchmark. Setups run in the
+# measuring process, so their cost is not timed but their memory counts towards its RSS.
+
+def setupParse(tool):
+    files = [path for path, _ in sampleFiles(tool)]
+    mark = tool
+
+    def run():
+        for path in files:
+            dotparse.parse_dot_file(path, mark)
+    return run
+
+
+def setupBuild(tool):
+    files = sampleFiles(tool)
+    builder = process.toolRegister[tool][2]
+
+    def run():
+        for path, count in files:
+            builder(path, count)
+    return run
+
+
+def setupSynth(tool, n):
+    # Full builder (parse, build, merge or collapse) on a synthetic function of n instructions
+    spec = synth.Spec(instructions=n, locals=16, depth=3, loops=max(1, n // 500), indirect=max(1, n // 200))
+    func = synth.generate_functions(spec)[0]
+    path = BENCH_PATH / "synth" / "{}_{}.dot".format(tool, n)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(synth.to_dot(tool, func, spec, "synthetic.wat"))
+    builder = process.toolRegister[tool][2]
+    count = len(func.instrs)
+    return lambda: builder(path, count)
+
+
+def setupMerge(n):
+    g = local_chain_graph(n)
+    if graph.merge_local_get_set(g).adj_list != reference_merge(g).adj_list:
+        raise AssertionError("merge_local_get_set differs from the reference on {} nodes".format(n))
+    return lambda: graph.merge_local_get_set(g)
+
+
+def setupCollapse(n):
+    tmp, debugLocMap = debug_graph(n)
+    return lambda: graph.collapse_debug_locations(tmp, debugLocMap, graph.Graph(n))
+
+
+def setupSimplify(n, transitive=False):
+    # simplify works in place, every repetition gets its own copy made here
+    frozen = dependence_graph(n).freeze()
+    copies = iter([frozen.thaw() for _ in range(REPEAT)])
+    return lambda: next(copies).simplify(transitive)
+
+
+def setupCompare(n):
+    g = dependence_graph(n)
+    graphs = [g.freeze(), perturbed(g, 1).freeze(), perturbed(g, 2).freeze()]
+    return lambda: graph.compareAdjacentMatrix(graphs)
+
+
+def setupMetrics(n):
+    # A case of 64 functions of n / 64 instructions compared in one batch
+    functions = []
+    for k in range(64):
+        g = dependence_graph(max(1, n // 64), seed=k)
+        graphs = [g, perturbed(g, 1), perturbed(g, 2)]
+        functions.append(([graph.edge_keys(x) for x in graphs], [graph.node_keys(x) for x in graphs]))
+    return lambda: graph.compareBatch(functions)
+
+
+def setupStartup(case, args):
+    # Wall-clock time of a cheap main.py subcommand, interpreter start included. It runs in
+    # an empty scratch tree, so --clear and --dump touch nothing outside data/bench.
+    scratch = (BENCH_PATH / "startup" / case).resolve()
+    command = [sys.executable, str(MAIN_SCRIPT)] + args
+
+    def run():
+        for path in (process.MICRO_BENCHMARKS_PATH, process.REAL_WORLD_PATH,
+                     process.DATA_MICRO_BENCHMARKS_PATH, process.DATA_REAL_WORLD_PATH):
+            (scratch / path).mkdir(parents=True, exist_ok=True)
+        subprocess.run(command, cwd=scratch, stdout=subprocess.DEVNULL, check=True)
+
+    # Untimed first run, e.g. --dump compiles the empty report only once
+    run()
+    return run
+
+
+def startupCases(sizes):
+    # Subcommands that must not load numpy, asyncio or the pools (see lazy.py)
+    trace = (BENCH_PATH / "empty-trace.jsonl").resolve()
+    trace.parent.mkdir(parents=True, exist_ok=True)
+    trace.touch()
+    yield "help", 1, lambda: setupStartup("help", ["--help"])
+    yield "trace", 1, lambda: setupStartup("trace", ["--trace-summary", str(trace)])
+    yield "dump", 1, lambda: setupStartup("dump", ["--micro", "--dump"])
+    yield "clear", 1, lambda: setupStartup("clear", ["--clear"])
+
+
+def sampleCases(setup):
+    # One case per tool with stored samples, sized by the number of files
+    def cases(sizes):
+        for tool in process.toolRegister:
+            count = len(sampleFiles(tool))
+            if count:
+                yield tool, count, lambda tool=tool: setup(tool)
+    return cases
+
+
+def synthCases(sizes):
+    # One curve per tool output format
+    for tool in process.toolRegister:
+        for n in sizes:
+            yield tool, n, lambda tool=tool, n=n: setupSynth(tool, n)
+
+
+def generatedCases(setup):
+    def cases(sizes):
+        for n in sizes:
+            yield "generated", n, lambda n=n: setup(n)
+    return cases
+
+
+STAGES = {
+    "parse": sampleCases(setupParse),
+    "build": sampleCases(setupBuild),
+    "synth": synthCases,
+    "merge": generatedCases(setupMerge),
+    "collapse": generatedCases(setupCollapse),
+    "simplify": generatedCases(setupSimplify),
+    "reduce": generatedCases(lambda n: setupSimplify(n, True)),
+    "compare": generatedCases(setupCompare),
+    "metrics": generatedCases(setupMetrics),
+    "startup": startupCases,
+}
+
+
+def _measure(setup, repeat, conn):
+    try:
+        run = setup()
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            best = min(best, time.perf_counter() - start)
+        # ru_maxrss is in KiB on Linux
+        conn.send((best, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+    except BaseException as e:
+        conn.send(e)
+    finally:
+        conn.close()
+
+
+def measure(setup, repeat):
+    # Best wall-clock time of repeat runs and peak RSS (MiB), measured in a forked process
+    ctx = multiprocessing.get_context("fork")
+    receiver, sender = ctx.Pipe(duplex=False)
+    worker = ctx.Process(target=_measure, args=(setup, repeat, sender))
+    worker.start()
+    sender.close()
+    try:
+        result = receiver.recv()
+    except EOFError:
+        result = RuntimeError("benchmark process exited with code {}".format(worker.exitcode))
+    worker.join()
+    if isinstance(result, BaseException):
+        raise result
+    return result
+
+
+def scaling_exponent(points):
+    # Least-squares slope of log(time) over log(size): ~1 linear, ~2 quadratic
+    xs = [math.log(n) for n, t in points if t > 0]
+    ys = [math.log(t) for n, t in points if t > 0]
+    if len(xs) < 2:
+        return float("nan")
+    mx = sum(xs) / len(xs)
+    my = sum(ys) / len(ys)
+    var = sum((x - mx) ** 2 for x in xs)
+    return sum((x - mx) * (y - my) for x, y in zip(xs, ys)) / var if var else float("nan")
+
+
+def loadBaseline(path):
+    if not path.exists():
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def runStage(name, sizes, baseline, threshold):
+    # Returns the measurements of the stage and the keys that regressed
+    measurements = {}
+    regressions = []
+    curves = {}
+    print(name)
+    print("{:>10} {:>8} {:>10} {:>10} {:>10}".format("case", "n", "time (s)", "rss (MiB)", "baseline"))
+    for case, n, setup in STAGES[name](sizes):
+        seconds, rss = measure(setup, max(REPEAT, REPEATS.get(name, 0)))
+        key = "{}/{}/{}".format(name, case, n)
+        measurements[key] = {"seconds": seconds, "rss": rss}
+        curves.setdefault(case, []).append((n, seconds))
+        base = baseline.get(key, {}).get("seconds")
+        note = "{:>10.4f}".format(base) if base is not None else "{:>10}".format("-")
+        if base is not None and seconds > base * (1 + threshold) + MIN_SLACK:
+            regressions.append(key)
+            note += "  REGRESSION x{:.2f}".format(seconds / base)
+        elif name in BUDGETS and seconds > BUDGETS[name]:
+            regressions.append(key)
+            note += "  OVER BUDGET {:.3f}s".format(BUDGETS[name])
+        print("{:>10} {:>8} {:>10.4f} {:>10.1f} {}".format(case, n, seconds, rss, note))
+    for case, points in curves.items():
+        if len(points) > 1:
+            print("{} scaling exponent: {:.2f}".format(case, scaling_exponent(points)))
+    if not curves:
+        print("  skipped, no stored samples under {}".format(process.DATA_MICRO_BENCHMARKS_PATH))
+    return measurements, regressions
+
+
+def main():
+    global REPEAT
+    args = sys.argv[1:]
+
+    def option(name, convert):
+        if name not in args:
+            return None
+        pos = args.index(name)
+        value = convert(args[pos + 1])
+        del args[pos:pos + 2]
+        return value
+
+    sizes = option("--sizes", lambda v: [int(x) for x in v.split(",")]) or DEFAULT_SIZES
+    REPEAT = option("--repeat", int) or REPEAT
+    threshold = option("--threshold", float)
+    threshold = THRESHOLD if threshold is None else threshold
+    baselineFile = option("--baseline", Path) or BASELINE_FILE
+    saveBaseline = "--save-baseline" in args
+    if saveBaseline:
+        args.remove("--save-baseline")
+    for stage in args:
+        if stage not in STAGES:
+            print("Unknown stage {}, available: {}".format(stage, ", ".join(STAGES)))
+            sys.exit(2)
+
+    baseline = {} if saveBaseline else loadBaseline(baselineFile)
+    measurements = {}
+    regressions = []
+    for stage in args or list(STAGES):
+        stageMeasurements, stageRegressions = runStage(stage, sizes, baseline, threshold)
+        measurements.update(stageMeasurements)
+        regressions += stageRegressions
+
+    BENCH_PATH.mkdir(parents=True, exist_ok=True)
+    with open(LATEST_FILE, "w") as f:
+        json.dump(measurements, f, indent=1)
+    if saveBaseline:
+        baselineFile.parent.mkdir(parents=True, exist_ok=True)
+        merged = loadBaseline(baselineFile)
+        merged.update(measurements)
+        with open(baselineFile, "w") as f:
+            json.dump(merged, f, indent=1)
+        print("baseline saved to {}".format(baselineFile))
+    if regressions:
+        print("{} regression(s) beyond {:.0%} of {}: {}".format(len(regressions), threshold, baselineFile, ", ".join(regressions)))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
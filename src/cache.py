@@ -0,0 +1,260 @@
+from pathlib import Path
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import zipfile
+
+# Analyzer outputs keyed by (input hashes, tool identity, function index, flags)
+CACHE_PATH = Path("data") / "cache"
+# Least recently used entries are evicted once the cache grows beyond this size
+CACHE_MAX_BYTES = 4 * 1024 ** 3
+ENABLED = True
+# Normalized graphs built from the analyzer outputs, keyed by (DOT hash, tool, function size, options)
+GRAPH_CACHE_PATH = Path("data") / "graph-cache"
+GRAPH_CACHE_MAX_BYTES = 1024 ** 3
+# Bump whenever the graph builders change what they produce for the same DOT file
+GRAPH_VERSION = 2
+# DOT file -> (size, mtime_ns, SHA-256) when it was last hashed, so reruns only hash changed outputs
+GRAPH_STAMP_PATH = Path("data") / "graph-stamps"
+# Files modified this recently may still change within the mtime resolution; their hash is not stamped
+RACY_SECONDS = 2
+SETUP_SCRIPT = Path("setup.sh")
+
+stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+_lock = threading.Lock()
+_fileHashes = {}
+_toolIdentities = {}
+
+
+def hashFile(path):
+    # Memoized per (path, size, mtime) so a module shared by thousands of jobs is read once
+    path = Path(path)
+    st = path.stat()
+    memoKey = (str(path.resolve()), st.st_size, st.st_mtime_ns)
+    with _lock:
+        if memoKey in _fileHashes:
+            return _fileHashes[memoKey]
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    digest = h.hexdigest()
+    with _lock:
+        _fileHashes[memoKey] = digest
+    return digest
+
+
+def pinnedCommits():
+    # tool checkout name -> commit pinned by "cd <tool> ... git reset --hard <sha>" in setup.sh
+    commits = {}
+    if not SETUP_SCRIPT.exists():
+        return commits
+    current = None
+    for line in SETUP_SCRIPT.read_text().splitlines():
+        line = line.strip()
+        if line.startswith("cd "):
+            current = line[3:].strip()
+        match = re.match(r"git reset --hard ([0-9a-f]+)", line)
+        if match and current:
+            commits[current] = match.group(1)
+    return commits
+
+
+def toolIdentity(tool, binary):
+    with _lock:
+        if tool in _toolIdentities:
+            return _toolIdentities[tool]
+    identity = {
+        "tool": tool,
+        "commit": pinnedCommits().get(tool),
+        "binary": hashFile(binary) if Path(binary).exists() else None,
+    }
+    with _lock:
+        _toolIdentities[tool] = identity
+    return identity
+
+
+def jobKey(job):
+    # None when an input is missing: such a job is not cached, the tool run reports the error
+    try:
+        inputs = [hashFile(path) for path in job.inputs]
+    except FileNotFoundError:
+        return None
+    key = {
+        "inputs": inputs,
+        "tool": toolIdentity(job.tool, job.binary),
+        "function": job.funcIndex,
+        "flags": job.flags,
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def entryPath(key):
+    return CACHE_PATH / key[:2] / key
+
+
+def restore(job):
+    # Copy the cached outputs of job into place, returns False on a miss
+    if not ENABLED:
+        return False
+    key = jobKey(job)
+    if key is None:
+        return False
+    entry = entryPath(key)
+    if not entry.is_dir():
+        with _lock:
+            stats["misses"] += 1
+        return False
+    outputDir = job.outputDir if job.outputDir is not None else job.outputs[0].parent
+    outputDir.mkdir(parents=True, exist_ok=True)
+    for file in entry.iterdir():
+        shutil.copyfile(file, outputDir / file.name)
+    # The entry mtime is the LRU clock
+    os.utime(entry)
+    with _lock:
+        stats["hits"] += 1
+    return True
+
+
+def store(job, startTime):
+    # Save the outputs of a successful run. For whole-directory jobs only files written
+    # during this run are kept, stale dumps from earlier runs are ignored.
+    if not ENABLED:
+        return
+    if job.outputDir is not None:
+        files = [f for f in job.outputDir.glob("*.dot") if f.stat().st_mtime >= startTime]
+    else:
+        files = list(job.outputs)
+        if not all(f.exists() for f in files):
+            return
+    key = jobKey(job)
+    if key is None:
+        return
+    entry = entryPath(key)
+    if entry.exists():
+        return
+    tmp = entry.with_name("{}.tmp{}.{}".format(entry.name, os.getpid(), threading.get_ident()))
+    tmp.mkdir(parents=True, exist_ok=True)
+    for file in files:
+        shutil.copyfile(file, tmp / file.name)
+    try:
+        tmp.rename(entry)
+    except OSError:
+        # Another worker stored the same entry first
+        shutil.rmtree(tmp, ignore_errors=True)
+        return
+    with _lock:
+        stats["stores"] += 1
+
+
+def stampedHash(path):
+    # hashFile(path), taken from the stamp of an earlier run while size and mtime are unchanged.
+    # A file rewritten with the same content (e.g. restored from the output cache) is hashed
+    # again but still finds its graph.
+    path = Path(path)
+    st = path.stat()
+    name = hashlib.sha1(str(path.resolve()).encode("utf-8")).hexdigest()
+    stampFile = GRAPH_STAMP_PATH / name[:2] / (name + ".json")
+    try:
+        with open(stampFile, "r") as f:
+            stamp = json.load(f)
+        if stamp["size"] == st.st_size and stamp["mtime_ns"] == st.st_mtime_ns:
+            return stamp["sha256"]
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    digest = hashFile(path)
+    if time.time_ns() - st.st_mtime_ns > RACY_SECONDS * 10 ** 9:
+        stampFile.parent.mkdir(parents=True, exist_ok=True)
+        tmp = stampFile.with_name("{}.tmp{}.{}".format(stampFile.name, os.getpid(), threading.get_ident()))
+        try:
+            with open(tmp, "w") as f:
+                json.dump({"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": digest}, f)
+            os.replace(tmp, stampFile)
+        except OSError:
+            tmp.unlink(missing_ok=True)
+    return digest
+
+
+def graphEntry(tool, dot, count, options=None):
+    # Path of the cached graph built from dot, None when caching is off or dot does not exist.
+    # The DOT file is only read when it changed since the last run, see stampedHash.
+    if not ENABLED or not Path(dot).is_file():
+        return None
+    key = {"dot": stampedHash(dot), "tool": tool, "count": count, "options": options, "version": GRAPH_VERSION}
+    key = hashlib.sha256(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()
+    return GRAPH_CACHE_PATH / key[:2] / (key + ".npz")
+
+
+def restoreGraph(entry, load):
+    # load(file) the cached graph, None on a miss or an unreadable entry
+    try:
+        with open(entry, "rb") as f:
+            ret = load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+        # Truncated or stale format, rebuilt and overwritten by the caller
+        return None
+    os.utime(entry)
+    return ret
+
+
+def storeGraph(entry, save):
+    # save(file) writes the graph; written under a temporary name and renamed into place
+    entry.parent.mkdir(parents=True, exist_ok=True)
+    tmp = entry.with_name("{}.tmp{}.{}".format(entry.name, os.getpid(), threading.get_ident()))
+    try:
+        with open(tmp, "wb") as f:
+            save(f)
+        os.replace(tmp, entry)
+    except OSError:
+        tmp.unlink(missing_ok=True)
+
+
+def _entrySize(entry):
+    if entry.is_dir():
+        return sum(f.stat().st_size for f in entry.iterdir())
+    return entry.stat().st_size
+
+
+def evict(path=None, maxBytes=None):
+    # Drop least recently used entries until the cache fits in maxBytes
+    path = CACHE_PATH if path is None else path
+    maxBytes = CACHE_MAX_BYTES if maxBytes is None else maxBytes
+    if not path.exists():
+        return
+    entries = []
+    total = 0
+    for bucket in path.iterdir():
+        for entry in bucket.iterdir():
+            size = _entrySize(entry)
+            entries.append((entry.stat().st_mtime, size, entry))
+            total += size
+    entries.sort()
+    for _, size, entry in entries:
+        if total <= maxBytes:
+            break
+        if entry.is_dir():
+            shutil.rmtree(entry, ignore_errors=True)
+        else:
+            entry.unlink(missing_ok=True)
+        total -= size
+        stats["evictions"] += 1
+
+
+def evictGraphs():
+    evict(GRAPH_CACHE_PATH, GRAPH_CACHE_MAX_BYTES)
+
+
+def summary():
+    return "cache: {hits} hits, {misses} misses, {stores} stored, {evictions} evicted".format(**stats)
+
+
+def now():
+    # Timestamp to pass to store(); truncated so coarse filesystem mtimes still compare correctly
+    return int(time.time()) - 1
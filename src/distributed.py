@@ -0,0 +1,507 @@
+from pathlib import Path
+import abc
+import asyncio
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import uuid
+import cache
+import runner
+import scheduler
+import tracing
+
+# Coordinator / worker mode for the analyzer stage. The coordinator expands the jobs as usual,
+# restores what it can from the output cache and publishes the rest to a transport in shards;
+# workers (on this or other machines, each in its own checkout with the tools built) claim
+# shards, run the analyzers in a scratch directory and send the DOT outputs back. The coordinator
+# writes them to the normal data/ layout, so evaluation and dump are unchanged.
+#
+# Jobs travel as argument templates: the tool binary stays a path relative to the worker's
+# checkout, inputs are shipped by content hash and outputs are collected from the scratch
+# directory, so workers need neither the coordinator's paths nor a shared data/ directory.
+
+# Jobs of one tool and program per shard; small shards balance better, large ones cost less IO
+SHARD_SIZE = 8
+# Seconds between polls of the transport, for the coordinator and idle workers
+POLL_INTERVAL = 0.5
+# A claimed shard whose worker stopped sending heartbeats for this long is given to another worker
+CLAIM_TIMEOUT = 120
+HEARTBEAT_INTERVAL = 10
+# Seconds between progress messages of a coordinator waiting for its shards
+PROGRESS_INTERVAL = 60
+
+
+class Transport(abc.ABC):
+    """
+    Interface between the coordinator and the workers. Shards are JSON-serializable dicts;
+    results are a JSON-serializable dict plus a directory of output files.
+    Several coordinators may share one transport: every shard id contains the id of its run
+    (see shardRun), and a coordinator only removes the entries of its own run or of runs that
+    stopped sending heartbeats.
+    """
+
+    @abc.abstractmethod
+    def openRun(self, runId):
+        # Coordinator: register runId and drop what runs that are no longer alive left behind
+        pass
+
+    @abc.abstractmethod
+    def touchRun(self, runId):
+        # Coordinator: heartbeat of runId, a run without one for CLAIM_TIMEOUT counts as dead
+        pass
+
+    @abc.abstractmethod
+    def finishRun(self, runId):
+        # Coordinator: drop the remaining shards and results of runId and unregister it
+        pass
+
+    @abc.abstractmethod
+    def putBlob(self, path):
+        # Coordinator: make the file available to workers, returns its key
+        pass
+
+    @abc.abstractmethod
+    def getBlob(self, key, path):
+        # Worker: copy the file with key to path
+        pass
+
+    @abc.abstractmethod
+    def publish(self, shardId, shard):
+        pass
+
+    @abc.abstractmethod
+    def claim(self, worker):
+        # Worker: take the next pending shard, (shardId, shard) or None
+        pass
+
+    @abc.abstractmethod
+    def heartbeat(self, shardId):
+        pass
+
+    @abc.abstractmethod
+    def complete(self, shardId, result, filesDir):
+        # Worker: hand back the result and the files under filesDir
+        pass
+
+    @abc.abstractmethod
+    def finished(self):
+        # Coordinator: ids of the shards with a result
+        pass
+
+    @abc.abstractmethod
+    def result(self, shardId):
+        # Coordinator: (result, filesDir) of a finished shard; filesDir is valid until release
+        pass
+
+    @abc.abstractmethod
+    def release(self, shardId):
+        pass
+
+    @abc.abstractmethod
+    def requeueStale(self, timeout):
+        # Coordinator: put shards claimed more than timeout seconds ago without heartbeat back
+        pass
+
+    @abc.abstractmethod
+    def pendingCount(self, runId=None):
+        # Shards waiting for a worker, of runId or of all runs
+        pass
+
+    @abc.abstractmethod
+    def close(self):
+        # Coordinator: tell idle workers there is nothing more to come from this process
+        pass
+
+    @abc.abstractmethod
+    def closed(self):
+        # Worker: a coordinator has closed and no run is alive
+        pass
+
+
+def shardRun(shardId):
+    # Shard ids are "<seq>-<runId>-<tool>", see coordinate
+    return shardId.split("-", 2)[1]
+
+
+class FileTransport(Transport):
+    """
+    Transport over a directory, on a shared filesystem or local for several workers on one
+    machine. Every state change is a rename, so a shard is claimed and completed exactly once.
+      blobs/<sha256>         input files
+      runs/<runId>           one per running coordinator, the mtime is the heartbeat
+      pending/<id>.json      published shards, claimed in name order
+      claimed/<id>.json      shards being worked on, the mtime is the heartbeat
+      done/<id>/             result.json and the output files of a finished shard
+      closed                 marker, workers exit once it exists, no run is alive and nothing is pending
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+        for name in ("blobs", "runs", "pending", "claimed", "done", "tmp"):
+            (self.root / name).mkdir(parents=True, exist_ok=True)
+
+    def _tmp(self, name):
+        return self.root / "tmp" / "{}.{}.{}".format(name, os.getpid(), threading.get_ident())
+
+    def _liveRuns(self):
+        now = time.time()
+        runs = set()
+        for runId in os.listdir(self.root / "runs"):
+            try:
+                if now - (self.root / "runs" / runId).stat().st_mtime <= CLAIM_TIMEOUT:
+                    runs.add(runId)
+            except FileNotFoundError:
+                pass
+        return runs
+
+    def _entries(self):
+        # (shardId, path) of every pending, claimed and finished shard
+        for name in ("pending", "claimed", "done"):
+            for entry in os.listdir(self.root / name):
+                yield (entry[:-len(".json")] if name != "done" else entry), self.root / name / entry
+
+    def _drop(self, keep):
+        for shardId, path in self._entries():
+            if not keep(shardRun(shardId)):
+                if path.is_dir():
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    path.unlink(missing_ok=True)
+
+    def openRun(self, runId):
+        (self.root / "runs" / runId).touch()
+        (self.root / "closed").unlink(missing_ok=True)
+        live = self._liveRuns()
+        for dead in set(os.listdir(self.root / "runs")) - live:
+            (self.root / "runs" / dead).unlink(missing_ok=True)
+        self._drop(lambda run: run in live)
+
+    def touchRun(self, runId):
+        (self.root / "runs" / runId).touch()
+
+    def finishRun(self, runId):
+        self._drop(lambda run: run != runId)
+        (self.root / "runs" / runId).unlink(missing_ok=True)
+
+    def putBlob(self, path):
+        key = cache.hashFile(path)
+        blob = self.root / "blobs" / key
+        if not blob.exists():
+            tmp = self._tmp(key)
+            shutil.copyfile(path, tmp)
+            os.replace(tmp, blob)
+        return key
+
+    def getBlob(self, key, path):
+        shutil.copyfile(self.root / "blobs" / key, path)
+
+    def publish(self, shardId, shard):
+        tmp = self._tmp(shardId)
+        with open(tmp, "w") as f:
+            json.dump(shard, f)
+        os.replace(tmp, self.root / "pending" / (shardId + ".json"))
+
+    def claim(self, worker):
+        for entry in sorted(os.listdir(self.root / "pending")):
+            claimed = self.root / "claimed" / entry
+            try:
+                os.rename(self.root / "pending" / entry, claimed)
+            except FileNotFoundError:
+                # Claimed by another worker in the meantime
+                continue
+            os.utime(claimed)
+            with open(claimed, "r") as f:
+                shard = json.load(f)
+            return entry[:-len(".json")], shard
+        return None
+
+    def heartbeat(self, shardId):
+        try:
+            os.utime(self.root / "claimed" / (shardId + ".json"))
+        except FileNotFoundError:
+            pass
+
+    def complete(self, shardId, result, filesDir):
+        tmp = self._tmp(shardId)
+        shutil.copytree(filesDir, tmp)
+        with open(tmp / "result.json", "w") as f:
+            json.dump(result, f)
+        try:
+            os.rename(tmp, self.root / "done" / shardId)
+        except OSError:
+            # Requeued after a missed heartbeat and finished by another worker first
+            shutil.rmtree(tmp, ignore_errors=True)
+        (self.root / "claimed" / (shardId + ".json")).unlink(missing_ok=True)
+
+    def finished(self):
+        return set(os.listdir(self.root / "done"))
+
+    def result(self, shardId):
+        entry = self.root / "done" / shardId
+        with open(entry / "result.json", "r") as f:
+            return json.load(f), entry
+
+    def release(self, shardId):
+        shutil.rmtree(self.root / "done" / shardId, ignore_errors=True)
+
+    def requeueStale(self, timeout):
+        now = time.time()
+        for entry in os.listdir(self.root / "claimed"):
+            claimed = self.root / "claimed" / entry
+            try:
+                if now - claimed.stat().st_mtime > timeout and not (self.root / "done" / entry[:-len(".json")]).exists():
+                    os.rename(claimed, self.root / "pending" / entry)
+            except FileNotFoundError:
+                pass
+
+    def pendingCount(self, runId=None):
+        entries = os.listdir(self.root / "pending")
+        if runId is None:
+            return len(entries)
+        return sum(1 for entry in entries if shardRun(entry) == runId)
+
+    def close(self):
+        (self.root / "closed").touch()
+
+    def closed(self):
+        return (self.root / "closed").exists() and not self._liveRuns()
+
+
+# Transport backends by URL scheme, "file:DIR" or a plain directory
+TRANSPORTS = {"file": FileTransport}
+
+
+def openTransport(spec):
+    scheme, sep, rest = spec.partition(":")
+    if sep and scheme in TRANSPORTS:
+        return TRANSPORTS[scheme](rest)
+    if sep and len(scheme) > 1 and not scheme.startswith((".", "/", "~")):
+        raise ValueError("Unknown transport {}, expected one of {}.".format(scheme, ", ".join(TRANSPORTS)))
+    return FileTransport(spec)
+
+
+def encodeJob(job, transport):
+    # Argument template of job: literal strings, inputs by blob key, outputs by file name
+    inputs = {str(path): i for i, path in enumerate(job.inputs)}
+    outputs = {str(path): path.name for path in job.outputs}
+    outputDirs = {str(job.outputDir)} if job.outputDir is not None else {str(path.parent) for path in job.outputs}
+    argv = []
+    for arg in job.command:
+        arg = str(arg)
+        if arg in inputs:
+            argv.append({"input": inputs[arg]})
+        elif arg in outputs:
+            argv.append({"output": outputs[arg]})
+        elif arg in outputDirs:
+            argv.append({"outputDir": True})
+        else:
+            argv.append(arg)
+    blobs = [[transport.putBlob(path), path.name] if path.exists() else None for path in job.inputs]
+    return {"tool": job.tool, "program": job.program, "function": job.funcIndex, "argv": argv, "inputs": blobs}
+
+
+def decodeJob(encoded, transport, scratch):
+    # Materialize the inputs under scratch/in and return the argv to run
+    inputs = []
+    for i, blob in enumerate(encoded["inputs"]):
+        if blob is None:
+            inputs.append(None)
+            continue
+        key, name = blob
+        path = scratch / "in" / str(i) / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        transport.getBlob(key, path)
+        inputs.append(path)
+    outputDir = scratch / "out"
+    outputDir.mkdir(parents=True, exist_ok=True)
+    argv = []
+    for arg in encoded["argv"]:
+        if isinstance(arg, str):
+            argv.append(arg)
+        elif "input" in arg:
+            argv.append(inputs[arg["input"]] if inputs[arg["input"]] is not None else "missing-input")
+        elif "output" in arg:
+            argv.append(outputDir / arg["output"])
+        else:
+            argv.append(outputDir)
+    return argv, outputDir
+
+
+def makeShards(queues):
+    # Consecutive jobs of one tool and program, SHARD_SIZE at most; shards of the tools interleaved
+    perTool = []
+    for queue in queues.values():
+        shards = []
+        for job in queue:
+            if not shards or len(shards[-1]) >= SHARD_SIZE or shards[-1][0].program != job.program:
+                shards.append([])
+            shards[-1].append(job)
+        perTool.append(shards)
+    ret = []
+    while any(perTool):
+        for shards in perTool:
+            if shards:
+                ret.append(shards.pop(0))
+        perTool = [shards for shards in perTool if shards]
+    return ret
+
+
+def _collect(job, filesDir, files):
+    # Put the outputs a worker sent back where the local run would have written them
+    outputDir = job.outputDir if job.outputDir is not None else job.outputs[0].parent
+    outputDir.mkdir(parents=True, exist_ok=True)
+    for name in files:
+        shutil.copyfile(filesDir / name, outputDir / Path(name).name)
+
+
+def coordinate(queues, transport):
+    """
+    Run the jobs of queues (tool -> jobs, in start order) on the workers of transport.
+    Returns (ok, times) like scheduler._runJobs.
+    """
+    runId = uuid.uuid4().hex[:8]
+    transport.openRun(runId)
+    try:
+        return _coordinateRun(queues, transport, runId)
+    finally:
+        # Also when interrupted, so that workers do not pick up shards nobody waits for
+        transport.finishRun(runId)
+
+
+def _coordinateRun(queues, transport, runId):
+    shards = {}
+    ok = True
+    times = {}
+    remaining = []
+    startTime = cache.now()
+    for tool, queue in queues.items():
+        for job in queue:
+            if cache.restore(job):
+                job.outcome = runner.OK
+                print("{} restored from cache".format(job))
+            else:
+                remaining.append(job)
+    remainingQueues = {}
+    for job in remaining:
+        remainingQueues.setdefault(job.tool, []).append(job)
+    for seq, shardJobs in enumerate(makeShards(remainingQueues)):
+        shardId = "{:08d}-{}-{}".format(seq, runId, shardJobs[0].tool)
+        transport.publish(shardId, {"jobs": [encodeJob(job, transport) for job in shardJobs]})
+        shards[shardId] = shardJobs
+    print("published {} jobs in {} shards".format(len(remaining), len(shards)))
+    total = len(shards)
+    lastBeat = lastProgress = time.time()
+    while shards:
+        now = time.time()
+        if now - lastBeat >= HEARTBEAT_INTERVAL:
+            transport.touchRun(runId)
+            lastBeat = now
+        finished = transport.finished() & shards.keys()
+        if not finished:
+            if now - lastProgress >= PROGRESS_INTERVAL:
+                pending = transport.pendingCount(runId)
+                print("waiting for workers: {} of {} shards finished, {} not claimed yet".format(
+                    total - len(shards), total, pending))
+                if pending == len(shards):
+                    print("no worker is running a shard of this run, start workers with main.py --worker on the same queue")
+                lastProgress = now
+            transport.requeueStale(CLAIM_TIMEOUT)
+            time.sleep(POLL_INTERVAL)
+            continue
+        for shardId in sorted(finished):
+            result, filesDir = transport.result(shardId)
+            for job, entry in zip(shards.pop(shardId), result["jobs"]):
+                job.outcome = entry["outcome"]
+                if entry["status"]:
+                    _collect(job, filesDir / str(entry["slot"]), entry["files"])
+                    cache.store(job, startTime)
+                    times[job.key()] = entry["time"]
+                    print(job.message.format(entry["time"]) + " on {}".format(result["worker"]))
+                else:
+                    ok = False
+                    print(entry["msg"])
+            transport.release(shardId)
+    return ok, times
+
+
+async def _runEncoded(encoded, transport, scratch, worker):
+    loop = asyncio.get_running_loop()
+    with tracing.span("analyse", "tool", tool=encoded["tool"], case=encoded["program"],
+                      function=encoded["function"], worker=worker) as attrs:
+        try:
+            argv, outputDir = await loop.run_in_executor(None, decodeJob, encoded, transport, scratch)
+        except OSError as e:
+            msg = "Error: {} could not fetch the inputs of {}/{} on {}: {}".format(
+                encoded["tool"], encoded["program"], encoded["function"], worker, e)
+            return {"outcome": runner.ERROR, "status": False, "msg": msg, "time": 0.0, "files": []}
+        status, msg, exec_time, outcome = await runner.run(argv, encoded["tool"], usage=attrs, **scheduler.limitsFor(encoded["tool"]))
+        attrs["outcome"] = outcome
+    files = sorted(os.listdir(outputDir)) if status else []
+    return {"outcome": outcome, "status": status, "msg": msg, "time": exec_time, "files": files}
+
+
+async def _runShard(shardId, shard, transport, worker):
+    loop = asyncio.get_running_loop()
+
+    async def heartbeat():
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            await loop.run_in_executor(None, transport.heartbeat, shardId)
+
+    beat = asyncio.ensure_future(heartbeat())
+    with tempfile.TemporaryDirectory(prefix="worker-") as scratch:
+        scratch = Path(scratch)
+        try:
+            entries = await asyncio.gather(*(_runEncoded(encoded, transport, scratch / "jobs" / str(slot), worker)
+                                             for slot, encoded in enumerate(shard["jobs"])))
+        finally:
+            beat.cancel()
+        # Only the outputs travel back, one directory per job of the shard
+        results = scratch / "results"
+        results.mkdir()
+        for slot, entry in enumerate(entries):
+            entry["slot"] = slot
+            if entry["status"]:
+                os.rename(scratch / "jobs" / str(slot) / "out", results / str(slot))
+        await loop.run_in_executor(None, transport.complete, shardId, {"worker": worker, "jobs": entries}, results)
+    return len(entries)
+
+
+async def _work(transport, worker, once):
+    loop = asyncio.get_running_loop()
+    # Enough shards in flight to keep runner.LIMIT analyzers busy
+    capacity = (runner.LIMIT or os.cpu_count() or 1) // SHARD_SIZE + 1
+    running = set()
+    done = 0
+    while True:
+        claimed = None
+        if len(running) < capacity:
+            claimed = await loop.run_in_executor(None, transport.claim, worker)
+        if claimed is not None:
+            running.add(asyncio.ensure_future(_runShard(claimed[0], claimed[1], transport, worker)))
+            continue
+        if not running and (once or transport.closed()) and transport.pendingCount() == 0:
+            return done
+        if running:
+            finished, running = await asyncio.wait(running, timeout=POLL_INTERVAL, return_when=asyncio.FIRST_COMPLETED)
+            for task in finished:
+                done += task.result()
+        else:
+            await asyncio.sleep(POLL_INTERVAL)
+
+
+def work(spec, worker=None, once=False):
+    """
+    Worker loop: run shards from the transport at spec until it is closed (or, with once,
+    until nothing is pending). Analyzer limits and runner.LIMIT are this machine's settings.
+    """
+    worker = worker or "{}-{}".format(socket.gethostname(), os.getpid())
+    transport = openTransport(spec)
+    print("worker {} waiting for jobs on {}".format(worker, spec))
+    done = runner.call(_work(transport, worker, once))
+    print("worker {} ran {} jobs".format(worker, done))
+    return done
@@ -0,0 +1,272 @@
+import re
+import mmap
+
+# 三个工具输出的 DOT 都只用到了 DOT 语法的一个很小的子集：
+#   digraph 头、节点语句 `ID [k=v, ...]`、边语句 `ID[:port] -> ID[:port] [k=v]`、顶层 `k=v`
+# 这里用一个单遍的词法扫描直接得到节点和边，不再经过 pydot/pyparsing 构建完整的语法树。
+# 遇到子集之外的语法（subgraph、node/edge 默认属性、HTML 标签、预处理行等）时抛出
+# DotUnsupported，由调用方回退到 pydot，从而保证两条路径得到的结果完全一致。
+
+# 注释只能整条跳过：行注释必须读到行尾，块注释在第一个 */ 结束。
+# 否则回溯会从注释中间开始匹配（把 `// x y` 里的 y 读成节点），或让块注释越过 */ 吞掉后面的语句
+_COMMENT = rb'(?://[^\n]*(?![^\n])|/\*(?:[^*]|\*(?!/))*\*/)'
+
+# 记号之前的空白与注释在同一次匹配中跳过；直接在 bytes / mmap 上匹配，不先解码成 str
+_TOKEN_PATTERN = re.compile(rb"""
+    (?:\s+|""" + _COMMENT + rb""")*
+    (?:
+          (?P<str>"(?:[^"\\]|\\.)*")
+        | (?P<arrow>->)
+        | (?P<id>[A-Za-z_\x80-\xff][\w\x80-\xff]*|-?(?:\.\d+|\d+(?:\.\d*)?))
+        | (?P<punct>[{}\[\];,=:])
+        | (?P<eof>\Z)
+    )
+""", re.VERBOSE | re.DOTALL)
+
+# 绝大多数语句形如 `ID [attrs]` 或 `ID[:port] -> ID[:port] [attrs]`，用一次匹配读完整条语句；
+# 匹配不上（链式边、多个属性列表、语句内注释、图属性等）的语句交给逐记号的 _Reader 处理
+# 不带引号的 ID 后面不能紧跟 ID 字符，否则回溯会把 ID 截短后让语句照样匹配成功
+# （如 `a -> bc -> d` 被读成 a -> b），Python 3.8 还没有原子分组，用否定前瞻代替
+_ID = rb'(?:"(?:[^"\\]|\\.)*"|(?:[A-Za-z_\x80-\xff][\w\x80-\xff]*|-?(?:\.\d+|\d+(?:\.\d*)?))(?![\w\x80-\xff.]))'
+_SKIP = rb'(?:\s+|' + _COMMENT + rb'|;)*'
+_STATEMENT_PATTERN = re.compile(
+    _SKIP
+    + rb'(?P<src>' + _ID + rb'(?::' + _ID + rb')?)\s*'
+    + rb'(?:->\s*(?P<dst>' + _ID + rb'(?::' + _ID + rb')?)\s*)?'
+    + rb'(?:\[(?P<attrs>[^\]"/]*(?:"(?:[^"\\]|\\.)*"[^\]"/]*)*)\])?'
+    # 语句之后只能是下一条语句的开头（不以 - 或 . 开头的 ID）、; 、} 或结尾
+    + rb'(?=(?:\s+|' + _COMMENT + rb')*(?:[;}"A-Za-z_\x80-\xff\d]|\Z))',
+    re.DOTALL)
+_ATTR_PATTERN = re.compile(rb'[\s,;]*(?P<key>' + _ID + rb')(?:\s*=\s*(?P<val>' + _ID + rb'))?')
+_ATTR_END_PATTERN = re.compile(rb'[\s,;]*\Z')
+
+_UNSUPPORTED_KEYWORDS = {"node", "edge", "graph", "subgraph", "strict", "digraph"}
+_UNSUPPORTED_KEYWORDS_BYTES = {keyword.encode() for keyword in _UNSUPPORTED_KEYWORDS}
+
+# 每种方言真正需要保留的属性，其余属性只扫描不保存
+DIALECT_ATTRS = {
+    "wassail": ({"label"}, set()),
+    "wasma": ({"label"}, {"label"}),
+    "binaryen": ({"label", "debugLoc"}, set()),
+}
+
+
+class DotUnsupported(Exception):
+    """
+    输入超出了快速解析器支持的 DOT 子集
+    """
+
+
+def _tokens(buf, pos=0):
+    """
+    单遍扫描 DOT 内容（bytes 或 mmap），产生 (类型, 起点, 终点) 记号
+    标点与箭头的类型就是其本身（如 "[", "->"），其余为 "id" / "str" / "eof"；
+    记号内容只在需要时由 _Reader.text 解码
+    """
+    match = _TOKEN_PATTERN.match
+    while True:
+        m = match(buf, pos)
+        if m is None:
+            raise DotUnsupported(f"unexpected character at offset {pos}")
+        kind = m.lastgroup
+        start, pos = m.span(kind)
+        if kind == "punct":
+            kind = chr(buf[start])
+        elif kind == "arrow":
+            kind = "->"
+        yield kind, start, pos
+        if kind == "eof":
+            return
+
+
+class _Reader:
+    def __init__(self, buf, pos=0):
+        self.buf = buf
+        self._it = _tokens(buf, pos)
+        self._peek = next(self._it)
+
+    def peek(self):
+        return self._peek[0]
+
+    def position(self):
+        # 下一个记号的起点，之前的空白与注释已跳过
+        return self._peek[1]
+
+    def next(self):
+        tok = self._peek
+        if tok[0] != "eof":
+            self._peek = next(self._it)
+        return tok
+
+    def text(self, tok):
+        return self.buf[tok[1]:tok[2]].decode("utf-8")
+
+    def expect_id(self):
+        tok = self.next()
+        if tok[0] != "id" and tok[0] != "str":
+            raise DotUnsupported(f"expected ID at offset {tok[1]}")
+        return tok
+
+
+def _read_attrs(reader, keep):
+    """
+    读取零个或多个 [k=v, ...] 属性列表，只保留 keep 中列出的属性
+    属性值保持原样（带引号的字符串保留引号），与 pydot 的 get_attributes() 一致；
+    不保留的属性值不会被解码
+    """
+    attrs = {}
+    while reader.peek() == "[":
+        reader.next()
+        while True:
+            kind = reader.peek()
+            if kind == "]":
+                reader.next()
+                break
+            if kind == "," or kind == ";":
+                reader.next()
+                continue
+            key = reader.text(reader.expect_id())
+            val = True
+            if reader.peek() == "=":
+                reader.next()
+                val = reader.expect_id()
+                if key in keep:
+                    val = reader.text(val)
+            if key in keep:
+                attrs[key] = val
+    return attrs
+
+
+def _match_attrs(buf, start, end, keep):
+    """
+    解析单个属性列表 buf[start:end]（不含方括号），规则同 _read_attrs
+    列表不合法时返回 None，由调用方交给 _Reader 处理
+    """
+    attrs = {}
+    match = _ATTR_PATTERN.match
+    pos = start
+    while True:
+        m = match(buf, pos, end)
+        if m is None:
+            break
+        pos = m.end()
+        key = buf[m.start("key"):m.end("key")].decode("utf-8")
+        if key in keep:
+            val = m.start("val")
+            attrs[key] = True if val < 0 else buf[val:pos].decode("utf-8")
+    if _ATTR_END_PATTERN.match(buf, pos, end) is None:
+        return None
+    return attrs
+
+
+def _read_point(reader):
+    name = reader.text(reader.expect_id())
+    if reader.peek() == ":":
+        reader.next()
+        name += ":" + reader.text(reader.expect_id())
+        if reader.peek() == ":":
+            raise DotUnsupported("compass points are not supported")
+    return name
+
+
+def parse_dot(text, mark):
+    """
+    解析指定工具方言的 DOT 内容
+    :param text: DOT 内容，str、bytes 或 mmap 等支持缓冲区协议的对象
+    :param mark: 工具名，wassail / wasma / binaryen
+    :return: (nodes, edges)，nodes 为 [(name, attrs)]，edges 为 [(src, dst, attrs)]，
+             顺序与 pydot 的 get_nodes()/get_edges() 相同（同名节点、同端点的边相邻排列）
+    """
+    if isinstance(text, str):
+        text = text.encode("utf-8")
+    node_keep, edge_keep = DIALECT_ATTRS[mark]
+    reader = _Reader(text)
+    tok = reader.next()
+    if tok[0] != "id" or reader.text(tok).lower() != "digraph":
+        raise DotUnsupported("only a plain digraph is supported")
+    if reader.peek() in ("id", "str"):
+        reader.next()
+    if reader.next()[0] != "{":
+        raise DotUnsupported("expected '{'")
+
+    nodes = {}
+    edges = {}
+    # 同一个节点名在边语句中反复出现，按原始字节复用已解码的 str
+    names = {}
+    statement = _STATEMENT_PATTERN.match
+    pos = reader.position()
+    while True:
+        m = statement(text, pos)
+        if m is not None:
+            src = m.group("src")
+            dst = m.start("dst")
+            keep = edge_keep if dst >= 0 else node_keep
+            attrs = {}
+            if m.start("attrs") >= 0:
+                attrs = _match_attrs(text, m.start("attrs"), m.end("attrs"), keep)
+            # 关键字与带端口的节点语句同样交给 _Reader，由它给出 DotUnsupported
+            if (attrs is not None and src.lower() not in _UNSUPPORTED_KEYWORDS_BYTES
+                    and (dst >= 0 or b":" not in src)):
+                name = names.get(src)
+                if name is None:
+                    name = names[src] = src.decode("utf-8")
+                if dst >= 0:
+                    dst = m.group("dst")
+                    dst_name = names.get(dst)
+                    if dst_name is None:
+                        dst_name = names[dst] = dst.decode("utf-8")
+                    edges.setdefault((name, dst_name), []).append(attrs)
+                else:
+                    nodes.setdefault(name, []).append(attrs)
+                pos = m.end()
+                continue
+        # 快速匹配不适用的语句，逐记号读取
+        reader = _Reader(text, pos)
+        kind = reader.peek()
+        if kind == "}":
+            break
+        if kind == ";":
+            reader.next()
+            pos = reader.position()
+            continue
+        if kind != "id" and kind != "str":
+            raise DotUnsupported(f"unexpected token {kind!r}")
+        name = _read_point(reader)
+        if kind == "id" and name.lower() in _UNSUPPORTED_KEYWORDS:
+            raise DotUnsupported(f"keyword {name!r} is not supported")
+        if reader.peek() == "=":
+            # 顶层图属性，对构图没有影响
+            reader.next()
+            reader.expect_id()
+        elif reader.peek() == "->":
+            points = [name]
+            while reader.peek() == "->":
+                reader.next()
+                points.append(_read_point(reader))
+            attrs = _read_attrs(reader, edge_keep)
+            for src, dst in zip(points, points[1:]):
+                edges.setdefault((src, dst), []).append(attrs)
+        else:
+            if ":" in name:
+                raise DotUnsupported("node statements with ports are not supported")
+            nodes.setdefault(name, []).append(_read_attrs(reader, node_keep))
+        pos = reader.position()
+    return (
+        [(name, attrs) for name, attr_list in nodes.items() for attrs in attr_list],
+        [(src, dst, attrs) for (src, dst), attr_list in edges.items() for attrs in attr_list],
+    )
+
+
+def parse_dot_file(path, mark):
+    """
+    把 DOT 文件映射到内存后直接解析，见 parse_dot
+    文件内容不会整体读入或解码，只有保留下来的节点名、属性值会被解码成 str
+    """
+    with open(path, "rb") as f:
+        try:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # 空文件无法映射
+            return parse_dot(b"", mark)
+        with buf:
+            return parse_dot(buf, mark)
@@ -1,5 +1,33 @@
-import json
 import os
+import re
+import json
+import heapq
+import shutil
+import hashlib
+import itertools
+import lazy
+import results
+import tracing
+
+# asyncio is only needed once a document is compiled
+runner = lazy.module("runner")
+
+# 报告分三档（REPORT_TIERS）：
+#   summary  只生成索引文档：每个 case 的平均矩阵，以及全部 case 中分歧最大的 TOP_K 个函数
+#   top      另为每个 case 生成一份文档，只含该 case 中分歧最大的 TOP_K 个函数
+#   full     case 文档含全部函数
+# 分歧以函数 Frobenius 范数矩阵中的最大值衡量。索引为 output/result.tex，case 文档在
+# output/report/ 下，各自单独编译，编译在 runner 的事件循环上并行进行（受 --jobs 限制）。
+# 结果文件只流式读取一遍，文档边读边写；写出的 .tex 与上次内容相同且 PDF 还在时不再编译。
+REPORT_TIERS = ("summary", "top", "full")
+REPORT_TIER = "full"
+TOP_K = 20
+INDEX_FILE = "result.tex"
+REPORT_DIR = "report"
+# 上次写出的各文档内容哈希，键为相对 output 的路径
+REPORT_STAMPS = "report.json"
+PDFLATEX = "pdflatex"
+PDFLATEX_TIMEOUT = 600
 
 def recrusivePrint(path, indent=0):
     for item in path.iterdir():
@@ -11,12 +39,236 @@ def recrusivePrint(path, indent=0):
             print("目录:", item)
             recrusivePrint(item, indent + 1)
 
-def dump(path, output):
-    json_to_latex(path, output/"result.tex")
-    # 执行shell脚本
-    os.system("bash ./latexify.sh {}".format(output))
-    print("\nreport generated at {}".format(output))
-    
+def dump(path, output, tier=None, topK=None):
+    """
+    由结果文件 path 在 output 下生成报告并编译，tier 与 topK 默认取 REPORT_TIER 与 TOP_K
+    """
+    tier = tier or REPORT_TIER
+    topK = TOP_K if topK is None else topK
+    (output / REPORT_DIR).mkdir(parents=True, exist_ok=True)
+    stampFile = output / REPORT_DIR / REPORT_STAMPS
+    stamps = loadStamps(stampFile)
+    pdflatex = shutil.which(PDFLATEX) is not None
+    if not pdflatex:
+        print("{} not found, only the .tex files are written".format(PDFLATEX))
+    compiling = []
+
+    def finished(document):
+        # 文档写完即开始编译，与后面 case 的生成重叠
+        key = document.path.relative_to(output).as_posix()
+        stamps[key], stale = document.finish(stamps.get(key))
+        if stale and pdflatex:
+            compiling.append((key, runner.submit(compile_latex(document.path))))
+
+    with tracing.span("latex", "report", tier=tier) as attrs:
+        written = json_to_latex(path, output, tier, topK, finished)
+        attrs["documents"] = len(written)
+    if tier != "summary":
+        removeStale(output, stamps, written)
+    with tracing.span("pdflatex", "report") as attrs:
+        failed = 0
+        for key, future in compiling:
+            status, msg = future.result()
+            if not status:
+                failed += 1
+                stamps.pop(key, None)  # 下次重新编译
+                print(msg)
+        attrs["documents"] = len(compiling)
+        attrs["failed"] = failed
+    saveStamps(stampFile, stamps)
+    print("\nreport generated at {} ({} of {} documents compiled, {} failed)".format(
+        output / INDEX_FILE, len(compiling) - failed, len(written), failed))
+
+
+def loadStamps(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def saveStamps(path, stamps):
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(stamps, f, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def removeStale(output, stamps, written):
+    # 结果中已经没有的 case 的文档
+    for key in [key for key in stamps if key.startswith(REPORT_DIR + "/") and key not in written]:
+        texFile = output / key
+        for suffix in (".tex", ".pdf", ".log"):
+            texFile.with_suffix(suffix).unlink(missing_ok=True)
+        del stamps[key]
+
+
+async def compile_latex(texFile):
+    """
+    在 texFile 所在目录编译，返回 (status, msg)；失败时保留 .log 以便查看
+    """
+    argv = [PDFLATEX, "-interaction=nonstopmode", "-output-directory", texFile.parent, texFile]
+    status, msg, _, _ = await runner.run(argv, "pdflatex", timeout=PDFLATEX_TIMEOUT)
+    for suffix in (".aux", ".out") + ((".log",) if status else ()):
+        texFile.with_suffix(suffix).unlink(missing_ok=True)
+    if not status:
+        msg += "\nSee {}".format(texFile.with_suffix(".log"))
+    return status, msg
+
+
+def caseFileName(case):
+    """ case 名转换为文件名，改动过的名字附加哈希以免冲突 """
+    name = re.sub(r"[^A-Za-z0-9._-]+", "-", case).strip("-.")
+    if name != case:
+        name = "{}-{}".format(name, hashlib.sha1(case.encode("utf-8")).hexdigest()[:8])
+    return name
+
+
+def disagreement(record):
+    """ 函数记录的分歧程度：各工具两两之间 Frobenius 范数的最大值 """
+    return max((val for row in record["matrix"] for val in row), default=0.0)
+
+
+def pushTop(heap, k, item):
+    """ 在小顶堆 heap 中保留最大的 k 项 """
+    if len(heap) < k:
+        heapq.heappush(heap, item)
+    elif k > 0 and item > heap[0]:
+        heapq.heapreplace(heap, item)
+
+
+def texName(name):
+    return f"\\texttt{{\\detokenize{{{name}}}}}"
+
+
+def preamble(title):
+    return '\n'.join([
+        "\\documentclass{article}", "\\usepackage{booktabs}", "\\usepackage{float}", "\\usepackage{hyperref}",
+        "\\begin{document}", f"\\title{{{title}}}", "\\author{}", "\\date{}", "\\maketitle"
+    ])
+
+
+class Document:
+    """
+    边生成边写入的 LaTeX 文档：先写到临时文件，同时计算内容哈希
+    """
+    def __init__(self, path):
+        self.path = path
+        self.tmp = path.with_name(path.name + ".tmp")
+        self.file = open(self.tmp, "w", encoding="utf-8")
+        self.hash = hashlib.sha256()
+
+    def write(self, text):
+        self.file.write(text)
+        self.hash.update(text.encode("utf-8"))
+
+    def finish(self, stamp):
+        """
+        与上次的哈希 stamp 比较，内容有变化或 PDF 不在时才替换 .tex
+        :return: (本次的哈希, 是否需要编译)
+        """
+        self.file.write("\n\\end{document}\n")
+        self.file.close()
+        digest = self.hash.hexdigest()
+        if digest == stamp and self.path.with_suffix(".pdf").exists():
+            os.unlink(self.tmp)
+            return digest, False
+        os.replace(self.tmp, self.path)
+        return digest, True
+
+
+class Report:
+    """
+    按结果记录的顺序生成索引和 case 文档，同一时刻只有一个 case 的文档是打开的；
+    内存中只保留各个 top-K 堆
+    """
+    def __init__(self, output, tier, topK, finished):
+        self.output = output
+        self.tier = tier
+        self.topK = topK
+        self.finished = finished
+        self.tools = []
+        self.order = itertools.count(0, -1)  # 分数相同时先出现的优先，堆中也就不会比较记录本身
+        self.worst = []  # 全部 case 中分歧最大的函数 (score, order, case, index)
+        self.top = []  # 当前 case 中分歧最大的函数 (score, order, record)
+        self.case = None
+        self.document = None
+        self.written = set()
+        self.index = Document(output / INDEX_FILE)
+        self.index.write(preamble("Graph Similarity Analysis"))
+
+    def add(self, record):
+        if record["type"] == "header":
+            self.tools = record["tools"]
+        elif record["type"] == "function":
+            if record["case"] != self.case:
+                self.endCase()
+                self.startCase(record["case"])
+            self.addFunction(record)
+        elif record["type"] == "case":
+            if record["case"] != self.case:
+                # 没有函数的 case
+                self.endCase()
+                self.startCase(record["case"])
+            self.endCase(record)
+
+    def startCase(self, case):
+        self.case = case
+        self.top = []
+        if self.tier != "summary":
+            self.document = Document(self.output / REPORT_DIR / (caseFileName(case) + ".tex"))
+            self.document.write(preamble(f"Case {texName(case)}"))
+            self.document.write("\n\\section{Functions}")
+
+    def addFunction(self, record):
+        score = disagreement(record)
+        pushTop(self.worst, self.topK, (score, next(self.order), self.case, record["index"]))
+        if self.tier == "full":
+            self.document.write(functionTable(record, self.tools, self.case))
+        elif self.tier == "top":
+            pushTop(self.top, self.topK, (score, next(self.order), record))
+
+    def endCase(self, record=None):
+        """
+        record 为 case 记录；结果文件在 case 中途截断时为 None，此时没有平均值
+        """
+        if self.case is None:
+            return
+        case = self.case
+        self.index.write(f"\n\\section{{Case: {texName(case)} }}")
+        if record is None:
+            self.index.write("\nIncomplete: the evaluation of this case did not finish.")
+        else:
+            self.index.write(f"\n{record['functions']} functions.")
+            for tool, counts in sorted(record.get("outcomes", {}).items()):
+                failures = ", ".join(f"{n} {outcome}" for outcome, n in sorted(counts.items()))
+                self.index.write(f"\n\n{tool} runs failed: {failures}.")
+        if self.document is not None:
+            name = self.document.path.with_suffix(".pdf").relative_to(self.output).as_posix()
+            self.index.write(f"\n\n\\href{{run:{name}}}{{{texName(name)}}}")
+            if self.tier == "top":
+                for score, _, function in sorted(self.top, reverse=True):
+                    self.document.write(functionTable(function, self.tools, case, score))
+        if record is not None:
+            tables = averageTables(record, self.tools, case)
+            self.index.write(tables)
+            if self.document is not None:
+                self.document.write("\n\\section{Average}" + tables)
+        if self.document is not None:
+            self.finished(self.document)
+            self.written.add(self.document.path.relative_to(self.output).as_posix())
+        self.case = None
+        self.document = None
+
+    def close(self):
+        self.endCase()
+        if self.worst:
+            self.index.write("\n\\section{Largest disagreements}")
+            self.index.write("\n" + worstTable(sorted(self.worst, reverse=True)))
+        self.finished(self.index)
+        self.written.add(INDEX_FILE)
+        return self.written
 
 
 # def latexify(path): 
@@ -38,35 +290,40 @@ def dump(path, output):
 #         print("\\\\")
 
 
-def json_to_latex(json_file, output_file):
-    with open(json_file, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    
-    tools = data["tools"]
-    cases = data["cases"]
-    
-    latex_output = [
-        "\\documentclass{article}", "\\usepackage{booktabs}", "\\usepackage{float}", "\\begin{document}",
-        "\\title{Graph Similarity Analysis}", "\\author{}", "\\date{}", "\\maketitle"
-    ]
-    
-    for case in cases:
-        latex_output.append(f"\\section{{Case: \\texttt{{\\detokenize{{{case['case']}}}}} }}")
-        
-        for func in case["functions"]:
-            func_index = func["index"]
-            matrix = func["matrix"]
-            latex_output.append(f"\\subsection{{Function {func_index}}}")
-            latex_output.append(matrix_to_latex(matrix, tools, f"Frobenius Norm for Function {func_index} in \\texttt{{\\detokenize{{{case['case']}}}}}"))
-        
-        # 添加平均相似度矩阵
-        latex_output.append("\\subsection{Average}")
-        latex_output.append(matrix_to_latex(case["average"], tools, f"Average Frobenius Norm for \\texttt{{\\detokenize{{{case['case']}}}}}"))
-    
-    latex_output.append("\\end{document}")
-    
-    with open(output_file, 'w', encoding='utf-8') as f:
-        f.write('\n'.join(latex_output))
+def json_to_latex(json_file, output, tier, topK, finished):
+    """
+    流式读取结果文件并逐条写出 LaTeX，内存占用与函数数量无关
+    每写完一份文档调用 finished(document)；返回写出的文档（相对 output 的路径）
+    """
+    report = Report(output, tier, topK, finished)
+    for record in results.readResults(json_file):
+        report.add(record)
+    return report.close()
+
+
+def functionTable(record, tools, case, score=None):
+    func_index = record["index"]
+    title = f"Function {func_index}" if score is None else f"Function {func_index} (largest distance {score:.4f})"
+    return (f"\n\\subsection{{{title}}}"
+            + "\n" + matrix_to_latex(record["matrix"], tools, f"Frobenius Norm for Function {func_index} in {texName(case)}"))
+
+
+def averageTables(record, tools, case):
+    tables = "\n" + matrix_to_latex(record["average"], tools, f"Average Frobenius Norm for {texName(case)}")
+    for name, matrix in record.get("metrics", {}).items():
+        metric = name.replace("_", " ").title()
+        tables += "\n" + matrix_to_latex(matrix, tools, f"Average {metric} (column: reference tool) for {texName(case)}")
+    return tables
+
+
+def worstTable(worst):
+    table = ["\\begin{table}[H]", "    \\centering", "    \\begin{tabular}{llc}", "        \\toprule",
+             "        Case & Function & Largest distance \\\\", "        \\midrule"]
+    for score, _, case, index in worst:
+        table.append(f"        {texName(case)} & {index} & {score:.4f} \\\\")
+    table += ["        \\bottomrule", "    \\end{tabular}",
+              "    \\caption{Functions with the largest Frobenius norm between two tools}", "\\end{table}"]
+    return '\n'.join(table)
 
 def matrix_to_latex(matrix, tools, caption):
     """ 将矩阵转换为 LaTeX 表格格式 """
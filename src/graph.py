@@ -1,16 +1,38 @@
 import re
-import pydot
+import sys
+import math
+import array
+import dotparse
+import tracing
 import itertools
 import numpy as np
-import networkx as nx
-import concurrent.futures
+
+WASSAIL_INSTR_PATTERN = re.compile(r"<instr\d+>(\d+:[^<\\\|]+)")  # 匹配 `<instrX>` 及指令内容
+WASSAIL_EDGE_PATTERN = re.compile(r"block\d+:instr(\d+) -> block\d+:instr(\d+)")  # 匹配边
+WASMA_NODE_PATTERN = re.compile(r"\"#\d+\+(\d+):(.*?)\"")  # 匹配节点
+WASMA_LOCAL_PATTERN = re.compile(r"\"#\d+: \((local|param|global) (.*?)\)\"")  # 匹配 local变量
+WASMA_EDGE_PATTERN = re.compile(r"(\d+) -> (\d+)")  # 匹配边
+WASMOPT_DEBUGLOC_PATTERN = re.compile(r"\".*?\| Line: (\d+) \|.*?\"")  # 匹配 debugLoc
+
+# wasma 中一个读 local 的节点对应多个候选定义、无法唯一确定时的处理方式：
+# "skip" 不连边（与论文结果一致），"all" 连到所有候选定义
+WASMA_AMBIGUOUS_DEFS = "skip"
+
+# 后继达到这个数目的节点另建一个后继集合，之后的去重判断为 O(1)
+FANOUT_SET_MIN = 16
 
 class Graph:
+    __slots__ = ("adj_list", "node_count", "orignate", "_fanout")
+
     def __init__(self, count=0, origin=""):
         """
         初始化一个空的邻接表图
         """
-        self.adj_list = {}  # 邻接表，key: 节点ID, value: (label, [依赖的目标节点列表])
+        # 邻接表，key: 节点ID, value: (label, [依赖的目标节点列表])，后继保持插入顺序
+        self.adj_list = {}
+        # 高扇出节点 ID -> 其后继集合，与列表内容一致；绝大多数节点只有几个后继，
+        # 只用列表，比每个节点一个 dict 省内存。除追加之外修改了后继列表时要删掉对应的项
+        self._fanout = {}
         self.node_count = count
         self.orignate = origin
 
@@ -27,37 +49,102 @@ class Graph:
         """
         添加一个新节点
         :param id: 节点的唯一标识
-        :param label: 节点的指令信息
+        :param label: 节点的指令信息，同一指令文本在所有图之间共享一份字符串
         """
         if id not in self.adj_list:
+            if type(label) is str:
+                label = sys.intern(label)
             self.adj_list[id] = (label, [])
 
     def add_edge(self, from_id, to_id):
         """
-        添加一条数据依赖边
+        添加一条数据依赖边，均摊 O(1)（后继少时在短列表中查重）
         :param from_id: 依赖的起始节点 ID
         :param to_id: 目标节点 ID
         """
-        if from_id in self.adj_list and to_id in self.adj_list:
-            if to_id not in self.adj_list[from_id][1]:
-                self.adj_list[from_id][1].append(to_id)
+        adj_list = self.adj_list
+        if from_id in adj_list and to_id in adj_list:
+            to_ids = adj_list[from_id][1]
+            if len(to_ids) < FANOUT_SET_MIN:
+                if to_id not in to_ids:
+                    to_ids.append(to_id)
+            else:
+                self._append(from_id, to_ids, to_id)
+
+    def add_edges(self, edges):
+        """
+        批量添加数据依赖边
+        :param edges: (from_id, to_id) 的可迭代对象
+        """
+        adj_list = self.adj_list
+        for from_id, to_id in edges:
+            if from_id in adj_list and to_id in adj_list:
+                to_ids = adj_list[from_id][1]
+                if len(to_ids) < FANOUT_SET_MIN:
+                    if to_id not in to_ids:
+                        to_ids.append(to_id)
+                else:
+                    self._append(from_id, to_ids, to_id)
 
-    def simplify(self):
+    def _append(self, from_id, to_ids, to_id):
+        seen = self._fanout.get(from_id)
+        if seen is None:
+            seen = self._fanout[from_id] = set(to_ids)
+        if to_id not in seen:
+            seen.add(to_id)
+            to_ids.append(to_id)
+
+    def successors(self, id):
+        """
+        按插入顺序返回节点的后继列表
+        """
+        return list(self.adj_list[id][1])
+
+    def simplify(self, transitive=False):
         """
         简化图,去除多余依赖关系，如 A -> B, B -> C,A -> C, 则去除 A -> C
+        :param transitive: 为 False 时只去除一跳的捷径边；为 True 时做完整的传递规约，
+                           见 transitive_reduction
         """
-        for from_id, (_, to_ids) in self.adj_list.items():
-            to_ids_copy = to_ids.copy()
-            for to_id in to_ids_copy:
-                for to_id2 in to_ids_copy:
-                    if to_id != to_id2 and to_id2 in self.adj_list[to_id][1]:
-                        self.adj_list[from_id][1].remove(to_id2)
+        if transitive:
+            reduced = transitive_reduction(self.freeze())
+            for from_id, (_, to_ids) in self.adj_list.items():
+                to_ids.clear()
+            self._fanout.clear()
+            self.add_edges(reduced.get_edges())
+            return self
+        adj_list = self.adj_list
+        fanout = self._fanout
+        for from_id, (_, to_ids) in adj_list.items():
+            if len(to_ids) < 2:
+                continue
+            removed = set()
+            for to_id in to_ids:
+                if to_id == from_id:
+                    # 自环：from_id 的每个其他后继都经由自身可达
+                    removed.update(to_id2 for to_id2 in to_ids if to_id2 != from_id)
+                    continue
+                succ = fanout.get(to_id) or adj_list[to_id][1]
+                for to_id2 in to_ids:
+                    if to_id != to_id2 and to_id2 in succ:
+                        removed.add(to_id2)
+            if removed:
+                to_ids[:] = [to_id for to_id in to_ids if to_id not in removed]
+                fanout.pop(from_id, None)
         return self
-    
+
+    def freeze(self):
+        """
+        冻结为紧凑的 CSR 形式，供比较等只读阶段使用
+        :return: FrozenGraph 对象
+        """
+        return FrozenGraph(self)
+
     def to_NetworkX(self):
         """
         转换为 NetworkX 图对象, 邻接矩阵形式
         """
+        import networkx as nx  # 只有这里用到，按需导入
         # 首先创建一个空的有向图，结点数量为 self.node_count
         G = nx.DiGraph()
         G.add_nodes_from(range(self.node_count))
@@ -87,6 +174,283 @@ class Graph:
         return f"Graph({len(self.adj_list)} nodes)"
     
 
+# CSR 下标数组的类型：C int，32 位
+INDEX_TYPECODE = "i"
+
+def compact_ids(ids):
+    """
+    节点 ID 全为 int 时存为 int64 数组，否则（wasm-opt 的字符串 ID）保持列表
+    """
+    if all(type(id) is int for id in ids):
+        try:
+            return array.array("q", ids)
+        except OverflowError:
+            pass
+    return ids
+
+class FrozenGraph:
+    """
+    只读的紧凑图表示（CSR）：
+    ids[i] 为第 i 个节点的 ID，labels[i] 为其指令，
+    indices[indptr[i]:indptr[i+1]] 为其后继节点在 ids 中的下标
+    ID 到下标的映射 index 只在用到时构建
+    """
+    __slots__ = ("ids", "labels", "indptr", "indices", "node_count", "orignate", "_index")
+
+    def __init__(self, graph: Graph):
+        ids = list(graph.adj_list)
+        lookup = {id: i for i, id in enumerate(ids)}.__getitem__
+        self.labels = [label for label, _ in graph.adj_list.values()]
+        indptr = array.array(INDEX_TYPECODE, [0])
+        indices = array.array(INDEX_TYPECODE)
+        for _, to_ids in graph.adj_list.values():
+            indices.extend(map(lookup, to_ids))
+            indptr.append(len(indices))
+        self.indptr = indptr
+        self.indices = indices
+        self.ids = compact_ids(ids)
+        self._index = None
+        self.node_count = graph.node_count
+        self.orignate = graph.orignate
+
+    @property
+    def index(self):
+        """
+        节点 ID 到下标的映射，按需构建
+        """
+        if self._index is None:
+            self._index = {id: i for i, id in enumerate(self.ids)}
+        return self._index
+
+    def __len__(self):
+        return len(self.ids)
+
+    def edge_count(self):
+        return len(self.indices)
+
+    def successor_positions(self, i):
+        return self.indices[self.indptr[i]:self.indptr[i + 1]]
+
+    def get_edges(self):
+        ids = self.ids
+        indptr = self.indptr
+        indices = self.indices
+        for i, from_id in enumerate(ids):
+            for k in range(indptr[i], indptr[i + 1]):
+                yield from_id, ids[indices[k]]
+
+    def save(self, file):
+        """
+        以 .npz 格式写出：节点 ID 与 CSR 数组原样保存，指令只保存一份去重后的表和每个节点的下标
+        只支持整数节点 ID；node_count 与来源由 load 的调用方给出
+        """
+        table = {}
+        positions = [table.setdefault(label, len(table)) for label in self.labels]
+        np.savez(
+            file,
+            ids=np.array(self.ids, dtype=np.int64),
+            labels=np.array(list(table), dtype=str),
+            label_index=np.array(positions, dtype=np.int32),
+            indptr=np.frombuffer(self.indptr, dtype=np.int32),
+            indices=np.frombuffer(self.indices, dtype=np.int32),
+        )
+
+    @classmethod
+    def load(cls, file, count=0, origin=""):
+        """
+        读取 save 写出的图
+        """
+        with np.load(file, allow_pickle=False) as data:
+            table = [sys.intern(label) for label in data["labels"].tolist()]
+            ret = cls.__new__(cls)
+            ret.ids = array.array("q", data["ids"].astype(np.int64).tobytes())
+            ret.labels = [table[i] for i in data["label_index"].tolist()]
+            ret.indptr = array.array(INDEX_TYPECODE, data["indptr"].astype(np.int32).tobytes())
+            ret.indices = array.array(INDEX_TYPECODE, data["indices"].astype(np.int32).tobytes())
+        ret._index = None
+        ret.node_count = count
+        ret.orignate = origin
+        return ret
+
+    def thaw(self):
+        """
+        还原为可修改的 Graph 对象
+        """
+        ret = Graph(self.node_count, self.orignate)
+        for id, label in zip(self.ids, self.labels):
+            ret.add_node(id, label)
+        ret.add_edges(self.get_edges())
+        return ret
+
+    def __repr__(self):
+        return f"FrozenGraph({len(self.ids)} nodes, {len(self.indices)} edges)"
+
+
+def strongly_connected_components(frozen: FrozenGraph, active=None):
+    """
+    迭代版 Tarjan 算法求强连通分量，不受递归深度限制
+    :param frozen: FrozenGraph 对象
+    :param active: 可选，active[i] 为 False 的节点及其边被忽略（只在其余节点的导出子图上求分量）
+    :return: (comp, count)，comp[i] 为节点 i 所在分量的编号，被忽略的节点为 -1；
+             分量按逆拓扑序编号，即若分量 a 能到达分量 b (a != b)，则 a > b
+    """
+    n = len(frozen.ids)
+    indptr = frozen.indptr
+    indices = frozen.indices
+    order = [-1] * n  # 访问序号
+    low = [0] * n
+    comp = [-1] * n
+    on_stack = [False] * n
+    stack = []
+    count = 0
+    counter = 0
+    for root in range(n):
+        if order[root] != -1 or (active is not None and not active[root]):
+            continue
+        # 调用栈元素：(节点, 下一个待访问的后继位置)
+        call = [(root, indptr[root])]
+        order[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack[root] = True
+        while call:
+            v, k = call[-1]
+            if k < indptr[v + 1]:
+                call[-1] = (v, k + 1)
+                w = indices[k]
+                if active is not None and not active[w]:
+                    continue
+                if order[w] == -1:
+                    order[w] = low[w] = counter
+                    counter += 1
+                    stack.append(w)
+                    on_stack[w] = True
+                    call.append((w, indptr[w]))
+                elif on_stack[w] and order[w] < low[v]:
+                    low[v] = order[w]
+                continue
+            call.pop()
+            if call:
+                parent = call[-1][0]
+                if low[v] < low[parent]:
+                    low[parent] = low[v]
+            if low[v] == order[v]:
+                while True:
+                    w = stack.pop()
+                    on_stack[w] = False
+                    comp[w] = count
+                    if w == v:
+                        break
+                count += 1
+    return comp, count
+
+def transitive_reduction(frozen: FrozenGraph) -> FrozenGraph:
+    """
+    传递规约：去除所有能由其他路径推出的边，A -> B -> ... -> C 存在时去除 A -> C
+    环（如循环产生的依赖）先按强连通分量缩点，分量内部的边原样保留，
+    分量之间的边在缩点后的 DAG 上按拓扑序规约，可达集合用 Python 整数做位集合，
+    整体代价约为 O(V + E · V / 字长)
+    :param frozen: FrozenGraph 对象
+    :return: 规约后的 FrozenGraph
+    """
+    comp, count = strongly_connected_components(frozen)
+    indptr = frozen.indptr
+    indices = frozen.indices
+    n = len(frozen.ids)
+    # 缩点后的后继分量
+    comp_succ = [set() for _ in range(count)]
+    for v in range(n):
+        cv = comp[v]
+        for k in range(indptr[v], indptr[v + 1]):
+            cw = comp[indices[k]]
+            if cw != cv:
+                comp_succ[cv].add(cw)
+    # 编号小的分量先处理，保证后继分量的闭包已经算好
+    closure = [0] * count
+    kept = [None] * count
+    for c in range(count):
+        reach = 0
+        kept_c = set()
+        # 按拓扑序由近及远访问后继：编号越大越靠近 c
+        for d in sorted(comp_succ[c], reverse=True):
+            if not (reach >> d) & 1:
+                kept_c.add(d)
+                reach |= closure[d]
+        closure[c] = reach | (1 << c)
+        kept[c] = kept_c
+    ret = Graph(frozen.node_count, frozen.orignate)
+    for id, label in zip(frozen.ids, frozen.labels):
+        ret.add_node(id, label)
+    ids = frozen.ids
+    for v in range(n):
+        cv = comp[v]
+        for k in range(indptr[v], indptr[v + 1]):
+            w = indices[k]
+            cw = comp[w]
+            if cw == cv or cw in kept[cv]:
+                ret.add_edge(ids[v], ids[w])
+    return ret.freeze()
+
+def debug_frontiers(frozen: FrozenGraph, located: list) -> list:
+    """
+    对每个节点求最近的带 debugLoc 的后继：只经过不带 debugLoc 的节点能到达的第一批带 debugLoc 的节点
+    不带 debugLoc 的节点先按强连通分量缩点（phi 等形成的环），每个分量的结果只算一次并被所有源节点共用，
+    不再从每个源节点出发枚举路径
+    :param frozen: FrozenGraph 对象
+    :param located: located[i] 为 True 表示节点 i 带 debugLoc
+    :return: 列表，第 i 项为节点 i 的最近带 debugLoc 后继的位置集合（frozenset）
+    """
+    comp, count = strongly_connected_components(frozen, [not x for x in located])
+    indptr = frozen.indptr
+    indices = frozen.indices
+    members = [[] for _ in range(count)]
+    for v, c in enumerate(comp):
+        if c >= 0:
+            members[c].append(v)
+
+    def gather(nodes, own):
+        # 直接后继中带 debugLoc 的节点，加上其余后继所在分量（已算好）的结果
+        direct = set()
+        shared = {}
+        for v in nodes:
+            for k in range(indptr[v], indptr[v + 1]):
+                w = indices[k]
+                if located[w]:
+                    direct.add(w)
+                elif comp[w] != own:
+                    part = comp_frontier[comp[w]]
+                    shared[id(part)] = part
+        if not direct and len(shared) == 1:
+            return next(iter(shared.values()))
+        return frozenset(direct).union(*shared.values())
+
+    # 编号小的分量先处理，保证后继分量的结果已经算好
+    comp_frontier = [None] * count
+    for c in range(count):
+        comp_frontier[c] = gather(members[c], c)
+    return [gather((v,), -1) if located[v] else comp_frontier[comp[v]] for v in range(len(comp))]
+
+def collapse_debug_locations(tmp: Graph, debugLocMap: dict, ret: Graph) -> Graph:
+    """
+    把 wasm-opt 的数据流图收缩到带 debugLoc 的节点上：节点编号取 debugLoc 行号，
+    A 到 B 有边当且仅当 B 是 A 最近的带 debugLoc 的后继，同一行号之间的边（自反）被去掉
+    边按节点在 tmp 中的顺序加入，结果与集合的哈希顺序无关
+    """
+    frozen = tmp.freeze()
+    ids = frozen.ids
+    labels = frozen.labels
+    lines = [debugLocMap.get(id) for id in ids]
+    frontiers = debug_frontiers(frozen, [line is not None for line in lines])
+    for v, line in enumerate(lines):
+        if line is None:
+            continue
+        ret.add_node(int(line), labels[v])
+        for w in sorted(frontiers[v]):
+            if line != lines[w]:  # 避免自反
+                ret.add_node(int(lines[w]), labels[w])
+                ret.add_edge(int(line), int(lines[w]))
+    return ret
+
 def build_graph_from_dot(dot_str, mark):
     if mark == "wassail":
         return build_graph_from_dot_wassail(dot_str)
@@ -103,97 +467,112 @@ def extract_all_instr_from_label(label):
     :param label: DOT 节点的 label 字符串
     :return: 纯指令列表 [指令1, 指令2, ...]
     """
-    pattern = r"<instr\d+>(\d+:[^<\\\|]+)"  # 匹配 `<instrX>` 及指令内容
-    return [instr.strip() for instr in re.findall(pattern, label)]  
+    return [instr.strip() for instr in WASSAIL_INSTR_PATTERN.findall(label)]
 
 
-def merge_local_get_set(graph: Graph) -> Graph:
+def load_dot(dot, mark):
+    """
+    读取工具输出的 DOT 文件，得到节点与边
+    优先使用 dotparse 中针对各工具方言的单遍解析器，超出其支持范围时回退到 pydot
+    :param dot: DOT 文件路径
+    :param mark: 工具名，wassail / wasma / binaryen
+    :return: (nodes, edges)，nodes 为 [(name, attrs)]，edges 为 [(src, dst, attrs)]
+    """
+    with tracing.span("parse", "graph", tool=mark) as attrs:
+        try:
+            nodes, edges = dotparse.parse_dot_file(dot, mark)
+        except dotparse.DotUnsupported:
+            attrs["fallback"] = True
+            import pydot  # 只在回退时导入，pyparsing 的加载开销不小
+            graph = pydot.graph_from_dot_file(dot)[0]
+            nodes = [(node.get_name(), node.get_attributes()) for node in graph.get_nodes()]
+            edges = [(edge.get_source(), edge.get_destination(), edge.get_attributes()) for edge in graph.get_edges()]
+        attrs["nodes"] = len(nodes)
+        attrs["edges"] = len(edges)
+        return nodes, edges
+
+
+def merge_local_get_set(graph) -> Graph:
     """
     合并 local.get 和 local.set 指令
-    :param graph: Graph 对象
+    :param graph: Graph 或 FrozenGraph 对象
     :return: 合并后的 Graph 对象
     """
     # 合并示例：
     # local.get $0 -> local.set $0 -> instr1 合并为 local.get $0 -> instr1
-    # 定义一个映射表，用于存储每一句 local.get或local.set 和其最终的值
-    local_map = {}
-    # 遍历图的每个节点
-    for node_id, _ in graph.adj_list.items():
-        merge_local_get_set_helper(graph, node_id, local_map)
-    # print(local_map)
-    # 利用映射表更新图
-    res = Graph(graph.node_count, graph.orignate)
-    # 添加节点
-    for node_id, (label, _) in graph.adj_list.items():
-        if node_id in local_map:
-            if local_map[node_id] == node_id:
-                res.add_node(node_id, label)
-            else:
-                continue
-        else:
+    frozen = graph.freeze() if isinstance(graph, Graph) else graph
+    # forward[i] 为节点 i 合并后的代表节点下标，-1 表示节点 i 没有参与合并
+    forward = local_forwarding_table(frozen)
+    ids = frozen.ids
+    indptr = frozen.indptr
+    indices = frozen.indices
+    res = Graph(frozen.node_count, frozen.orignate)
+    # 添加节点：参与合并的节点只保留代表节点
+    for i, (node_id, label) in enumerate(zip(ids, frozen.labels)):
+        if forward[i] == -1 or forward[i] == i:
             res.add_node(node_id, label)
-    # 添加边
-    for node_id, (_, to_ids) in graph.adj_list.items():
-        if node_id in res.adj_list:
-            for to_id in to_ids:
-                if to_id in local_map:
-                    res.add_edge(node_id, local_map[to_id])
-                res.add_edge(node_id, to_id)
+    # 添加边：指向被合并节点的边同时连到其代表节点
+    adj_list = res.adj_list
+
+    def edges():
+        for i, node_id in enumerate(ids):
+            if node_id not in adj_list:
+                continue
+            for k in range(indptr[i], indptr[i + 1]):
+                w = indices[k]
+                if forward[w] != -1:
+                    yield node_id, ids[forward[w]]
+                yield node_id, ids[w]
+
+    res.add_edges(edges())
     return res
 
-# def merge_local_get_set_helper(graph: Graph, node_id: int, local_map: dict) -> int:
-#     # 如果节点不是 local.get 或 local.set, 直接返回
-#     if "local.get" not in graph.adj_list[node_id][0] and "local.set" not in graph.adj_list[node_id][0]:
-#         return node_id
-#     # 如果节点是 local.get 或 local.set, 先判断是否已经合并过
-#     if node_id in local_map:
-#         return local_map[node_id]
-#     else:
-#         # 如果没有后继节点, 直接返回
-#         if not graph.adj_list[node_id][1]:
-#             local_map[node_id] = node_id
-#             return node_id
-#         # 如果有后继节点, 合并后继节点
-#         res = merge_local_get_set_helper(graph, graph.adj_list[node_id][1][0], local_map)
-#         local_map[node_id] = res
-#         return res
-
-def merge_local_get_set_helper(graph: Graph, node_id: int, local_map: dict):
-    path = []
-    current = node_id
-
-    # 迭代找最终合并目标
-    while True:
-        # 检查path中是否有当前节点，如果有，说明有环，直接返回
-        if current in path:
-            for node in path:
-                local_map[node] = node
-        label, successors = graph.adj_list[current]
-        if "local.get" not in label and "local.set" not in label:
-            break
-        if current in local_map:
-            current = local_map[current]
-            break
-        path.append(current)
-        if not successors:
-            break
-        current = successors[0]
-
-    # 路径压缩
-    for node in path:
-        local_map[node] = current
+def local_forwarding_table(frozen: FrozenGraph):
+    """
+    沿 local.get / local.set 的第一个后继向下合并，求每个节点的代表节点
+    代表节点为链上遇到的第一个非 local 指令、没有后继的 local 指令，或链成环时的入环节点。
+    每个节点只会进入一次路径，路径上的节点直接指向最终代表（路径压缩），整体 O(V + E)
+    :param frozen: FrozenGraph 对象
+    :return: forward 列表，forward[i] 为代表节点下标，未参与合并的节点为 -1
+    """
+    ON_PATH = -2
+    n = len(frozen.ids)
+    indptr = frozen.indptr
+    indices = frozen.indices
+    is_local = ["local.get" in label or "local.set" in label for label in frozen.labels]
+    forward = [-1] * n
+    for start in range(n):
+        path = []
+        current = start
+        while True:
+            state = forward[current]
+            if state == ON_PATH:
+                # 成环，入环节点即为代表
+                break
+            if not is_local[current]:
+                break
+            if state != -1:
+                current = state
+                break
+            path.append(current)
+            forward[current] = ON_PATH
+            if indptr[current] == indptr[current + 1]:
+                break
+            current = indices[indptr[current]]
+        # 路径压缩
+        for node in path:
+            forward[node] = current
+    return forward
 
-    
-    
 def build_graph_from_dot_wassail(dot, count=0):
     """
     从 wassail 的输出中构建数据依赖图
     """
     ret = Graph(count, dot)
     try:
-        graph = pydot.graph_from_dot_file(dot)[0]  # 解析 DOT 图
-        for node in graph.get_nodes():
-            insList = extract_all_instr_from_label(node.get_label())  # 提取节点指令
+        nodes, edges = load_dot(dot, "wassail")  # 解析 DOT 图
+        for _, attrs in nodes:
+            insList = extract_all_instr_from_label(attrs.get("label"))  # 提取节点指令
             for instr in insList:
                 instrTuple = instr.split(":")
                 if len(instrTuple) != 2:
@@ -201,9 +580,8 @@ def build_graph_from_dot_wassail(dot, count=0):
                 if instrTuple[1].strip() == "return": # 跳过 return 指令
                     continue
                 ret.add_node(int(instrTuple[0].strip()), instrTuple[1].strip())  # 添加节点
-        for edge in graph.get_edges():
-            pattern = r"block\d+:instr(\d+) -> block\d+:instr(\d+)"  # 匹配边
-            match = re.match(pattern, edge.get_source() + " -> " + edge.get_destination())
+        for src, dst, _ in edges:
+            match = WASSAIL_EDGE_PATTERN.match(src + " -> " + dst)
             if match:
                 from_id, to_id = match.groups()
                 ret.add_edge(int(from_id), int(to_id))  # 添加边
@@ -211,7 +589,8 @@ def build_graph_from_dot_wassail(dot, count=0):
         print(f"Error parsing DOT file: {e}")
         return Graph(count, dot)  # 返回空图
     
-    return merge_local_get_set(ret) 
+    with tracing.span("merge", "graph", tool="wassail") as attrs:
+        return tracing.graphCounts(attrs, merge_local_get_set(ret))
 
 
 def build_graph_from_dot_wasma(dot, count=0):
@@ -220,9 +599,7 @@ def build_graph_from_dot_wasma(dot, count=0):
     """
     ret = Graph(count, dot)
     try: 
-        graph = pydot.graph_from_dot_file(dot)[0]  # 解析 DOT 图
-        nodePattern = r"\"#\d+\+(\d+):(.*?)\""  # 匹配节点
-        localPattern = r"\"#\d+: \((local|param|global) (.*?)\)\""  # 匹配 local变量
+        nodes, edges = load_dot(dot, "wasma")  # 解析 DOT 图
         localMap = {}  # local变量映射表,key: local变量名, value: ([前驱节点列表],[后继节点列表])
         weightMap = {}  # 权重映射表,key: (from_id, to_id), value: weight
         # 规则：
@@ -232,32 +609,35 @@ def build_graph_from_dot_wasma(dot, count=0):
         #   如果与L0相连的边上有权重，按照权重相等来传递，若无，按照间接边上的权来传递，如 a ->(va) local.set 01 ->(va) L0 -> local.get 0 ->(va) b
         #   如果无法判断，报错
         # 4. 多对多，需对于每个local.get都要进行多对1的判断
-        for node in graph.get_nodes():
-            match = re.match(nodePattern, node.get_label())
+        for _, attrs in nodes:
+            match = WASMA_NODE_PATTERN.match(attrs.get("label"))
             if match:
                 instr_id, instr_content = match.groups()
                 ret.add_node(int(instr_id), instr_content.strip())  # 添加节点
-            match2 = re.match(localPattern, node.get_label())
+            match2 = WASMA_LOCAL_PATTERN.match(attrs.get("label"))
             if match2:
                 local_id = match2.group(2)
                 # print(local_id)
                 if local_id not in localMap:
                     localMap[local_id] = ([], [])
         # print(localMap)
-        for edge in graph.get_edges():
-            pattern = r"(\d+) -> (\d+)"  # 匹配边
-            match = re.match(pattern, edge.get_source() + " -> " + edge.get_destination())
+        for src, dst, attrs in edges:
+            match = WASMA_EDGE_PATTERN.match(src + " -> " + dst)
             if match:
                 to_id, from_id = match.groups()
                 ret.add_edge(int(from_id), int(to_id))  # 添加边
-            if edge.get_source() in localMap:
-                localMap[edge.get_source()][1].append(edge.get_destination())
-            if edge.get_destination() in localMap:
-                localMap[edge.get_destination()][0].append(edge.get_source())
-            weight = edge.get_label()
+            if src in localMap:
+                localMap[src][1].append(dst)
+            if dst in localMap:
+                localMap[dst][0].append(src)
+            weight = attrs.get("label")
             if weight:
-                weightMap[(edge.get_source(), edge.get_destination())] = weight
+                weightMap[(src, dst)] = weight
         # print(weightMap)
+        # 索引只建一次：每个源节点出边上的权重（按 weightMap 顺序），以及每个 local 按权重分组的定义节点
+        weightsFrom = {}
+        for (src, _), weight in weightMap.items():
+            weightsFrom.setdefault(src, []).append(weight)
         for local_id, (from_ids, to_ids) in localMap.items():
             # print(local_id, from_ids, to_ids)
             if len(from_ids) == 1 and len(to_ids) == 1:
@@ -266,136 +646,90 @@ def build_graph_from_dot_wasma(dot, count=0):
                 for to_id in to_ids:
                     # print("to_id", to_id, "from_ids", from_ids[0])
                     ret.add_edge(int(to_id), int(from_ids[0]))
-            elif len(from_ids) > 1 and len(to_ids) == 1:
-                build_graph_from_dot_wasma_helper(ret, to_ids[0], weightMap, localMap, local_id)
-            elif len(from_ids) > 1 and len(to_ids) > 1:
+            elif len(from_ids) > 1 and len(to_ids) >= 1:
+                defsByWeight, unweightedDefs = index_wasma_definitions(from_ids, local_id, weightMap)
                 for to_id in to_ids:
-                    build_graph_from_dot_wasma_helper(ret, to_id, weightMap, localMap, local_id)
+                    for from_id in resolve_wasma_definitions(to_id, local_id, weightMap, weightsFrom, defsByWeight, unweightedDefs):
+                        ret.add_edge(int(to_id), int(from_id))
     except Exception as e:
         print(f"Error parsing DOT file: {e}")
         return Graph(count, dot)
-    return merge_local_get_set(ret)  # 合并 local.get 和 local.set 指令
-
-def build_graph_from_dot_wasma_helper(graph: Graph, node_id: str, weightMap: dict, localMap: dict, local_id: str):
-    # print("build_graph_from_dot_wasma_helper", node_id, local_id)
-    # print("localMap", localMap)
-    # print("weightMap", weightMap)
-    # 帮助一个后继节点找到它的前驱节点
-    from_ids = localMap[local_id][0] 
-    if (local_id, node_id) in weightMap:
-        weight = weightMap[(local_id, node_id)]
-        last_m = ""
-        cur_m = ""
-        for from_id in from_ids:
-            if (from_id, local_id) in weightMap and weightMap[(from_id, local_id)] == weight:
-                last_m = cur_m
-                cur_m = from_id
-        if cur_m == "":
-            # not found, nothing to do
-            pass
+    with tracing.span("merge", "graph", tool="wasma") as attrs:
+        return tracing.graphCounts(attrs, merge_local_get_set(ret))  # 合并 local.get 和 local.set 指令
+
+def index_wasma_definitions(from_ids: list, local_id: str, weightMap: dict):
+    """
+    为一个有多个定义（前驱）的 local 建立索引
+    :return: (defsByWeight, unweightedDefs)，defsByWeight: 权重 -> 以该权重写入 local 的前驱列表，
+             unweightedDefs: 无权边写入的前驱列表；列表保持原顺序，重复的边也保留
+    """
+    defsByWeight = {}
+    unweightedDefs = []
+    for from_id in from_ids:
+        weight = weightMap.get((from_id, local_id))
+        if weight is None:
+            unweightedDefs.append(from_id)
         else:
-            if last_m == "":
-                graph.add_edge(int(node_id), int(cur_m))
-                return
-            else:
-                # 多个前驱节点，不能确定
-                # TODO: 处理这种情况
-                pass
+            defsByWeight.setdefault(weight, []).append(from_id)
+    return defsByWeight, unweightedDefs
+
+def resolve_wasma_definitions(node_id: str, local_id: str, weightMap: dict, weightsFrom: dict, defsByWeight: dict, unweightedDefs: list):
+    """
+    帮助一个后继节点（读 local 的节点）找到它的前驱节点（写 local 的节点），每一步都是字典查找
+    规则依次为：local -> 读节点 的边权；读节点出边上的间接权重；唯一的无权前驱。
+    某条规则只有唯一候选时采用它；候选有多个时无法确定，
+    按 WASMA_AMBIGUOUS_DEFS 处理："skip" 继续尝试后面的规则，"all" 在所有规则都无法唯一确定时连到第一组候选的全部节点
+    :return: 选中的前驱节点列表
+    """
+    ambiguous = []
+    if (local_id, node_id) in weightMap:
+        candidates = defsByWeight.get(weightMap[(local_id, node_id)], ())
+        if len(candidates) == 1:
+            return candidates
+        ambiguous = candidates
     else:
         # 如果没有权重，先找间接边
-        for pair in weightMap:
-            if pair[0] == node_id:
-                weight = weightMap[pair]
-                last_m = ""
-                cur_m = ""
-                for from_id in from_ids:
-                    if (from_id, local_id) in weightMap and weightMap[(from_id, local_id)] == weight:
-                        last_m = cur_m
-                        cur_m = from_id
-                if cur_m == "":
-                    # not found, nothing to do
-                    pass
-                else:
-                    if last_m == "":
-                        graph.add_edge(int(node_id), int(cur_m))
-                        return
-                    else:
-                        # 多个前驱节点，不能确定
-                        # TODO: 处理这种情况
-                        pass
+        for weight in weightsFrom.get(node_id, ()):
+            candidates = defsByWeight.get(weight, ())
+            if len(candidates) == 1:
+                return candidates
+            if candidates and not ambiguous:
+                ambiguous = candidates
         # 如果没有间接边，找到唯一的无权前驱
-        last_m = ""
-        cur_m = ""
-        for from_id in from_ids:
-            if (from_id, local_id) not in weightMap:
-                last_m = cur_m
-                cur_m = from_id
-        if cur_m == "":
-            # not found, nothing to do
-            pass    
-        else:
-            if last_m == "":
-                graph.add_edge(int(node_id), int(cur_m))
-                return
-            else:
-                # 多个前驱节点，不能确定
-                # TODO: 处理这种情况
-                pass
+        if len(unweightedDefs) == 1:
+            return unweightedDefs
+        if unweightedDefs and not ambiguous:
+            ambiguous = unweightedDefs
+    if WASMA_AMBIGUOUS_DEFS == "all":
+        return list(dict.fromkeys(ambiguous))
+    return []
 
 
-def build_graph_from_dot_wasmOpt_helper(graph: Graph, node_id: str, debugLocMap: dict, visited: set):
-    visited.add(node_id)
-    retSet = set()
-    for to_id in graph.adj_list[node_id][1]:
-        if to_id in debugLocMap:
-            retSet.add(to_id)
-        else:
-            if to_id in visited:
-                continue
-            s = build_graph_from_dot_wasmOpt_helper(graph, to_id, debugLocMap, visited)
-            # Union set
-            retSet = retSet.union(s)
-    visited.remove(node_id)
-    return retSet
-
 def build_graph_from_dot_wasmOpt(dot, count=0):
     """
     从 wasm-opt 的输出中构建数据依赖图
     """
     tmp = Graph()
     try:
-        graph = pydot.graph_from_dot_file(dot)[0]  # 解析 DOT 图
-        debugLocPattern = r"\".*?\| Line: (\d+) \|.*?\""  # 匹配 debugLoc
+        nodes, edges = load_dot(dot, "binaryen")  # 解析 DOT 图
         debugLocMap = {}  # debugLoc 映射表, key: node_name, value: debugLoc
-        for node in graph.get_nodes():
-            node_name = node.get_name()
-            node_debugLoc = node.get_attributes().get("debugLoc")  # 获取 debugLoc  # 添加节点
+        for node_name, attrs in nodes:
+            node_debugLoc = attrs.get("debugLoc")  # 获取 debugLoc
             if node_debugLoc:
-                match = re.match(debugLocPattern, node_debugLoc)
+                match = WASMOPT_DEBUGLOC_PATTERN.match(node_debugLoc)
                 if match:
                     # print(match.group())
                     debugLoc = match.group(1)
                     debugLocMap[node_name] = debugLoc
-            label = node.get_label()
+            label = attrs.get("label")
             tmp.add_node(node_name, label[1:len(label)-1])  # 添加节点
         # print(debugLocMap)    
-        for edge in graph.get_edges():
-            from_id = edge.get_source()
-            to_id = edge.get_destination()
+        for from_id, to_id, _ in edges:
             tmp.add_edge(from_id, to_id)
 
         # 修正图
-        ret = Graph(count, dot)
-        visited = set()
-        for node_id, _ in tmp.adj_list.items():
-            if node_id in debugLocMap:
-                ret.add_node(int(debugLocMap[node_id]), tmp.adj_list[node_id][0])
-                s = build_graph_from_dot_wasmOpt_helper(tmp, node_id, debugLocMap, visited)
-                # print(s)
-                for to_id in s:
-                    if debugLocMap[node_id] != debugLocMap[to_id]: # 避免自反
-                        ret.add_node(int(debugLocMap[to_id]), tmp.adj_list[to_id][0])
-                        ret.add_edge(int(debugLocMap[node_id]), int(debugLocMap[to_id]))      
+        with tracing.span("collapse", "graph", tool="binaryen") as attrs:
+            ret = tracing.graphCounts(attrs, collapse_debug_locations(tmp, debugLocMap, Graph(count, dot)))
     except Exception as e:
         print(f"Error parsing DOT file: {e}")
         return Graph(count, dot)  
@@ -457,45 +791,141 @@ def get_edges_set(graph):
 
 #     return similarity_matrix
 
-def _frobenius_task(args):
-    i, j, g1, g2 = args
-    m1 = nx.adjacency_matrix(g1.to_NetworkX()).toarray()
-    m2 = nx.adjacency_matrix(g2.to_NetworkX()).toarray()
-    sim = np.linalg.norm(m1 - m2, 'fro')
-    return i, j, sim
+def in_range_edges(graph):
+    """
+    提取图中端点都落在 [0, node_count) 内的边，与 to_NetworkX 的过滤规则一致
+    每条边 (from_id, to_id) 编码为整数 from_id * node_count + to_id，比元组集合更省内存
+    :param graph: Graph 或 FrozenGraph 对象
+    :return: 边编码集合
+    """
+    n = graph.node_count
+    if isinstance(graph, FrozenGraph):
+        ids = graph.ids
+        indptr = graph.indptr
+        indices = graph.indices
+        keys = set()
+        for i, from_id in enumerate(ids):
+            if from_id >= n:
+                continue
+            base = from_id * n
+            for k in range(indptr[i], indptr[i + 1]):
+                to_id = ids[indices[k]]
+                if to_id < n:
+                    keys.add(base + to_id)
+        return keys
+    return set(
+        from_id * n + to_id
+        for from_id, (_, to_ids) in graph.adj_list.items() if from_id < n
+        for to_id in to_ids if to_id < n
+    )
+
+def frobenius_distance(g1, g2):
+    """
+    计算两个图邻接矩阵之差的 Frobenius 范数
+    邻接矩阵元素只取 0/1，因此 ||A1 - A2||_F = sqrt(|E1 Δ E2|)，
+    直接在边集合上计算，内存与边数成正比，不再构造 node_count × node_count 的稠密矩阵
+    """
+    return _frobenius_from_keys(in_range_edges(g1), in_range_edges(g2))
+
+def _frobenius_from_keys(e1, e2):
+    return math.sqrt(len(e1 ^ e2))
 
 def compareAdjacentMatrix(graphs):
     """
-    并行计算多个图的 Frobenius 范数差异
-    :param graphs: 图列表，每个图为 networkx 表示的邻接矩阵
+    计算多个图两两之间的 Frobenius 范数差异
+    基于边集合的计算代价为 O(E)，直接在当前进程内完成；并行由调用方在函数粒度上进行
+    :param graphs: 图列表，每个图为 Graph 或 FrozenGraph 对象
     :return: 相似度矩阵（对称）
     """
     num_graphs = len(graphs)
     similarity_matrix = np.zeros((num_graphs, num_graphs))
 
-    args_list = [
-        (i, j, graphs[i], graphs[j])
-        for (i, g1), (j, g2) in itertools.combinations(enumerate(graphs), 2)
-    ]
+    # 每个图的边集合只提取一次，所有图对共用
+    edge_sets = [in_range_edges(g) for g in graphs]
+    for i, j in itertools.combinations(range(num_graphs), 2):
+        similarity_matrix[i, j] = similarity_matrix[j, i] = _frobenius_from_keys(edge_sets[i], edge_sets[j])
 
-    with concurrent.futures.ProcessPoolExecutor() as executor:
-        results = executor.map(_frobenius_task, args_list)
+    return similarity_matrix
 
-    for i, j, sim in results:
-        similarity_matrix[i, j] = similarity_matrix[j, i] = sim
+def edge_keys(graph) -> np.ndarray:
+    """
+    图中端点都在 [0, node_count) 内的边的编码（见 in_range_edges），排序去重后的 int64 数组
+    """
+    keys = np.fromiter(in_range_edges(graph), dtype=np.int64)
+    keys.sort()
+    return keys
 
-    return similarity_matrix
+def node_keys(graph) -> np.ndarray:
+    """
+    图中编号在 [0, node_count) 内的节点，排序后的 int64 数组
+    """
+    n = graph.node_count
+    ids = graph.ids if isinstance(graph, FrozenGraph) else graph.adj_list
+    keys = np.fromiter((id for id in ids if 0 <= id < n), dtype=np.int64)
+    keys.sort()
+    return keys
+
+def overlap_counts(groups: list) -> np.ndarray:
+    """
+    一次向量化计算一批函数里所有工具两两之间的交集大小
+    把所有 (函数, 键) 排序后，每个不同的键得到一个工具位掩码，按 (函数, 掩码) 计数，
+    再由掩码计数展开出交集大小；代价与工具对的数量无关
+    :param groups: 每个函数一项，每项为各工具排序去重后的键数组列表，工具顺序一致
+    :return: 形状 (函数数, 工具数, 工具数) 的数组，[g, i, j] 为 |K_gi ∩ K_gj|，对角线为 |K_gi|
+    """
+    num_groups = len(groups)
+    num_tools = len(groups[0]) if groups else 0
+    sizes = np.array([[len(keys) for keys in tools] for tools in groups], dtype=np.int64).reshape(-1)
+    counts = np.zeros((num_groups, num_tools, num_tools), dtype=np.int64)
+    if not sizes.sum():
+        return counts
+    keys = np.concatenate([keys for tools in groups for keys in tools])
+    owner = np.repeat(np.arange(num_groups * num_tools), sizes)
+    group = owner // num_tools
+    order = np.lexsort((keys, group))
+    keys = keys[order]
+    group = group[order]
+    bits = np.left_shift(1, owner[order] % num_tools)
+    start = np.flatnonzero(np.concatenate(([True], (keys[1:] != keys[:-1]) | (group[1:] != group[:-1]))))
+    masks = np.bitwise_or.reduceat(bits, start)
+    hist = np.bincount((group[start] << num_tools) + masks, minlength=num_groups << num_tools)
+    hist = hist.reshape(num_groups, 1 << num_tools)
+    member = (np.arange(1 << num_tools)[:, None] >> np.arange(num_tools)) & 1
+    return np.einsum("gm,mi,mj->gij", hist, member, member)
+
+def _ratio(num, den):
+    # 分母为 0（对应的集合为空）时记为 1.0
+    out = np.ones(num.shape)
+    np.divide(num, den, out=out, where=den != 0)
+    return out
+
+def _sizes(counts):
+    return np.diagonal(counts, axis1=1, axis2=2)
+
+# 所有指标都只由交集大小算出，增加指标不需要再做集合运算
+# edges / nodes 为 overlap_counts 的结果，[g, i, j] 中 j 视为参考工具
+SIMILARITY_METRICS = {
+    # ||A_i - A_j||_F = sqrt(|E_i Δ E_j|)
+    "frobenius": lambda edges, nodes: np.sqrt(_sizes(edges)[:, :, None] + _sizes(edges)[:, None, :] - 2 * edges),
+    "jaccard": lambda edges, nodes: _ratio(edges, _sizes(edges)[:, :, None] + _sizes(edges)[:, None, :] - edges),
+    # 工具 i 的边中有多少也被参考工具 j 给出
+    "precision": lambda edges, nodes: _ratio(edges, np.broadcast_to(_sizes(edges)[:, :, None], edges.shape)),
+    # 参考工具 j 的边中有多少被工具 i 找到
+    "recall": lambda edges, nodes: _ratio(edges, np.broadcast_to(_sizes(edges)[:, None, :], edges.shape)),
+    # 参考工具 j 的节点中有多少也出现在工具 i 的图里
+    "node_coverage": lambda edges, nodes: _ratio(nodes, np.broadcast_to(_sizes(nodes)[:, None, :], nodes.shape)),
+}
+
+def compareBatch(functions: list, metrics=None) -> dict:
+    """
+    一次计算一批函数的所有相似度指标
+    :param functions: 每个函数一项 (edge_arrays, node_arrays)，分别为各工具的 edge_keys / node_keys
+    :param metrics: 要计算的指标名，默认 SIMILARITY_METRICS 中的全部
+    :return: 指标名 -> 形状 (函数数, 工具数, 工具数) 的数组
+    """
+    edges = overlap_counts([edge_arrays for edge_arrays, _ in functions])
+    nodes = overlap_counts([node_arrays for _, node_arrays in functions])
+    return {name: SIMILARITY_METRICS[name](edges, nodes) for name in (metrics or SIMILARITY_METRICS)}
 
 def f(tmp: Graph, debugLocMap: map):
-    ret = Graph()
-    visited = set()
-    for node_id, _ in tmp.adj_list.items():
-        if node_id in debugLocMap:
-            ret.add_node(int(debugLocMap[node_id]), tmp.adj_list[node_id][0])
-            s = build_graph_from_dot_wasmOpt_helper(tmp, node_id, debugLocMap, visited)
-            for to_id in s:
-                if debugLocMap[node_id] != debugLocMap[to_id]: # 避免自反
-                    ret.add_node(int(debugLocMap[to_id]), tmp.adj_list[to_id][0])
-                    ret.add_edge(int(debugLocMap[node_id]), int(debugLocMap[to_id])) 
-    return ret
-    
\ No newline at end of file
+    return collapse_debug_locations(tmp, debugLocMap, Graph())
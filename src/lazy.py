@@ -0,0 +1,29 @@
+import importlib.util
+import sys
+import types
+
+# Deferred imports, so that cheap subcommands (--help, --dump, --clear, --trace-summary) do
+# not pay for numpy, asyncio or concurrent.futures. A module returned by module() is
+# registered in sys.modules right away; its code runs on the first attribute access.
+
+
+def module(name):
+    """
+    Return module name, executed on first use instead of now
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError("No module named {!r}".format(name), name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    ret = importlib.util.module_from_spec(spec)
+    sys.modules[name] = ret
+    loader.exec_module(ret)
+    return ret
+
+
+def loaded(mod):
+    # False while mod is a deferred module nobody has used yet; does not load it
+    return type(mod) is types.ModuleType
@@ -1,7 +1,18 @@
 import sys
 import time
-from process import runBenchmark, prepareBenchmark, clear, clearBenchmark, DATA_MICRO_BENCHMARKS_PATH, prepareReal, runReal, clearReal, DATA_REAL_WORLD_PATH, evalDataJson
-import dump
+import lazy
+
+# Loaded on first use, so --help, --dump, --clear and --trace-summary start without numpy,
+# asyncio and the process pools
+process = lazy.module("process")
+dump = lazy.module("dump")
+results = lazy.module("results")
+pool = lazy.module("pool")
+scheduler = lazy.module("scheduler")
+runner = lazy.module("runner")
+cache = lazy.module("cache")
+distributed = lazy.module("distributed")
+tracing = lazy.module("tracing")
 
 def help_message(): 
     print("-" * 80)
@@ -18,21 +29,126 @@ def help_message():
     print("--real               Run evaluation on real world binaries dataset")
     print("  --fresh            Run a fresh evaluation from the start, re-evaluating static, tools and dynamic information.")
     print("  --eval-no-prepare  Re-use the existing prerequsite file, only run PDG generate and transform, compare and analyse result store.")
+    print("  --resume           Continue an interrupted evaluation, skipping functions already recorded in result.jsonl.")
     print("  --dump             Print the result generated last time.")
     print("  --clear            Clear all the data generated by the real script.")
     print("--micro              Run evaulation on microbenchmarks, if no suboptions are passed, print help message.")
     print("  --fresh            Run a fresh evaluation from the start, include prerequsite file generate, PDG generate and transform, compare and analyse result store.")
     print("  --eval-no-prepare  Re-use the existing prerequsite file, only run PDG generate and transform, compare and analyse result store.")
+    print("  --resume           Continue an interrupted evaluation, skipping functions already recorded in result.jsonl.")
     print("  --dump             Print the result generated last time.")
     print("  --clear            Clear all the data generated by the micro benchmarks script.")
     print("--help   -h          Print this help message.")
     print("--all-fresh          Run a fresh evaluation for realworld and microbenchmarks.")
     print("--clear              Clear all the data generated by the script.")
+    print("--check-metadata     Compare the function instruction counts decoded from each prepared benchmark binary")
+    print("                     with wassail's listing; exits with status 1 on any difference.")
+    print("--jobs N             Number of analyzer processes and of graph build/compare workers (default: cpu count).")
+    print("--tool-jobs T=N,...  Per-tool cap on concurrently running analyzers, e.g. wasma=4,binaryen=1.")
+    print("--reduce             Compare transitively reduced dependence graphs.")
+    print("--skip-tools         Do not run the analyzers, evaluate the outputs already in data/ (e.g. from synth.py --dot).")
+    print("--decode-metadata    Decode metadata.json from the wasm binaries instead of asking wassail (see --check-metadata).")
+    print("--no-cache           Always rerun the analyzers and rebuild the graphs instead of reusing data/cache and data/graph-cache.")
+    print("--forkserver         Start workers from a forkserver with graph/numpy already imported.")
+    print("--timeout [T=]S,...  Kill analyzer runs after S seconds, per tool or for all tools, e.g. wasma=300,600.")
+    print("--memory-limit [T=]SIZE,...  Address space limit (RLIMIT_AS) of analyzer runs, e.g. 4G or wassail=8G.")
+    print("--cpu-limit [T=]S,...  CPU time limit (RLIMIT_CPU) of analyzer runs in seconds.")
+    print("--longest-first      Start the analyzer runs that took longest in earlier runs first.")
+    print("--distributed QUEUE  Run the analyzers on workers attached to QUEUE (a directory, or file:DIR) instead of locally.")
+    print("--worker QUEUE       Run analyzer jobs published on QUEUE until the coordinator is done.")
+    print("  --worker-id ID     Name reported with the results (default: host-pid).")
+    print("  --once             Exit as soon as no job is pending.")
+    print("--report-tier TIER   Report detail: summary (case averages only), top (the --report-top functions per case")
+    print("                     that disagree most) or full (every function, default). One PDF per case plus result.pdf.")
+    print("--report-top K       Functions listed per case by the top tier and overall in result.pdf (default: 20).")
+    print("--trace FILE         Append per-stage spans (Chrome trace events, one JSON per line) to FILE.")
+    print("--trace-summary FILE Summarize a trace: time per stage, throughput and slowest functions per tool and stage.")
+    print("  --top N            Number of slowest functions listed per tool and stage (default: 10).")
+    print("  --chrome OUT       Also convert the trace to OUT for chrome://tracing or Perfetto.")
     print("")
     print("If you do not pass in any options, there is nothing to do.")
 
+def popOption(args, name, hasValue=False):
+    # Remove a global option from args, it may appear at any position
+    if name not in args:
+        return None
+    pos = args.index(name)
+    if not hasValue:
+        del args[pos]
+        return True
+    if pos + 1 >= len(args):
+        print("Option {} requires a value.".format(name))
+        help_message()
+        sys.exit()
+    value = args[pos + 1]
+    del args[pos:pos + 2]
+    return value
+
 def main():
     args = sys.argv[1:]
+    jobs = popOption(args, "--jobs", True)
+    if jobs is not None and (not jobs.isdigit() or int(jobs) < 1):
+        print("Invalid value {} for --jobs.".format(jobs))
+        help_message()
+        sys.exit()
+    forkserver = bool(popOption(args, "--forkserver"))
+    if jobs is not None or forkserver:
+        pool.configure(int(jobs) if jobs is not None else None, forkserver)
+    if jobs is not None:
+        runner.LIMIT = int(jobs)
+    if popOption(args, "--reduce"):
+        process.REDUCE_GRAPHS = True
+    if popOption(args, "--skip-tools"):
+        process.RUN_TOOLS = False
+    if popOption(args, "--decode-metadata"):
+        process.DECODE_METADATA = True
+    if popOption(args, "--no-cache"):
+        cache.ENABLED = False
+    traceFile = popOption(args, "--trace", True)
+    if traceFile is not None:
+        tracing.configure(traceFile)
+    toolJobs = popOption(args, "--tool-jobs", True)
+    if toolJobs is not None:
+        try:
+            scheduler.TOOL_JOBS = scheduler.parseToolJobs(toolJobs)
+        except ValueError as e:
+            print(e)
+            help_message()
+            sys.exit()
+    for option, attr, convert in (("--timeout", "TOOL_TIMEOUTS", float), ("--memory-limit", "TOOL_MEMORY", lambda value: scheduler.parseSize(value)), ("--cpu-limit", "TOOL_CPU", int)):
+        value = popOption(args, option, True)
+        if value is None:
+            continue
+        try:
+            setattr(scheduler, attr, scheduler.parseToolValues(value, convert))
+        except ValueError as e:
+            print(e)
+            help_message()
+            sys.exit()
+    if popOption(args, "--longest-first"):
+        scheduler.LONGEST_FIRST = True
+    tier = popOption(args, "--report-tier", True)
+    if tier is not None:
+        if tier not in dump.REPORT_TIERS:
+            print("Invalid value {} for --report-tier.".format(tier))
+            help_message()
+            sys.exit()
+        dump.REPORT_TIER = tier
+    topK = popOption(args, "--report-top", True)
+    if topK is not None:
+        if not topK.isdigit():
+            print("Invalid value {} for --report-top.".format(topK))
+            help_message()
+            sys.exit()
+        dump.TOP_K = int(topK)
+    queue = popOption(args, "--distributed", True)
+    if queue is not None:
+        try:
+            scheduler.TRANSPORT = distributed.openTransport(queue)
+        except ValueError as e:
+            print(e)
+            help_message()
+            sys.exit()
     if len(args)==0 or args[0] == "-h" or args[0] == "--help": 
         help_message()
         sys.exit()
@@ -42,45 +158,82 @@ def main():
             help_message()
             sys.exit()
         if args[1] == "--fresh":
-            if not prepareBenchmark():
+            if not process.prepareBenchmark():
                 print("Error in preparing benchmark.")
                 sys.exit()
-            runBenchmark()
-            dump.dump(DATA_MICRO_BENCHMARKS_PATH / "result.json", DATA_MICRO_BENCHMARKS_PATH)
+            process.runBenchmark()
+            dump.dump(process.DATA_MICRO_BENCHMARKS_PATH / results.RESULT_FILE, process.DATA_MICRO_BENCHMARKS_PATH)
         elif args[1] == "--eval-no-prepare":
-            runBenchmark()
-            dump.dump(DATA_MICRO_BENCHMARKS_PATH / "result.json", DATA_MICRO_BENCHMARKS_PATH)
+            process.runBenchmark()
+            dump.dump(process.DATA_MICRO_BENCHMARKS_PATH / results.RESULT_FILE, process.DATA_MICRO_BENCHMARKS_PATH)
+        elif args[1] == "--resume":
+            process.runBenchmark(resume=True)
+            dump.dump(process.DATA_MICRO_BENCHMARKS_PATH / results.RESULT_FILE, process.DATA_MICRO_BENCHMARKS_PATH)
         elif args[1] == "--dump":
-            dump.dump(DATA_MICRO_BENCHMARKS_PATH / "result.json", DATA_MICRO_BENCHMARKS_PATH)
+            dump.dump(process.DATA_MICRO_BENCHMARKS_PATH / results.RESULT_FILE, process.DATA_MICRO_BENCHMARKS_PATH)
         elif args[1] == "--clear":
-            clearBenchmark()
+            process.clearBenchmark()
         else:
             print("Invalid suboption {} for --micro.".format(args[1]))
             help_message()
             sys.exit()
+    elif args[0] == "--trace-summary":
+        if len(args) < 2:
+            print("Please pass in the trace file for --trace-summary.")
+            help_message()
+            sys.exit()
+        top = popOption(args, "--top", True)
+        if top is not None and not top.isdigit():
+            print("Invalid value {} for --top.".format(top))
+            help_message()
+            sys.exit()
+        chrome = popOption(args, "--chrome", True)
+        tracing.summarize(args[1], int(top) if top is not None else 10)
+        if chrome is not None:
+            tracing.toChrome(args[1], chrome)
+            print("chrome trace written to {}".format(chrome))
+    elif args[0] == "--worker":
+        workerId = popOption(args, "--worker-id", True)
+        once = bool(popOption(args, "--once"))
+        if len(args) < 2:
+            print("Please pass in the queue for --worker.")
+            help_message()
+            sys.exit()
+        try:
+            distributed.work(args[1], workerId, once)
+        except ValueError as e:
+            print(e)
+            help_message()
+            sys.exit()
     elif args[0] == "--all-fresh":
         print("Not implemented yet.")
         pass
     elif args[0] == "--clear":
-        clear()
+        process.clear()
+    elif args[0] == "--check-metadata":
+        if not process.checkMetadata():
+            sys.exit(1)
     elif args[0] == "--real":
         if len(args) == 1:
             print("Please pass in suboptions for --real.")
             help_message()
             sys.exit()
         if args[1] == "--fresh":
-            if not prepareReal():
+            if not process.prepareReal():
                 print("Error in preparing benchmark.")
                 sys.exit()
-            runReal()
-            dump.dump(DATA_REAL_WORLD_PATH / "result.json", DATA_REAL_WORLD_PATH)
+            process.runReal()
+            dump.dump(process.DATA_REAL_WORLD_PATH / results.RESULT_FILE, process.DATA_REAL_WORLD_PATH)
         elif args[1] == "--eval-no-prepare":
-            runReal()
-            dump.dump(DATA_REAL_WORLD_PATH / "result.json", DATA_REAL_WORLD_PATH)
+            process.runReal()
+            dump.dump(process.DATA_REAL_WORLD_PATH / results.RESULT_FILE, process.DATA_REAL_WORLD_PATH)
+        elif args[1] == "--resume":
+            process.runReal(resume=True)
+            dump.dump(process.DATA_REAL_WORLD_PATH / results.RESULT_FILE, process.DATA_REAL_WORLD_PATH)
         elif args[1] == "--dump":
-             dump.dump(DATA_REAL_WORLD_PATH / "result.json", DATA_REAL_WORLD_PATH)
+             dump.dump(process.DATA_REAL_WORLD_PATH / results.RESULT_FILE, process.DATA_REAL_WORLD_PATH)
         elif args[1] == "--clear":
-            clearReal()
+            process.clearReal()
         else:
             print("Invalid suboption {} for --real.".format(args[1]))
             help_message()
@@ -92,7 +245,14 @@ def main():
 
 if __name__ == "__main__":
     start = time.time()
-    main()
+    try:
+        main()
+    finally:
+        if lazy.loaded(pool):
+            pool.shutdown()
+        # Idle workers exit once the coordinator is done
+        if lazy.loaded(scheduler) and scheduler.TRANSPORT is not None:
+            scheduler.TRANSPORT.close()
     end = time.time()
     print(f"main() 执行耗时：{end - start:.4f} 秒")
-    # evalDataJson(DATA_REAL_WORLD_PATH / "result.json")
+    # process.evalDataJson(process.DATA_REAL_WORLD_PATH / results.RESULT_FILE)
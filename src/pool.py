@@ -0,0 +1,59 @@
+import concurrent.futures
+import multiprocessing
+import collections
+
+# Number of worker processes, None means os.cpu_count()
+JOBS = None
+# Start workers from a forkserver which already imported the modules below
+FORKSERVER = False
+FORKSERVER_PRELOAD = ["process", "graph", "numpy"]
+# Outstanding futures per worker before the producer waits for results
+IN_FLIGHT_PER_WORKER = 4
+
+_executor = None
+
+
+def configure(jobs=None, forkserver=False):
+    # Must be called before the first task is submitted
+    global JOBS, FORKSERVER
+    if _executor is not None:
+        shutdown()
+    JOBS = jobs
+    FORKSERVER = forkserver
+
+
+def getExecutor():
+    # One executor lives for the whole run, workers are reused across cases and functions
+    global _executor
+    if _executor is None:
+        context = None
+        if FORKSERVER:
+            context = multiprocessing.get_context("forkserver")
+            context.set_forkserver_preload(FORKSERVER_PRELOAD)
+        _executor = concurrent.futures.ProcessPoolExecutor(max_workers=JOBS, mp_context=context)
+    return _executor
+
+
+def workerCount():
+    return getExecutor()._max_workers
+
+
+def imapOrdered(fn, argsIter):
+    # Like executor.map, but never holds more than IN_FLIGHT_PER_WORKER * workers
+    # futures, so huge argument lists are not materialized up front
+    executor = getExecutor()
+    limit = max(1, workerCount() * IN_FLIGHT_PER_WORKER)
+    pending = collections.deque()
+    for args in argsIter:
+        pending.append(executor.submit(fn, args))
+        if len(pending) >= limit:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown()
+        _executor = None
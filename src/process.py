@@ -1,9 +1,19 @@
 from pathlib import Path
-import subprocess
-import time
+import itertools
 import json
-import graph
-import concurrent.futures
+import os
+import lazy
+import results
+import tracing
+
+# Only needed once analyzers run or graphs are built, not by --clear or --dump
+asyncio = lazy.module("asyncio")
+cache = lazy.module("cache")
+graph = lazy.module("graph")
+pool = lazy.module("pool")
+scheduler = lazy.module("scheduler")
+runner = lazy.module("runner")
+wasmparse = lazy.module("wasmparse")
 
 
 MICRO_BENCHMARKS_PATH = Path("microbenchmarks")
@@ -17,33 +27,40 @@ DATA_MICRO_BENCHMARKS_PATH = DATA_PATH / "microbenchmarks"
 REAL_WORLD_PATH = Path("real-world-programs")
 DATA_REAL_WORLD_PATH = DATA_PATH / "real-world-programs"
 
+# Compare transitively reduced graphs instead of the raw dependence graphs (--reduce)
+REDUCE_GRAPHS = False
+# Run the analyzers before the evaluation; False evaluates the outputs already in data/ (--skip-tools)
+RUN_TOOLS = True
+# Functions compared together in one vectorized pass of graph.compareBatch
+COMPARE_BATCH = 256
+# Bytes kept from the end of a function-instruction-labels listing
+LABELS_TAIL = 4096
+# Failed analyzer runs of a case (timeout, oom, cpu, error), next to the tool outputs
+OUTCOME_FILE = "outcomes.json"
+# Hashes of the inputs and outputs of the last successful prepare of every program
+PREPARE_STAMPS = DATA_PATH / "prepare.json"
+# Bump whenever generateMetadata changes what it writes for the same binary
+METADATA_VERSION = 1
+# Decode metadata.json from the wasm binary (wasmparse) instead of asking wassail (--decode-metadata).
+# Off until the decoder's instruction numbering has been checked against wassail on the
+# benchmarks with main.py --check-metadata, since the counts decide which nodes are compared.
+DECODE_METADATA = False
+
 name_map = {"blake3": "blake3_js_bg", "fonteditor-core": "woff2", "magic": "magic-js", "opusscript": "opusscript_native_wasm", "shiki": "onig", "source-map": "mappings", "wasm-rsa": "rsa_lib_bg"}
 
 
 
-def executeCommand(command, tool_name):
-    # Execute the command
-    start_time = time.time()
-    process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    stdout, stderr = process.communicate()
-    end_time = time.time()
-    exec_time = end_time - start_time
-    # Check if the command was executed successfully
-    if process.returncode != 0:
-        # Print the error message
-        # print("Error: {} failed to execute cmd {}".format(tool_name, command))
-        # print("Error message: {}".format(stderr.decode("utf-8")))
-        msg = "Error: {} failed to execute cmd {}. Error message: {}".format(tool_name, command, stderr.decode("utf-8"))
-        # Return the status as False
-        return False, msg, exec_time
-    # Print the output of the command
-    # print(tool_shell_output.format(tool_name, stdout.decode("utf-8")))
-    msg = stdout.decode("utf-8")
-    # Return the status as True
-    return True, msg, exec_time
+def executeCommand(command, tool_name, stdout=False):
+    # command is an argument list, executed without a shell. stdout: False discards the
+    # output, True returns it, an int returns only its last bytes (see runner.run).
+    status, msg, exec_time, _ = runner.call(runner.run(command, tool_name, stdout))
+    return status, msg, exec_time
 
 
 def runWassail(inputDir, micro = True):
+    scheduler.runJobs(wassailJobs(inputDir, micro))
+
+def wassailJobs(inputDir, micro = True):
     # find the metadata file
     metadataFile = inputDir / "metadata.json"
     metadata = readMetadata(metadataFile)
@@ -61,39 +78,96 @@ def runWassail(inputDir, micro = True):
         # Create the output directory
         outputFile.parent.mkdir(parents=True, exist_ok=True)
         # Create a command to run wassail
-        wassailCommand = "{} dependencies {} {} {}".format(TOOL_WASSAIL, inputFile, funcIndex, outputFile)
-        status, msg, exec_time = executeCommand(wassailCommand, "wassail")
-        if not status:
-            print(msg)
-        else :
-            print("wassail analyse function {} in {} took {} seconds".format(funcIndex, inputDir.name, exec_time))
-
-def generateMetadata(inputFile, metadataFile):
-    # Generate metadata for the tools
+        wassailCommand = [TOOL_WASSAIL, "dependencies", inputFile, funcIndex, outputFile]
+        message = "wassail analyse function {} in {} took {{}} seconds".format(funcIndex, inputDir.name)
+        yield scheduler.Job("wassail", inputDir.name, wassailCommand, message, funcIndex,
+                            binary=TOOL_WASSAIL, inputs=[inputFile], flags=["dependencies"], outputs=[outputFile])
+
+def generateMetadata(inputFile, metadataFile, wasmFile=None):
+    # Generate metadata for the tools, listed by wassail. With DECODE_METADATA it is decoded
+    # from wasmFile (the binary the analyzers read) in process, and wassail is only asked when
+    # there is no binary or the decoder gives up.
     metadata = {
         "source": inputFile.name,
         "functions": []
     }
-    wassailCommand = "{} functions {}".format(TOOL_WASSAIL, inputFile)
-    status, msg, _ = executeCommand(wassailCommand, "wassail")
+    if wasmFile is not None and DECODE_METADATA:
+        try:
+            metadata["functions"] = wasmparse.read_functions_file(wasmFile)
+        except (OSError, wasmparse.WasmDecodeError) as e:
+            print("Decoding {} failed ({}), asking wassail instead".format(wasmFile, e))
+        else:
+            with open(metadataFile, "w") as f:
+                json.dump(metadata, f)
+            return True, ""
+    status, msg, metadata["functions"] = runner.call(wassailFunctions(inputFile))
     if not status:
         return False, msg
-    # Parse the output of the command
-    # print(msg)
-    functions = msg.strip().split("\n")
-    for function in functions:
-        fTuple = function.strip().split("\t")
-        # print(fTuple)
-        wassailCommand2 = "{} function-instruction-labels {} {}".format(TOOL_WASSAIL, inputFile, fTuple[0])
-        status, msg, _ = executeCommand(wassailCommand2, "wassail")
-        if not status:
-            return False, msg
-        instructions = msg.strip().split("\n")
-        metadata["functions"].append({"index": fTuple[0], "name": fTuple[1], "count": int(instructions[-1]) + 1})
     # Write the metadata to a file
     with open(metadataFile, "w") as f:
         json.dump(metadata, f)
-    return True, _
+    return True, ""
+
+
+async def wassailFunctions(inputFile):
+    # The functions of inputFile as listed by wassail, in the format of metadata.json.
+    # Returns (status, msg, functions); the per-function listings run concurrently.
+    status, msg, _, _ = await runner.run([TOOL_WASSAIL, "functions", inputFile], "wassail", stdout=True)
+    if not status:
+        return False, msg, []
+    # Unnamed functions have nothing after the tab
+    fTuples = [(function.strip().split("\t") + [""])[:2] for function in msg.strip().split("\n")]
+
+    async def count(index):
+        # Only the last label is used, the rest of the listing is not kept
+        command = [TOOL_WASSAIL, "function-instruction-labels", inputFile, index]
+        return await runner.run(command, "wassail", stdout=LABELS_TAIL)
+
+    functions = []
+    for fTuple, (status, msg, _, _) in zip(fTuples, await asyncio.gather(*(count(fTuple[0]) for fTuple in fTuples))):
+        if not status:
+            return False, msg, []
+        instructions = msg.strip().split("\n")
+        functions.append({"index": fTuple[0], "name": fTuple[1], "count": int(instructions[-1]) + 1})
+    return True, "", functions
+
+
+def checkMetadata():
+    # Compare the functions decoded by wasmparse with wassail's listing for every prepared
+    # micro and real-world benchmark. Names may differ, indices and instruction counts must not.
+    programs = [(item.name, item / "{}.wat".format(item.name))
+                for item in sorted(MICRO_BENCHMARKS_PATH.iterdir()) if item.is_dir()]
+    programs += [(item.name, item / "{}.wat".format(name_map[item.name]))
+                 for item in sorted(REAL_WORLD_PATH.iterdir()) if item.is_dir()]
+    ok = True
+    for name, inputFile in programs:
+        wasmFile = inputFile.with_suffix(".wasm")
+        if not wasmFile.exists():
+            print("{}: {} not found, prepare the benchmarks first".format(name, wasmFile))
+            ok = False
+            continue
+        status, msg, expected = runner.call(wassailFunctions(inputFile))
+        if not status:
+            print(msg)
+            ok = False
+            continue
+        try:
+            decoded = wasmparse.read_functions_file(wasmFile)
+        except (OSError, wasmparse.WasmDecodeError) as e:
+            print("{}: decoding {} failed: {}".format(name, wasmFile, e))
+            ok = False
+            continue
+        expectedCounts = [(function["index"], function["count"]) for function in expected]
+        decodedCounts = [(function["index"], function["count"]) for function in decoded]
+        if expectedCounts == decodedCounts:
+            print("{}: {} functions match".format(name, len(expected)))
+            continue
+        ok = False
+        print("{}: wassail lists {} functions, the decoder {}".format(name, len(expected), len(decoded)))
+        mismatches = [(a, b) for a, b in itertools.zip_longest(expectedCounts, decodedCounts) if a != b]
+        for a, b in mismatches[:10]:
+            print("  wassail (index, count) {}, decoder {}".format(a, b))
+    return ok
 
 
 def readMetadata(metadataFile):
@@ -102,32 +176,121 @@ def readMetadata(metadataFile):
     return metadata
 
 
-def wat2wasm(inputFile):
-    # Output file
-    outputFile = inputFile.with_suffix(".wasm")
-    sourceMapFile = inputFile.with_suffix(".wasm.map")
-    # Create a command to run wassail
-    wat2wasmCommand = "{} {} -sm {} -o {}".format(TOOL_BINARYEN_AS, inputFile, sourceMapFile, outputFile)
-    status, msg, _ = executeCommand(wat2wasmCommand, "wasm-as")
+async def wat2wasm(inputFile, outputFile=None, sourceMapFile=None):
+    # Runs on the runner loop, see prepareAll
+    outputFile = outputFile or inputFile.with_suffix(".wasm")
+    sourceMapFile = sourceMapFile or inputFile.with_suffix(".wasm.map")
+    wat2wasmCommand = [TOOL_BINARYEN_AS, inputFile, "-sm", sourceMapFile, "-o", outputFile]
+    status, msg, _, _ = await runner.run(wat2wasmCommand, "wasm-as")
     return status, msg
 
 
-def prepareBenchmark():
-    # iterate over all the microbenchmarks dir, and run the tools on them
-    for item in MICRO_BENCHMARKS_PATH.iterdir():
-        if item.is_dir():
-            # Generate metadata for the tools
-            inputFile = item / "{}.wat".format(item.name)
-            metadataFile = item / "metadata.json"
-            status, msg = generateMetadata(inputFile, metadataFile)
+def hashOrNone(path):
+    return cache.hashFile(path) if path.exists() else None
+
+
+def staged(path):
+    # Where prepareProgram writes the new version of path until all its steps succeeded
+    return path.with_name(path.name + ".tmp")
+
+
+async def prepareProgram(name, inputFile, stamp):
+    # Bring the artifacts of one program up to date: .wat -> .wasm + .wasm.map -> metadata.json.
+    # A step runs only when its inputs or outputs differ from the hashes in stamp.
+    # New artifacts are written next to the old ones and moved into place only when every
+    # step succeeded, so a failure leaves the artifacts of the last successful prepare.
+    # Returns (ok, msg, new stamp); msg says what was done or why it failed.
+    loop = asyncio.get_running_loop()
+    wasmFile = inputFile.with_suffix(".wasm")
+    mapFile = inputFile.with_suffix(".wasm.map")
+    metadataFile = inputFile.parent / "metadata.json"
+    stamp = dict(stamp or {})
+    current = {"wat": hashOrNone(inputFile), "wasm-as": hashOrNone(Path(TOOL_BINARYEN_AS))}
+    if current["wat"] is None:
+        return False, "{}: {} not found".format(name, inputFile), {}
+    steps = []
+    outputs = []
+    try:
+        if any(stamp.get(key) != value for key, value in current.items()) or \
+                stamp.get("wasm") != hashOrNone(wasmFile) or stamp.get("map") != hashOrNone(mapFile):
+            with tracing.span("prepare", "prepare", case=name, step="wat2wasm"):
+                outputs += [wasmFile, mapFile]
+                status, msg = await wat2wasm(inputFile, staged(wasmFile), staged(mapFile))
             if not status:
-                print(msg)
-                return False
-            status, msg = wat2wasm(inputFile)
+                return False, msg, {}
+            stamp = dict(current, wasm=hashOrNone(staged(wasmFile)), map=hashOrNone(staged(mapFile)))
+            steps.append("wat2wasm")
+        if stamp.get("metadata") is None or stamp.get("metadata") != hashOrNone(metadataFile) or \
+                stamp.get("metadataOf") != stamp["wasm"] or stamp.get("metadataVersion") != METADATA_VERSION or \
+                stamp.get("metadataDecoded") != DECODE_METADATA:
+            with tracing.span("prepare", "prepare", case=name, step="metadata"):
+                outputs.append(metadataFile)
+                binary = staged(wasmFile) if wasmFile in outputs else wasmFile
+                # Asks wassail through runner.call, so it must not run on the loop itself
+                status, msg = await loop.run_in_executor(None, generateMetadata, inputFile, staged(metadataFile), binary)
             if not status:
-                print(msg)
-                return False
-    return True
+                return False, msg, {}
+            stamp.update(metadata=hashOrNone(staged(metadataFile)), metadataOf=stamp["wasm"],
+                         metadataVersion=METADATA_VERSION, metadataDecoded=DECODE_METADATA)
+            steps.append("metadata")
+        # metadata.json last: isPrepared must not see it before the binary it describes
+        for output in sorted(outputs, key=lambda output: output == metadataFile):
+            if staged(output).exists():
+                os.replace(staged(output), output)
+    finally:
+        for output in outputs:
+            staged(output).unlink(missing_ok=True)
+    return True, "{}: {}".format(name, ", ".join(steps) if steps else "up to date"), stamp
+
+
+def loadStamps():
+    if not PREPARE_STAMPS.exists():
+        return {}
+    with open(PREPARE_STAMPS, "r") as f:
+        return json.load(f)
+
+
+def saveStamps(stamps):
+    PREPARE_STAMPS.parent.mkdir(parents=True, exist_ok=True)
+    tmp = PREPARE_STAMPS.with_name(PREPARE_STAMPS.name + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(stamps, f, indent=1, sort_keys=True)
+    tmp.replace(PREPARE_STAMPS)
+
+
+def prepareAll(programs):
+    # programs: [(name, .wat file)]. Stale programs are prepared concurrently (wasm-as runs
+    # are bounded by runner.LIMIT). A failed program does not stop the others: it keeps the
+    # artifacts of its last successful prepare, if any, and loses its stamp so that the next
+    # prepare tries again. Returns False only when no program could be prepared.
+    stamps = loadStamps()
+
+    async def run():
+        return await asyncio.gather(*(prepareProgram(name, inputFile, stamps.get(str(inputFile)))
+                                      for name, inputFile in programs))
+
+    failed = []
+    for (name, inputFile), (status, msg, stamp) in zip(programs, runner.call(run())):
+        print(msg)
+        if status:
+            stamps[str(inputFile)] = stamp
+        else:
+            failed.append(name)
+            stamps.pop(str(inputFile), None)
+    saveStamps(stamps)
+    if failed:
+        print("Failed to prepare {} of {} programs: {}".format(len(failed), len(programs), ", ".join(failed)))
+    return len(failed) < len(programs) or not programs
+
+
+def isPrepared(programDir):
+    return (programDir / "metadata.json").exists()
+
+
+def prepareBenchmark():
+    programs = [(item.name, item / "{}.wat".format(item.name))
+                for item in sorted(MICRO_BENCHMARKS_PATH.iterdir()) if item.is_dir()]
+    return prepareAll(programs)
 
 def clear():
     clearBenchmark()
@@ -170,6 +333,9 @@ def rmdirHelper(path):
     
 # ~/wasma/bin/DataFlowGraph -file test2.wasm -fi 0 -cdfg true -out .
 def runWasma(inputDir, micro = True):
+    scheduler.runJobs(wasmaJobs(inputDir, micro))
+
+def wasmaJobs(inputDir, micro = True):
     # find the metadata file
     metadataFile = inputDir / "metadata.json"
     metadata = readMetadata(metadataFile)
@@ -187,14 +353,17 @@ def runWasma(inputDir, micro = True):
         # Create the output directory
         outputDir.mkdir(parents=True, exist_ok=True)
         # Create a command to run wasma
-        wasmaCommand = "{} -file {} -fi {} -cdfg true -out {}".format(TOOL_WASMA, inputFile, funcIndex, outputDir)
-        status, msg, exec_time = executeCommand(wasmaCommand, "wasma")
-        if not status:
-            print(msg)
-        else :
-            print("wasma analyse function {} in {} took {} seconds".format(funcIndex, inputDir.name, exec_time))
+        wasmaCommand = [TOOL_WASMA, "-file", inputFile, "-fi", funcIndex, "-cdfg", "true", "-out", outputDir]
+        message = "wasma analyse function {} in {} took {{}} seconds".format(funcIndex, inputDir.name)
+        outputFile = outputDir / getWasmaOutFileName(funcIndex, inputFile.stem)
+        yield scheduler.Job("wasma", inputDir.name, wasmaCommand, message, funcIndex,
+                            binary=TOOL_WASMA, inputs=[inputFile], flags=["-cdfg", "true"], outputs=[outputFile])
 
 def runBinaryen(inputDir, micro = True):
+    scheduler.runJobs(binaryenJobs(inputDir, micro))
+
+def binaryenJobs(inputDir, micro = True):
+    # wasm-opt dumps every function of the module in one run, so this is a single job
     # input file
     inputFile = inputDir / "{}.wasm".format(inputDir.name)
     # Output directory
@@ -208,12 +377,10 @@ def runBinaryen(inputDir, micro = True):
     # Create the output directory
     outputDir.mkdir(parents=True, exist_ok=True)
     # Create a command to run binaryen wasm-opt
-    wasmOptCommand = "{} {} --flatten --dfo -ism {} -od {}".format(TOOL_BINARYEN_OPT, inputFile, mapFile, outputDir)
-    status, msg, exec_time = executeCommand(wasmOptCommand, "binaryen")
-    if not status:
-        print(msg)
-    else :
-        print("binaryen wasm-opt analyse function in {} took {} seconds".format(inputDir.name, exec_time))
+    wasmOptCommand = [TOOL_BINARYEN_OPT, inputFile, "--flatten", "--dfo", "-ism", mapFile, "-od", outputDir]
+    message = "binaryen wasm-opt analyse function in {} took {{}} seconds".format(inputDir.name)
+    yield scheduler.Job("binaryen", inputDir.name, wasmOptCommand, message,
+                        binary=TOOL_BINARYEN_OPT, inputs=[inputFile, mapFile], flags=["--flatten", "--dfo"], outputDir=outputDir)
 
 def getWassailOutFileName(index, testName = ""):
     return "graph_{}.dot".format(index)
@@ -224,80 +391,122 @@ def getWasmaOutFileName(index, testName = ""):
 def getBinaryenOutFileName(index, testName = ""):
     return "graph_{}.dot".format(index)
 
-#  dic of tools
+# Graph builders, looked up on call so that the register does not load graph
+def buildWassailGraph(dot, count=0):
+    return graph.build_graph_from_dot_wassail(dot, count)
+
+def buildWasmaGraph(dot, count=0):
+    return graph.build_graph_from_dot_wasma(dot, count)
+
+def buildBinaryenGraph(dot, count=0):
+    return graph.build_graph_from_dot_wasmOpt(dot, count)
+
+#  dic of tools: [run, output file name, graph builder, job generator]
 toolRegister = {
-    "wassail": [runWassail, getWassailOutFileName, graph.build_graph_from_dot_wassail],
-    "wasma": [runWasma, getWasmaOutFileName, graph.build_graph_from_dot_wasma],
-    "binaryen": [runBinaryen, getBinaryenOutFileName, graph.build_graph_from_dot_wasmOpt]
+    "wassail": [runWassail, getWassailOutFileName, buildWassailGraph, wassailJobs],
+    "wasma": [runWasma, getWasmaOutFileName, buildWasmaGraph, wasmaJobs],
+    "binaryen": [runBinaryen, getBinaryenOutFileName, buildBinaryenGraph, binaryenJobs]
 }
 
 
 def runAllTool(inputDir, micro = True):
-    for tool in toolRegister:
-        runTool(tool, inputDir, micro)
+    runAllTools([inputDir], micro)
+
+def runAllTools(inputDirs, micro = True, done = None):
+    # Expand programs x tools x functions into one job list and run it concurrently.
+    # done maps program -> {function index -> record}; recorded functions are not analysed
+    # again, and a whole-module job is skipped once every function of its program is recorded.
+    done = done or {}
+    jobs = []
+    for inputDir in inputDirs:
+        recorded = done.get(inputDir.name, {})
+        complete = recorded and len(recorded) == len(readMetadata(inputDir / "metadata.json")["functions"])
+        for tool in toolRegister:
+            for job in toolRegister[tool][3](inputDir, micro):
+                if job.funcIndex is None and complete:
+                    continue
+                if job.funcIndex is not None and job.funcIndex in recorded:
+                    continue
+                jobs.append(job)
+    ok = scheduler.runJobs(jobs)
+    recordOutcomes(jobs)
+    return ok
+
+def recordOutcomes(jobs):
+    # Failed runs are kept per case in OUTCOME_FILE, {tool: {function index or "module": outcome}},
+    # so the evaluation records them even when it runs later (--eval-no-prepare, --resume)
+    byCase = {}
+    for job in jobs:
+        outputDir = job.outputDir if job.outputDir is not None else job.outputs[0].parent
+        byCase.setdefault(outputDir.parent, []).append(job)
+    for caseDir, caseJobs in byCase.items():
+        outcomes = readOutcomes(caseDir)
+        for job in caseJobs:
+            if job.outcome is None:
+                continue
+            key = "module" if job.funcIndex is None else str(job.funcIndex)
+            toolOutcomes = outcomes.setdefault(job.tool, {})
+            if job.outcome == runner.OK:
+                toolOutcomes.pop(key, None)
+            else:
+                toolOutcomes[key] = job.outcome
+        outcomes = {tool: values for tool, values in outcomes.items() if values}
+        if outcomes:
+            caseDir.mkdir(parents=True, exist_ok=True)
+            with open(caseDir / OUTCOME_FILE, "w") as f:
+                json.dump(outcomes, f)
+        elif (caseDir / OUTCOME_FILE).exists():
+            (caseDir / OUTCOME_FILE).unlink()
+
+def readOutcomes(caseDir):
+    path = caseDir / OUTCOME_FILE
+    if not path.exists():
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+def functionOutcomes(outcomes, function):
+    # tool -> outcome of the runs behind one function, only the tools whose run failed
+    ret = {}
+    for tool, values in outcomes.items():
+        outcome = values.get(str(function["index"]), values.get("module"))
+        if outcome is not None:
+            ret[tool] = outcome
+    return ret
 
 def runTool(tool, inputDir, micro = True):
     toolRegister[tool][0](inputDir, micro)
 
 
-def runBenchmark():
-    # iterate over all the microbenchmarks dir, and run the tools on them
-    for item in MICRO_BENCHMARKS_PATH.iterdir():
-        if item.is_dir():
-            runAllTool(item)
-    data = {"tools": [], "cases": []}
-    data["tools"] = list(toolRegister.keys())
-    # transform the data
-    for item in DATA_MICRO_BENCHMARKS_PATH.iterdir():
-        if item.is_dir():
-            caseName = item.name
-            metadata = readMetadata(MICRO_BENCHMARKS_PATH / caseName / "metadata.json")
-            data_item = {
-                "case": caseName,
-                "functions": [],
-                "average": []
-            }
-            avg = {}
-            for i in range(len(metadata["functions"])):
-                graphs = []
-                for tool in toolRegister:
-                    graphs.append(toolRegister[tool][2](item / tool / toolRegister[tool][1](i if tool == "binaryen" else metadata["functions"][i]["index"], caseName), metadata["functions"][i]["count"]))
-                # if caseName == "stack_and_local":
-                #     for graph2 in graphs:
-                #         print(graph2.to_dot())
-                matrix = graph.compareAdjacentMatrix(graphs)
-                data_item["functions"].append({"index": metadata["functions"][i]["index"], "count": metadata["functions"][i]["count"], "matrix": matrix.tolist()})
-                if i == 0:
-                    avg = matrix
-                else:
-                    avg += matrix
-            data_item["average"] = (avg / len(metadata["functions"])).tolist()
-            data["cases"].append(data_item)
-        else :
-            # unexcepted file
-            item.unlink()
-    # Write the data to a file
-    with open(DATA_MICRO_BENCHMARKS_PATH / "result.json", "w") as f:
-        json.dump(data, f)
+def runBenchmark(resume = False):
+    DATA_MICRO_BENCHMARKS_PATH.mkdir(parents=True, exist_ok=True)
+    with results.ResultWriter(DATA_MICRO_BENCHMARKS_PATH / results.RESULT_FILE, list(toolRegister.keys()), resume) as writer:
+        # iterate over all the microbenchmarks dir, and run the tools on them
+        items = [item for item in sorted(MICRO_BENCHMARKS_PATH.iterdir()) if item.is_dir() and isPrepared(item)]
+        if RUN_TOOLS:
+            runAllTools(items, True, {item.name: writer.recorded(item.name) for item in items})
+        # transform the data, in a fixed case order so that --resume appends to the same stream
+        for item in sorted(DATA_MICRO_BENCHMARKS_PATH.iterdir()):
+            if item.is_dir():
+                caseName = item.name
+                if not isPrepared(MICRO_BENCHMARKS_PATH / caseName):
+                    # The program failed to prepare, see prepareAll
+                    continue
+                metadata = readMetadata(MICRO_BENCHMARKS_PATH / caseName / "metadata.json")
+                evalCase(item, caseName, caseName, metadata, writer)
+            elif item.name != results.RESULT_FILE:
+                # unexcepted file
+                item.unlink()
+    if cache.ENABLED:
+        cache.evictGraphs()
 
 
 
 
 def prepareReal():
-    for item in REAL_WORLD_PATH.iterdir():
-        if item.is_dir():
-            # Generate metadata for the tools
-            inputFile = item / "{}.wat".format(name_map[item.name])
-            metadataFile = item / "metadata.json"
-            status, msg = generateMetadata(inputFile, metadataFile)
-            if not status:
-                print(msg)
-                return False
-            status, msg = wat2wasm(inputFile)
-            if not status:
-                print(msg)
-                return False
-    return True
+    programs = [(item.name, item / "{}.wat".format(name_map[item.name]))
+                for item in sorted(REAL_WORLD_PATH.iterdir()) if item.is_dir()]
+    return prepareAll(programs)
     
 # def runReal():
 #     # for item in REAL_WORLD_PATH.iterdir():
@@ -338,80 +547,118 @@ def prepareReal():
 #     with open(DATA_REAL_WORLD_PATH / "result.json", "w") as f:
 #         json.dump(data, f)
 
-def run_tool_for_process(args):
-    idx, tool_name, tool_info, i, func_index, count, path = args
-    tool_func = tool_info[2]
-    return idx, tool_func(path, count)
-
-def runReal():
-    # for item in REAL_WORLD_PATH.iterdir():
-    #     if item.is_dir():
-    #         runAllTool(item, False)
-    data = {"tools": [], "cases": []}
-    data["tools"] = list(toolRegister.keys())
-
-    for item in DATA_REAL_WORLD_PATH.iterdir():
-        if item.is_dir():
-            caseName = item.name
-            metadata = readMetadata(REAL_WORLD_PATH / caseName / "metadata.json")
-            data_item = {
-                "case": caseName,
-                "functions": [],
-                "average": []
-            }
-            avg = {}
-
-            for i in range(len(metadata["functions"])):
-                graphs = [None] * len(toolRegister)
-                futures = []
-                
-                with concurrent.futures.ProcessPoolExecutor() as executor:
-                    args_list = []
-                    for idx, tool in enumerate(toolRegister):
-                        tool_info = toolRegister[tool]
-                        func_index = i if tool == "binaryen" else metadata["functions"][i]["index"]
-                        path = item / tool / tool_info[1](func_index, name_map[caseName])
-                        args_list.append((idx, tool, tool_info, i, func_index, metadata["functions"][i]["count"], path))
-
-                    futures = [executor.submit(run_tool_for_process, args) for args in args_list]
-
-                    for future in concurrent.futures.as_completed(futures):
-                        idx, result = future.result()
-                        graphs[idx] = result
-
-                matrix = graph.compareAdjacentMatrix(graphs)
-                data_item["functions"].append({
-                    "index": metadata["functions"][i]["index"],
-                    "count": metadata["functions"][i]["count"],
-                    "matrix": matrix.tolist()
-                })
-                if i == 0:
-                    avg = matrix
-                else:
-                    avg += matrix
-
-            data_item["average"] = (avg / len(metadata["functions"])).tolist()
-            data["cases"].append(data_item)
-
-        else:
-            # 非预期文件，删除
-            item.unlink()
+def graphOptions(tool):
+    # Builder settings that change the graph built from the same DOT file, part of its cache key
+    if tool == "wasma":
+        return {"ambiguous": graph.WASMA_AMBIGUOUS_DEFS}
+    return None
+
+
+def buildGraph(tool, path, count, useCache=True):
+    # The normalized (merged / collapsed) graph of one tool output, frozen. Reused from the
+    # graph cache while the DOT file is unchanged; returns (frozen, cached)
+    entry = cache.graphEntry(tool, path, count, graphOptions(tool)) if useCache else None
+    if entry is not None:
+        frozen = cache.restoreGraph(entry, lambda f: graph.FrozenGraph.load(f, count, path))
+        if frozen is not None:
+            return frozen, True
+    frozen = toolRegister[tool][2](path, count).freeze()
+    if entry is not None and all(type(id) is int for id in frozen.ids):
+        cache.storeGraph(entry, frozen.save)
+    return frozen, False
+
+
+def compareFunctionTask(args):
+    # Runs in a pool worker: build the graph of every tool for one function and return
+    # their edge/node keys, the metrics are computed per batch in evalCase
+    caseDir, outName, i, function, reduce, useCache = args
+    edges = []
+    nodes = []
+    for tool in toolRegister:
+        funcIndex = i if tool == "binaryen" else function["index"]
+        path = caseDir / tool / toolRegister[tool][1](funcIndex, outName)
+        with tracing.span("build", "graph", tool=tool, case=caseDir.name, function=function["index"]) as attrs:
+            frozen, attrs["cached"] = buildGraph(tool, path, function["count"], useCache)
+            if reduce:
+                frozen = graph.transitive_reduction(frozen)
+            tracing.graphCounts(attrs, frozen)
+        edges.append(graph.edge_keys(frozen))
+        nodes.append(graph.node_keys(frozen))
+    return function, edges, nodes
+
+
+def compareBatch(caseName, batch, outcomes=None):
+    # One record per function: "matrix" is the Frobenius norm, the other metrics go to "metrics",
+    # failed analyzer runs behind the function to "outcomes"
+    with tracing.span("compare", "graph", case=caseName, functions=len(batch)):
+        values = graph.compareBatch([(edges, nodes) for _, edges, nodes in batch])
+    for k, (function, _, _) in enumerate(batch):
+        record = {"index": function["index"], "count": function["count"], "matrix": values["frobenius"][k].tolist()}
+        record["metrics"] = {name: value[k].tolist() for name, value in values.items() if name != "frobenius"}
+        failed = functionOutcomes(outcomes or {}, function)
+        if failed:
+            record["outcomes"] = failed
+        yield record
+
+
+def evalCase(caseDir, caseName, outName, metadata, writer):
+    # Functions are submitted to the shared pool and streamed to writer in function order.
+    # Functions the writer already recorded (--resume) are skipped.
+    if writer.isComplete(caseName):
+        return
+    recorded = writer.recorded(caseName)
+    argsList = ((caseDir, outName, i, function, REDUCE_GRAPHS, cache.ENABLED) for i, function in enumerate(metadata["functions"])
+                if function["index"] not in recorded)
+    outcomes = readOutcomes(caseDir)
+    batch = []
+    for item in pool.imapOrdered(compareFunctionTask, argsList):
+        batch.append(item)
+        if len(batch) >= COMPARE_BATCH:
+            for record in compareBatch(caseName, batch, outcomes):
+                writer.writeFunction(caseName, record)
+            batch = []
+    for record in compareBatch(caseName, batch, outcomes):
+        writer.writeFunction(caseName, record)
+    writer.endCase(caseName)
+
+
+def runReal(resume = False):
+    DATA_REAL_WORLD_PATH.mkdir(parents=True, exist_ok=True)
+    with results.ResultWriter(DATA_REAL_WORLD_PATH / results.RESULT_FILE, list(toolRegister.keys()), resume) as writer:
+        # The real-world analyzer runs are too long to repeat locally, their stored outputs are
+        # evaluated as they are; with --distributed the workers produce them
+        if scheduler.TRANSPORT is not None and RUN_TOOLS:
+            items = [item for item in sorted(REAL_WORLD_PATH.iterdir()) if item.is_dir() and isPrepared(item)]
+            runAllTools(items, False, {item.name: writer.recorded(item.name) for item in items})
+        # Fixed case order, see runBenchmark
+        for item in sorted(DATA_REAL_WORLD_PATH.iterdir()):
+            if item.is_dir():
+                caseName = item.name
+                if not isPrepared(REAL_WORLD_PATH / caseName):
+                    continue
+                metadata = readMetadata(REAL_WORLD_PATH / caseName / "metadata.json")
+                evalCase(item, caseName, name_map[caseName], metadata, writer)
 
-    # 写入结果
-    with open(DATA_REAL_WORLD_PATH / "result.json", "w") as f:
-        json.dump(data, f)
+            elif item.name != results.RESULT_FILE:
+                # 非预期文件，删除
+                item.unlink()
+    if cache.ENABLED:
+        cache.evictGraphs()
 
 
 def evalDataJson(filePath):
-    with open(filePath, "r") as f:
-        data = json.load(f)
-    print("caseName : Fn : Fc")
-    for caseItem in data["cases"]:
-        caseName = caseItem["case"]
-        Fn = len(caseItem["functions"])
-        Fc = 0
-        for f in caseItem["functions"]:
-            matrix = f["matrix"]
-            if matrix == [[0.0,0.0,0.0],[0.0,0.0,0.0],[0.0,0.0,0.0]]:
+    # Streams the results, only the counters of the current case are kept
+    # Ff counts functions where an analyzer run failed (timeout, oom, cpu or error)
+    print("caseName : Fn : Fc : Ff")
+    Fn = Fc = Ff = 0
+    for record in results.readResults(filePath):
+        if record["type"] == "function":
+            Fn = Fn + 1
+            if record["matrix"] == [[0.0,0.0,0.0],[0.0,0.0,0.0],[0.0,0.0,0.0]]:
                 Fc = Fc + 1
-        print("{} : {} : {}".format(caseName, Fn, Fc))
\ No newline at end of file
+            if record.get("outcomes"):
+                Ff = Ff + 1
+        elif record["type"] == "case":
+            caseName = record["case"]
+            print("{} : {} : {} : {}".format(caseName, Fn, Fc, Ff))
+            Fn = Fc = Ff = 0
@@ -0,0 +1,165 @@
+import json
+import os
+
+# Evaluation results are a JSON Lines stream, written while the evaluation runs:
+#   {"type": "header", "tools": [...]}
+#   {"type": "function", "case": ..., "index": ..., "count": ..., "matrix": [[...]], "metrics": {...}}   one per function
+#   {"type": "case", "case": ..., "functions": n, "average": [[...]], "metrics": {...}}             after the last function of a case
+# "matrix" is the Frobenius norm, "metrics" maps the other metrics of graph.SIMILARITY_METRICS
+# to tool x tool matrices (column j uses tool j as the reference); older streams have no "metrics".
+# A function record has "outcomes": {tool: "timeout" | "oom" | "cpu" | "killed" | "error"} when an analyzer
+# run behind it failed, the case record then counts them as {tool: {outcome: functions}}.
+# The lines of one case are contiguous and functions keep metadata order, also across --resume.
+RESULT_FILE = "result.jsonl"
+
+
+def addMatrix(total, matrix):
+    if total is None:
+        return [list(row) for row in matrix]
+    return [[a + b for a, b in zip(rowA, rowB)] for rowA, rowB in zip(total, matrix)]
+
+
+class CaseProgress:
+    # Running sums of one case, enough to write its average without keeping the functions
+    def __init__(self):
+        self.indices = set()
+        self.total = None
+        self.metricTotals = {}
+        self.outcomes = {}
+        self.complete = False
+
+    def add(self, record):
+        self.indices.add(record["index"])
+        self.total = addMatrix(self.total, record["matrix"])
+        for name, matrix in record.get("metrics", {}).items():
+            self.metricTotals[name] = addMatrix(self.metricTotals.get(name), matrix)
+        for tool, outcome in record.get("outcomes", {}).items():
+            counts = self.outcomes.setdefault(tool, {})
+            counts[outcome] = counts.get(outcome, 0) + 1
+
+    def _average(self, total):
+        if total is None:
+            return []
+        return [[val / len(self.indices) for val in row] for row in total]
+
+    def average(self):
+        return self._average(self.total)
+
+    def metricAverages(self):
+        return {name: self._average(total) for name, total in self.metricTotals.items()}
+
+
+class ResultWriter:
+    # Appends records as they are produced. Every line is flushed and fsynced, so an
+    # interrupted run loses at most the comparison in progress and can be resumed.
+    def __init__(self, path, tools, resume=False):
+        self.path = path
+        self.progress = {}
+        if resume and os.path.exists(path):
+            truncatePartialLine(path)
+            self.progress = loadProgress(path)
+            self.file = open(path, "a", encoding="utf-8")
+            if self.file.tell() == 0:
+                self._write({"type": "header", "tools": tools})
+        else:
+            self.file = open(path, "w", encoding="utf-8")
+            self._write({"type": "header", "tools": tools})
+
+    def _write(self, record):
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def _case(self, case):
+        return self.progress.setdefault(case, CaseProgress())
+
+    def recorded(self, case):
+        return self._case(case).indices
+
+    def isComplete(self, case):
+        return self._case(case).complete
+
+    def writeFunction(self, case, record):
+        self._write(dict(type="function", case=case, **record))
+        self._case(case).add(record)
+
+    def endCase(self, case):
+        progress = self._case(case)
+        if progress.complete:
+            return
+        record = {"type": "case", "case": case, "functions": len(progress.indices), "average": progress.average(),
+                  "metrics": progress.metricAverages()}
+        if progress.outcomes:
+            record["outcomes"] = progress.outcomes
+        self._write(record)
+        progress.complete = True
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def readResults(path):
+    # Yield records lazily in file order. A crash can leave a partial last line, which is
+    # skipped. A result.json written by older versions is converted on the fly.
+    path = str(path)
+    if path.endswith(".json"):
+        yield from _readLegacy(path)
+        return
+    if not os.path.exists(path):
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            yield record
+
+
+def _readLegacy(path):
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    yield {"type": "header", "tools": data["tools"]}
+    for case in data["cases"]:
+        for func in case["functions"]:
+            yield dict(type="function", case=case["case"], **func)
+        yield {"type": "case", "case": case["case"], "functions": len(case["functions"]), "average": case["average"]}
+
+
+def loadProgress(path):
+    # case -> CaseProgress rebuilt from an existing stream, used by --resume
+    progress = {}
+    for record in readResults(path):
+        if record["type"] == "function":
+            progress.setdefault(record["case"], CaseProgress()).add(record)
+        elif record["type"] == "case":
+            progress.setdefault(record["case"], CaseProgress()).complete = True
+    return progress
+
+
+def truncatePartialLine(path):
+    # Drop a trailing partial line before appending to an existing stream
+    with open(path, "rb+") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        pos = size
+        # Scan backwards for the last newline instead of reading the whole file
+        while pos > 0:
+            step = min(pos, 1 << 16)
+            pos -= step
+            f.seek(pos)
+            chunk = f.read(step)
+            newline = chunk.rfind(b"\n")
+            if newline >= 0:
+                end = pos + newline + 1
+                break
+        else:
+            end = 0
+        if end != size:
+            f.truncate(end)
@@ -0,0 +1,220 @@
+import asyncio
+import os
+import re
+import resource
+import shlex
+import signal
+import subprocess
+import threading
+import time
+
+# Analyzer processes are started without a shell (argument lists passed to exec) and
+# multiplexed by one event loop running in a background thread. Only the tail of stderr
+# is kept for error messages; stdout is discarded unless the caller needs it.
+# Each child is reaped by its own thread with wait4 instead of asyncio's child watcher,
+# so its resource usage (CPU time of the analyzer itself) is available to the caller.
+
+# Cap on processes running at the same time, None means os.cpu_count()
+LIMIT = None
+# Bytes of stderr kept for the error message of a failed run
+STDERR_LIMIT = 64 * 1024
+READ_CHUNK = 64 * 1024
+# stderr of runs that failed for lack of memory (OCaml, C++, libc and Python wording)
+OOM_PATTERN = re.compile(r"out of memory|bad_alloc|cannot allocate memory|MemoryError", re.IGNORECASE)
+
+# Outcomes of a run, recorded in the results
+OK = "ok"
+ERROR = "error"
+TIMEOUT = "timeout"
+OOM = "oom"
+CPU = "cpu"
+# SIGKILL that neither the CPU limit nor a timeout explains: the kernel OOM killer or someone else
+KILLED = "killed"
+
+_loop = None
+_loopLock = threading.Lock()
+_semaphore = None
+_semaphoreLimit = None
+
+
+def _startLoop():
+    global _loop
+    with _loopLock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name="runner", daemon=True)
+            thread.start()
+            _loop = loop
+    return _loop
+
+
+def submit(coro):
+    # Start a coroutine on the runner loop, returns a concurrent.futures.Future
+    return asyncio.run_coroutine_threadsafe(coro, _startLoop())
+
+
+def call(coro):
+    # Run a coroutine on the runner loop from synchronous code and wait for its result
+    return submit(coro).result()
+
+
+def semaphore():
+    # Created inside the runner loop on first use, and again when LIMIT was changed
+    global _semaphore, _semaphoreLimit
+    limit = LIMIT or os.cpu_count() or 1
+    if _semaphore is None or _semaphoreLimit != limit:
+        _semaphore = asyncio.Semaphore(limit)
+        _semaphoreLimit = limit
+    return _semaphore
+
+
+class _Tail:
+    # Keeps at most limit bytes, dropping the oldest data; limit None keeps everything
+    def __init__(self, limit):
+        self.limit = limit
+        self.data = bytearray()
+        self.dropped = 0
+
+    def add(self, chunk):
+        self.data += chunk
+        if self.limit is not None and len(self.data) > self.limit:
+            extra = len(self.data) - self.limit
+            del self.data[:extra]
+            self.dropped += extra
+
+    def text(self):
+        text = self.data.decode("utf-8", errors="replace")
+        if self.dropped:
+            text = "[{} bytes omitted]\n".format(self.dropped) + text
+        return text
+
+
+async def _drain(stream, tail):
+    while True:
+        chunk = await stream.read(READ_CHUNK)
+        if not chunk:
+            break
+        if tail is not None:
+            tail.add(chunk)
+
+
+async def _pipeReader(loop, pipe):
+    reader = asyncio.StreamReader(limit=READ_CHUNK)
+    transport, _ = await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), pipe)
+    return reader, transport
+
+
+def _exitCode(status):
+    # Same convention as subprocess: -N when killed by signal N
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def _reap(proc, loop, exited):
+    _, status, usage = os.wait4(proc.pid, 0)
+    proc.returncode = _exitCode(status)
+    loop.call_soon_threadsafe(exited.set_result, usage)
+
+
+def _limit(proc, memory, cpu):
+    # Applied from the parent right after the start: preexec_fn is not safe while the loop
+    # and reaper threads run. Must happen before the reaper starts, so that the pid still
+    # belongs to the child (at worst a zombie) even when it has already exited.
+    try:
+        if memory:
+            resource.prlimit(proc.pid, resource.RLIMIT_AS, (memory, memory))
+        if cpu:
+            # SIGXCPU at the soft limit, SIGKILL one second later
+            resource.prlimit(proc.pid, resource.RLIMIT_CPU, (cpu, cpu + 1))
+    except ProcessLookupError:
+        pass
+
+
+def _kill(proc):
+    # The child leads its own session, so helpers it started are killed too
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def classify(returncode, stderr, memory=None, cpu=None, cpuTime=None):
+    # cpuTime: user + system seconds the child used, from wait4
+    if returncode == 0:
+        return OK
+    if cpu and returncode == -signal.SIGXCPU:
+        return CPU
+    if returncode == -signal.SIGKILL:
+        # A child that ignores SIGXCPU gets SIGKILL at the hard limit, one second later
+        if cpu and cpuTime is not None and cpuTime >= cpu:
+            return CPU
+        return KILLED
+    if OOM_PATTERN.search(stderr):
+        return OOM
+    # Allocation failures under RLIMIT_AS usually end in abort()
+    if memory and returncode in (-signal.SIGABRT, -signal.SIGSEGV):
+        return OOM
+    return ERROR
+
+
+async def run(argv, tool_name, stdout=False, timeout=None, memory=None, cpu=None, usage=None):
+    """
+    Run argv and wait for it, at most LIMIT runs at a time.
+    stdout: False discards it, True returns all of it, an int returns only its last bytes.
+    timeout: wall-clock seconds before the run is killed; memory: RLIMIT_AS in bytes;
+    cpu: RLIMIT_CPU in seconds. None means no limit.
+    usage: optional dict, receives "cpu", the user + system time of the process in µs.
+    Returns (status, msg, exec_time, outcome): msg is stdout on success and an error message
+    with the tail of stderr on failure, outcome is one of OK, ERROR, TIMEOUT, OOM, CPU, KILLED.
+    """
+    argv = [str(arg) for arg in argv]
+    command = shlex.join(argv)
+    loop = asyncio.get_running_loop()
+    async with semaphore():
+        start_time = time.time()
+        try:
+            proc = subprocess.Popen(
+                argv, stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE if stdout is not False else subprocess.DEVNULL,
+                stderr=subprocess.PIPE, start_new_session=True)
+        except OSError as e:
+            msg = "Error: {} failed to execute cmd {}. Error message: {}".format(tool_name, command, e)
+            return False, msg, time.time() - start_time, ERROR
+        _limit(proc, memory, cpu)
+        exited = loop.create_future()
+        threading.Thread(target=_reap, args=(proc, loop, exited), name="reap-{}".format(proc.pid), daemon=True).start()
+        out = _Tail(None if stdout is True else stdout) if stdout is not False else None
+        err = _Tail(STDERR_LIMIT)
+        pipes = [(proc.stderr, err)]
+        if out is not None:
+            pipes.append((proc.stdout, out))
+        transports = []
+        readers = []
+        for pipe, tail in pipes:
+            reader, transport = await _pipeReader(loop, pipe)
+            transports.append(transport)
+            readers.append(_drain(reader, tail))
+        try:
+            await asyncio.wait_for(asyncio.gather(asyncio.shield(exited), *readers), timeout)
+        except asyncio.TimeoutError:
+            _kill(proc)
+            await exited
+            for transport in transports:
+                transport.close()
+            msg = "Error: {} timed out after {} seconds running cmd {}".format(tool_name, timeout, command)
+            return False, msg, time.time() - start_time, TIMEOUT
+        finally:
+            if exited.done():
+                rusage = exited.result()
+                cpuTime = rusage.ru_utime + rusage.ru_stime
+                if usage is not None:
+                    usage["cpu"] = int(cpuTime * 1e6)
+        returncode = proc.returncode
+        exec_time = time.time() - start_time
+    if returncode != 0:
+        outcome = classify(returncode, err.text(), memory, cpu, cpuTime)
+        msg = "Error: {} failed ({}, exit code {}) to execute cmd {}. Error message: {}".format(
+            tool_name, outcome, returncode, command, err.text())
+        return False, msg, exec_time, outcome
+    return True, out.text() if out is not None else "", exec_time, OK
@@ -0,0 +1,189 @@
+from pathlib import Path
+import asyncio
+import collections
+import json
+import os
+import cache
+import distributed
+import process
+import runner
+import tracing
+
+# Per-tool caps, e.g. {"wasma": 4}; all tools together are bounded by runner.LIMIT
+TOOL_JOBS = {}
+# Per-tool limits of every run, tool -> value, "*" applies to tools not listed:
+# wall-clock seconds, RLIMIT_AS bytes and RLIMIT_CPU seconds
+TOOL_TIMEOUTS = {}
+TOOL_MEMORY = {}
+TOOL_CPU = {}
+# Start the jobs that took longest in earlier runs first, to bound the makespan
+LONGEST_FIRST = False
+# Execution time of every job of earlier runs, used by LONGEST_FIRST
+HISTORY_FILE = Path("data") / "job-times.json"
+# distributed.Transport: publish the jobs to remote workers instead of running them here (--distributed)
+TRANSPORT = None
+
+
+class Job:
+    # One analyzer invocation: a single function for wassail/wasma, a whole module for binaryen.
+    # command is an argument list, executed without a shell.
+    def __init__(self, tool, program, command, message, funcIndex=None, binary=None, inputs=(), flags=(), outputs=(), outputDir=None):
+        self.tool = tool
+        self.program = program
+        self.command = command
+        # Printed on success, formatted with the execution time
+        self.message = message
+        self.funcIndex = funcIndex
+        # What the result depends on and where it is written, used by the output cache.
+        # outputDir is set for jobs writing a whole directory (binaryen), outputs otherwise.
+        self.binary = binary
+        self.inputs = list(inputs)
+        self.flags = list(flags)
+        self.outputs = list(outputs)
+        self.outputDir = outputDir
+        # Set by runJob: runner.OK, ERROR, TIMEOUT, OOM or CPU
+        self.outcome = None
+
+    def key(self):
+        return "{}/{}/{}".format(self.tool, self.program, self.funcIndex)
+
+    def __repr__(self):
+        return "Job({}, {}, {})".format(self.tool, self.program, self.funcIndex)
+
+
+async def runJob(job):
+    loop = asyncio.get_running_loop()
+    with tracing.span("analyse", "tool", tool=job.tool, case=job.program, function=job.funcIndex) as attrs:
+        # Cache copies are plain file IO, done in the loop's thread pool
+        attrs["cached"] = await loop.run_in_executor(None, cache.restore, job)
+        if attrs["cached"]:
+            job.outcome = runner.OK
+            return job, True, "{} restored from cache".format(job), 0.0
+        startTime = cache.now()
+        status, msg, exec_time, job.outcome = await runner.run(job.command, job.tool, usage=attrs, **limitsFor(job.tool))
+        attrs["outcome"] = job.outcome
+        if status:
+            await loop.run_in_executor(None, cache.store, job, startTime)
+        return job, status, job.message.format(exec_time) if status else msg, exec_time
+
+
+def limitsFor(tool):
+    def get(limits):
+        return limits.get(tool, limits.get("*"))
+    return {"timeout": get(TOOL_TIMEOUTS), "memory": get(TOOL_MEMORY), "cpu": get(TOOL_CPU)}
+
+
+def loadHistory():
+    if not HISTORY_FILE.exists():
+        return {}
+    with open(HISTORY_FILE, "r") as f:
+        return json.load(f)
+
+
+def saveHistory(history):
+    HISTORY_FILE.parent.mkdir(parents=True, exist_ok=True)
+    tmp = HISTORY_FILE.with_name(HISTORY_FILE.name + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(history, f)
+    os.replace(tmp, HISTORY_FILE)
+
+
+def longestFirst(queue, history):
+    # Jobs without history first (they may be the stragglers), then by past time, longest first
+    return collections.deque(sorted(queue, key=lambda job: -history.get(job.key(), float("inf"))))
+
+
+def roundRobin(queues):
+    # Interleave the per-tool queues: a, b, c, a, b, c, ...
+    queues = [queue for queue in queues.values() if queue]
+    while queues:
+        for queue in queues:
+            yield queue.popleft()
+        queues = [queue for queue in queues if queue]
+
+
+async def _runJobs(queues):
+    toolCaps = {tool: asyncio.Semaphore(TOOL_JOBS[tool]) for tool in queues if tool in TOOL_JOBS}
+
+    async def start(job):
+        if job.tool in toolCaps:
+            async with toolCaps[job.tool]:
+                return await runJob(job)
+        return await runJob(job)
+
+    async def report(job):
+        job, status, msg, exec_time = await start(job)
+        # Cache hits say nothing about the run time
+        if exec_time:
+            times[job.key()] = exec_time
+        print(msg)
+        return status
+
+    times = {}
+
+    # Semaphores (here and the global one in runner) wake waiters in FIFO order, so jobs
+    # start in the round-robin order
+    statuses = await asyncio.gather(*(report(job) for job in roundRobin(queues)))
+    return all(statuses), times
+
+
+def runJobs(jobs):
+    # Run independent jobs concurrently on the runner's event loop. Jobs are started
+    # round-robin over tools so a tool with thousands of per-function jobs does not starve
+    # the others, at most runner.LIMIT at a time and never more than TOOL_JOBS[tool] of one tool.
+    queues = collections.OrderedDict()
+    for job in jobs:
+        queues.setdefault(job.tool, collections.deque()).append(job)
+    if not queues:
+        return True
+    history = loadHistory()
+    if LONGEST_FIRST:
+        for tool in queues:
+            queues[tool] = longestFirst(queues[tool], history)
+    if TRANSPORT is not None:
+        ok, times = distributed.coordinate(queues, TRANSPORT)
+    else:
+        ok, times = runner.call(_runJobs(queues))
+    history.update(times)
+    saveHistory(history)
+    if cache.ENABLED:
+        cache.evict()
+        print(cache.summary())
+    return ok
+
+
+def parseToolJobs(value):
+    # "wassail=8,wasma=4" -> {"wassail": 8, "wasma": 4}
+    limits = {}
+    for item in value.split(","):
+        tool, _, count = item.partition("=")
+        if tool not in process.toolRegister or not count.isdigit() or int(count) < 1:
+            raise ValueError("Invalid tool limit {}".format(item))
+        limits[tool] = int(count)
+    return limits
+
+
+def parseSize(value):
+    # "512M", "4G" or a number of bytes
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+    value = value.strip().upper()
+    if value[-1:] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+
+def parseToolValues(value, convert):
+    # "600" -> {"*": 600}, "wasma=300,600" -> {"wasma": 300, "*": 600}
+    limits = {}
+    for item in value.split(","):
+        tool, sep, amount = item.rpartition("=")
+        tool = tool if sep else "*"
+        if tool != "*" and tool not in process.toolRegister:
+            raise ValueError("Invalid tool limit {}".format(item))
+        try:
+            limits[tool] = convert(amount)
+        except ValueError:
+            raise ValueError("Invalid tool limit {}".format(item))
+        if limits[tool] <= 0:
+            raise ValueError("Invalid tool limit {}".format(item))
+    return limits
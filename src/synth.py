@@ -0,0 +1,314 @@
+from pathlib import Path
+import sys
+import json
+import random
+import process
+
+# Synthetic workloads for scaling tests.
+# Usage: python3 src/synth.py NAME [--instructions N] [--locals K] [--depth D] [--loops L]
+#                             [--indirect C] [--functions F] [--seed S] [--out DIR] [--dot]
+# Writes DIR/NAME/NAME.wat (DIR defaults to microbenchmarks/), so prepareBenchmark and the
+# analyzers pick it up like any other micro benchmark. With --dot it also writes
+# DIR/NAME/metadata.json and synthetic outputs of every tool under data/microbenchmarks/NAME,
+# so the Python stages can be run (main.py --skip-tools --micro --eval-no-prepare, or
+# bench.py) without the external analyzers.
+
+BINOPS = ["i32.add", "i32.sub", "i32.mul", "i32.xor"]
+# Instructions per record node in the wassail output
+WASSAIL_BLOCK_SIZE = 16
+# Share of binaryen dependences going through an extra flattened local without debugLoc
+BINARYEN_TEMP_RATE = 0.3
+
+
+class Spec:
+    # instructions is per function and a lower bound: a block started near the end is
+    # completed. depth bounds if/else nesting, loops and indirect calls are per function.
+    def __init__(self, instructions=1000, locals=8, depth=2, loops=2, indirect=2, functions=1, seed=0):
+        self.instructions = instructions
+        self.locals = locals
+        self.depth = depth
+        self.loops = loops
+        self.indirect = indirect
+        self.functions = functions
+        self.seed = seed
+
+
+class Function:
+    # Instructions of one generated function and its dependences. Instruction i has the
+    # label i, like the labels of wassail function-instruction-labels. deps[i] lists the
+    # instructions i depends on, local reads depend on the reaching local.set/local.tee.
+    def __init__(self):
+        self.lines = []  # wat text lines, with indentation
+        self.instrs = []  # numbered instructions
+        self.deps = []
+        self.locals = {}  # instruction -> local it reads or writes
+
+    def emit(self, text, indent, deps=(), local=None):
+        i = len(self.instrs)
+        self.instrs.append(text)
+        self.deps.append(list(deps))
+        if local is not None:
+            self.locals[i] = local
+        self.lines.append("  " * indent + text)
+        return i
+
+    def structural(self, text, indent):
+        # else/end are not numbered
+        self.lines.append("  " * indent + text)
+
+
+class _Generator:
+    def __init__(self, spec, rng):
+        self.spec = spec
+        self.rng = rng
+        self.func = Function()
+        self.numLocals = spec.locals + 1  # local 0 is the parameter
+        self.reaching = [set() for _ in range(self.numLocals)]
+
+    def local(self):
+        return self.rng.randrange(self.numLocals)
+
+    def get(self, indent, stack):
+        k = self.local()
+        stack.append(self.func.emit("local.get {}".format(k), indent, sorted(self.reaching[k]), k))
+
+    def set(self, indent, stack, tee=False):
+        k = self.rng.randrange(1, self.numLocals) if self.numLocals > 1 else 0
+        i = self.func.emit("local.{} {}".format("tee" if tee else "set", k), indent, [stack.pop()], k)
+        self.reaching[k] = {i}
+        if tee:
+            stack.append(i)
+
+    def binop(self, indent, stack):
+        b, a = stack.pop(), stack.pop()
+        stack.append(self.func.emit(self.rng.choice(BINOPS), indent, [a, b]))
+
+    def const(self, indent, stack):
+        stack.append(self.func.emit("i32.const {}".format(self.rng.randrange(100)), indent))
+
+    def statement(self, indent):
+        # One statement leaves the operand stack as it found it
+        stack = []
+        kind = self.rng.random()
+        if kind < 0.5:
+            self.get(indent, stack)
+            self.get(indent, stack)
+            self.binop(indent, stack)
+            self.set(indent, stack)
+        elif kind < 0.7:
+            self.const(indent, stack)
+            self.set(indent, stack)
+        else:
+            self.get(indent, stack)
+            self.const(indent, stack)
+            self.binop(indent, stack)
+            self.set(indent, stack, tee=True)
+            self.func.emit("drop", indent, [stack.pop()])
+
+    def indirectCall(self, indent):
+        stack = []
+        self.get(indent, stack)
+        self.func.emit("i32.const 0", indent)
+        stack.append(self.func.emit("call_indirect (type 0)", indent, [stack.pop(), len(self.func.instrs) - 1]))
+        self.set(indent, stack)
+
+    def ifElse(self, indent, depth):
+        stack = []
+        self.get(indent, stack)
+        self.func.emit("if", indent, [stack.pop()])
+        before = [set(defs) for defs in self.reaching]
+        self.body(indent + 1, depth - 1)
+        after = self.reaching
+        self.reaching = before
+        self.func.structural("else", indent)
+        self.body(indent + 1, depth - 1)
+        self.reaching = [a | b for a, b in zip(after, self.reaching)]
+        self.func.structural("end", indent)
+
+    def loop(self, indent, depth):
+        before = [set(defs) for defs in self.reaching]
+        self.func.emit("loop", indent)
+        self.body(indent + 1, depth)
+        stack = []
+        self.get(indent + 1, stack)
+        self.func.emit("br_if 0", indent + 1, [stack.pop()])
+        self.func.structural("end", indent)
+        # The loop may run zero or more times
+        self.reaching = [a | b for a, b in zip(before, self.reaching)]
+
+    def body(self, indent, depth):
+        for _ in range(self.rng.randint(1, 4)):
+            if depth > 0 and self.rng.random() < 0.3:
+                self.ifElse(indent, depth)
+            else:
+                self.statement(indent)
+
+    def generate(self):
+        spec = self.spec
+        # Loops and indirect calls are spread over the function at random statement slots
+        slots = max(1, spec.instructions // 5)
+        loops = set(self.rng.sample(range(slots), min(slots, spec.loops)))
+        calls = set(self.rng.sample(range(slots), min(slots, spec.indirect)))
+        slot = 0
+        indent = 2
+        while len(self.func.instrs) < spec.instructions - 1:
+            if slot in loops:
+                self.loop(indent, spec.depth)
+            elif slot in calls:
+                self.indirectCall(indent)
+            elif spec.depth > 0 and self.rng.random() < 0.1:
+                self.ifElse(indent, spec.depth)
+            else:
+                self.statement(indent)
+            slot += 1
+        # The parameter is the result of the function
+        self.func.emit("local.get 0", indent, sorted(self.reaching[0]), 0)
+        self.func.lines[-1] += ")"
+        return self.func
+
+
+def generate_functions(spec):
+    rng = random.Random(spec.seed)
+    return [_Generator(spec, rng).generate() for _ in range(spec.functions)]
+
+
+def to_wat(spec, functions):
+    lines = ["(module", "  (type (;0;) (func (param i32) (result i32)))", "  (table 1 funcref)", "  (elem (i32.const 0) 0)"]
+    for index, func in enumerate(functions):
+        lines.append("  (func (;{};) (type 0) (param i32) (result i32)".format(index))
+        if spec.locals:
+            lines.append("    (local {})".format(" ".join(["i32"] * spec.locals)))
+        lines += func.lines
+    lines.append("  (export \"main\" (func 0)))")
+    return "\n".join(lines) + "\n"
+
+
+def _isLocalRead(func, i):
+    return i in func.locals and func.instrs[i].startswith("local.get")
+
+
+def to_wassail_dot(func):
+    # Record nodes of WASSAIL_BLOCK_SIZE instructions, edges from ports of users to definitions
+    block = lambda i: i // WASSAIL_BLOCK_SIZE
+    lines = ["digraph \"synthetic\" {"]
+    for start in range(0, len(func.instrs), WASSAIL_BLOCK_SIZE):
+        fields = "|".join("<instr{0}>{0}: {1}".format(i, func.instrs[i])
+                          for i in range(start, min(start + WASSAIL_BLOCK_SIZE, len(func.instrs))))
+        lines.append("  block{} [shape=record, label=\"{{{}}}\"];".format(block(start), fields))
+    for i, deps in enumerate(func.deps):
+        for d in deps:
+            lines.append("  block{}:instr{} -> block{}:instr{};".format(block(i), i, block(d), d))
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+
+def to_wasma_dot(func, numLocals):
+    # Instructions are named by their label, locals are L<k> nodes between writers and
+    # readers. Edges go from definitions to users; local edges carry the written value as
+    # weight when the reader has a single reaching definition.
+    count = len(func.instrs)
+    lines = ["digraph \"synthetic\" {"]
+    for i, text in enumerate(func.instrs):
+        lines.append("  {0} [label=\"#{0}+{0}:{1}\"];".format(i, text))
+    for k in range(numLocals):
+        lines.append("  L{0} [label=\"#{1}: ({2} L{0})\"];".format(k, count + k, "param" if k == 0 else "local"))
+    for i, deps in enumerate(func.deps):
+        if _isLocalRead(func, i):
+            weight = " [label=\"v{}\"]".format(deps[0]) if len(deps) == 1 else ""
+            lines.append("  L{} -> {}{};".format(func.locals[i], i, weight))
+            continue
+        for d in deps:
+            lines.append("  {} -> {};".format(d, i))
+        if i in func.locals:
+            lines.append("  {} -> L{} [label=\"v{}\"];".format(i, func.locals[i], i))
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+
+def to_binaryen_dot(func, source, rng):
+    # Nodes carry the instruction label as debugLoc line; some dependences go through a
+    # flattened temporary without debugLoc, like the locals introduced by --flatten
+    lines = ["digraph \"synthetic\" {"]
+    for i, text in enumerate(func.instrs):
+        lines.append("  n{0} [label=\"{1}\", debugLoc=\"{2} | Line: {0} | Col: 1\"];".format(i, text, source))
+    temps = 0
+    for i, deps in enumerate(func.deps):
+        for d in deps:
+            if rng.random() < BINARYEN_TEMP_RATE:
+                lines.append("  t{} [label=\"local.get\"];".format(temps))
+                lines.append("  n{} -> t{};".format(i, temps))
+                lines.append("  t{} -> n{};".format(temps, d))
+                temps += 1
+            else:
+                lines.append("  n{} -> n{};".format(i, d))
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+
+def to_dot(tool, func, spec, source):
+    if tool == "wassail":
+        return to_wassail_dot(func)
+    elif tool == "wasma":
+        return to_wasma_dot(func, spec.locals + 1)
+    elif tool == "binaryen":
+        return to_binaryen_dot(func, source, random.Random(spec.seed))
+    else:
+        raise ValueError(f"Unknown tool: {tool}")
+
+
+def metadata(name, functions):
+    # Same shape as generateMetadata writes
+    return {
+        "source": "{}.wat".format(name),
+        "functions": [{"index": str(i), "name": "func{}".format(i), "count": len(func.instrs)} for i, func in enumerate(functions)],
+    }
+
+
+def write_case(name, spec, root=process.MICRO_BENCHMARKS_PATH, dot=False, dataRoot=process.DATA_MICRO_BENCHMARKS_PATH):
+    functions = generate_functions(spec)
+    caseDir = Path(root) / name
+    caseDir.mkdir(parents=True, exist_ok=True)
+    with open(caseDir / "{}.wat".format(name), "w") as f:
+        f.write(to_wat(spec, functions))
+    if not dot:
+        return caseDir
+    meta = metadata(name, functions)
+    with open(caseDir / "metadata.json", "w") as f:
+        json.dump(meta, f)
+    for tool in process.toolRegister:
+        outDir = Path(dataRoot) / name / tool
+        outDir.mkdir(parents=True, exist_ok=True)
+        for i, (func, function) in enumerate(zip(functions, meta["functions"])):
+            funcIndex = i if tool == "binaryen" else function["index"]
+            with open(outDir / process.toolRegister[tool][1](funcIndex, name), "w") as f:
+                f.write(to_dot(tool, func, spec, meta["source"]))
+    return caseDir
+
+
+def main():
+    args = sys.argv[1:]
+    options = {"--instructions": "instructions", "--locals": "locals", "--depth": "depth", "--loops": "loops",
+               "--indirect": "indirect", "--functions": "functions", "--seed": "seed"}
+    spec = Spec()
+    root = process.MICRO_BENCHMARKS_PATH
+    dot = False
+    names = []
+    while args:
+        arg = args.pop(0)
+        if arg in options:
+            setattr(spec, options[arg], int(args.pop(0)))
+        elif arg == "--out":
+            root = Path(args.pop(0))
+        elif arg == "--dot":
+            dot = True
+        else:
+            names.append(arg)
+    if len(names) != 1:
+        print("Usage: synth.py NAME [--instructions N] [--locals K] [--depth D] [--loops L] [--indirect C] [--functions F] [--seed S] [--out DIR] [--dot]")
+        sys.exit(2)
+    caseDir = write_case(names[0], spec, root, dot)
+    print("synthetic case written to {}".format(caseDir))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+import collections
+import contextlib
+import json
+import os
+import threading
+import time
+
+# Per-stage spans written as JSON Lines, one Chrome trace event ("ph": "X") per line:
+#   {"name": "build", "cat": "graph", "ph": "X", "ts": µs, "dur": µs, "pid": ..., "tid": ...,
+#    "args": {"tool": ..., "case": ..., "function": ..., "nodes": ..., "edges": ..., "cpu": µs}}
+# "cpu" is the thread CPU time of the span, for analyse spans the CPU time of the analyzer process.
+# Stages: prepare, analyse (one analyzer run), parse, merge, collapse, build (parse to
+# frozen graph of one function and tool), compare (one batch), latex, pdflatex.
+# Pool workers append to the same file; the path is passed through the environment so
+# workers started from a forkserver see it too. Tracing is off unless configure() is called.
+TRACE_ENV = "WASM_DEPENDENCE_TRACE"
+TRACE_FILE = os.environ.get(TRACE_ENV)
+
+_lock = threading.Lock()
+_fd = None
+_fdPid = None
+
+
+def configure(path):
+    # Must be called before the pools are started
+    global TRACE_FILE
+    TRACE_FILE = str(path) if path else None
+    if TRACE_FILE:
+        os.environ[TRACE_ENV] = TRACE_FILE
+    else:
+        os.environ.pop(TRACE_ENV, None)
+
+
+def enabled():
+    return TRACE_FILE is not None
+
+
+def _write(event):
+    # One write() per line on an O_APPEND descriptor, so lines of concurrent processes
+    # and threads do not interleave
+    global _fd, _fdPid
+    line = (json.dumps(event) + "\n").encode("utf-8")
+    with _lock:
+        if _fd is None or _fdPid != os.getpid():
+            _fd = os.open(TRACE_FILE, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            _fdPid = os.getpid()
+        os.write(_fd, line)
+
+
+@contextlib.contextmanager
+def span(name, cat="pipeline", **attrs):
+    # Yields the attribute dict, so counts known only at the end of the stage can be added
+    if TRACE_FILE is None:
+        yield attrs
+        return
+    ts = time.time_ns() // 1000
+    wall = time.perf_counter_ns()
+    cpu = time.thread_time_ns()
+    try:
+        yield attrs
+    finally:
+        # Spans around an analyzer run set "cpu" to the child's own CPU time (runner usage)
+        attrs.setdefault("cpu", (time.thread_time_ns() - cpu) // 1000)
+        _write({
+            "name": name, "cat": cat, "ph": "X", "ts": ts, "dur": (time.perf_counter_ns() - wall) // 1000,
+            "pid": os.getpid(), "tid": threading.get_ident(), "args": attrs,
+        })
+
+
+def graphCounts(attrs, g):
+    # Node/edge counts of a Graph or FrozenGraph
+    if TRACE_FILE is None:
+        return g
+    if hasattr(g, "edge_count"):
+        attrs["nodes"] = len(g)
+        attrs["edges"] = g.edge_count()
+    else:
+        attrs["nodes"] = len(g.adj_list)
+        attrs["edges"] = sum(len(to_ids) for _, to_ids in g.adj_list.values())
+    return g
+
+
+def readTrace(path):
+    # Events of a JSONL trace, a partial last line left by a crash is skipped
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+
+def toChrome(path, output):
+    # Chrome's trace viewer (chrome://tracing, Perfetto) loads a JSON object with traceEvents
+    with open(output, "w", encoding="utf-8") as f:
+        f.write('{"traceEvents": [')
+        for k, event in enumerate(readTrace(path)):
+            f.write(("," if k else "") + "\n" + json.dumps(event))
+        f.write("\n]}\n")
+
+
+def summarize(path, top=10):
+    stages = collections.OrderedDict()
+    # (tool, stage) -> (case, function) -> µs; analyse (external analyzer) and build (Python) apart
+    functions = collections.defaultdict(lambda: collections.defaultdict(int))
+    start = end = None
+    for event in readTrace(path):
+        args = event.get("args", {})
+        stage = stages.setdefault(event["name"], {"count": 0, "wall": 0, "cpu": 0, "nodes": 0})
+        stage["count"] += 1
+        stage["wall"] += event["dur"]
+        stage["cpu"] += args.get("cpu", 0)
+        stage["nodes"] += args.get("nodes", 0)
+        start = event["ts"] if start is None else min(start, event["ts"])
+        end = event["ts"] + event["dur"] if end is None else max(end, event["ts"] + event["dur"])
+        if "tool" in args and args.get("function") is not None:
+            functions[(args["tool"], event["name"])][(args.get("case"), args["function"])] += event["dur"]
+
+    if start is None:
+        print("{} has no spans".format(path))
+        return
+    elapsed = (end - start) / 1e6
+    print("trace {}: {} spans over {:.2f} seconds".format(path, sum(s["count"] for s in stages.values()), elapsed))
+    print("{:<12} {:>8} {:>12} {:>12} {:>12} {:>12}".format("stage", "spans", "wall (s)", "cpu (s)", "spans/s", "nodes/s"))
+    for name, stage in stages.items():
+        wall = stage["wall"] / 1e6
+        rate = stage["count"] / wall if wall else float("inf")
+        nodeRate = stage["nodes"] / wall if wall and stage["nodes"] else 0
+        print("{:<12} {:>8} {:>12.3f} {:>12.3f} {:>12.1f} {:>12.0f}".format(name, stage["count"], wall, stage["cpu"] / 1e6, rate, nodeRate))
+    for (tool, name), durations in functions.items():
+        total = sum(durations.values()) / 1e6
+        print("")
+        print("{} {}: {} functions, {:.3f} seconds, {:.1f} functions/s".format(tool, name, len(durations), total, len(durations) / total if total else float("inf")))
+        slowest = sorted(durations.items(), key=lambda item: item[1], reverse=True)[:top]
+        for (case, function), dur in slowest:
+            print("  {:>10.4f}s  {} function {}".format(dur / 1e6, case, function))
@@ -0,0 +1,320 @@
+import mmap
+
+# 只为生成 metadata.json 读取 wasm 二进制：导入的函数个数、每个函数的名字与指令条数。
+# 代码段只做一遍线性扫描，跳过各条指令的立即数，不构建任何指令对象。
+# 指令的编号按 wassail function-instruction-labels 的规则：每个函数从 0 开始按先序编号，
+# block / loop / if 本身占一个编号，else 与 end 不编号；因此指令条数即最后一个编号加一。
+# 这一规则尚未与 wassail 的实际输出逐一核对，所以只在 --decode-metadata 时使用；
+# main.py --check-metadata 会在所有 micro 与 real-world 程序上比较两者的结果。
+# 遇到不认识的操作码时抛出 WasmDecodeError，由调用方回退到 wassail。
+
+MAGIC = b"\0asm"
+
+SECTION_CUSTOM = 0
+SECTION_IMPORT = 2
+SECTION_FUNCTION = 3
+SECTION_EXPORT = 7
+SECTION_CODE = 10
+
+NAME_SUBSECTION_FUNCTIONS = 1
+
+# 立即数的类型
+_NONE, _U32, _U32_U32, _BLOCK, _BR_TABLE, _SELECT_T, _MEMARG, _I32, _I64, _F32, _F64, _BYTE, _PREFIX_FC, _PREFIX_FD = range(14)
+
+_IMMEDIATES = [None] * 256
+for _op in (0x00, 0x01, 0x05, 0x0B, 0x0F, 0x1A, 0x1B, 0xD1):
+    _IMMEDIATES[_op] = _NONE
+for _op in range(0x45, 0xC5):  # 数值运算
+    _IMMEDIATES[_op] = _NONE
+for _op in (0x02, 0x03, 0x04):  # block loop if
+    _IMMEDIATES[_op] = _BLOCK
+for _op in (0x0C, 0x0D, 0x10, 0x12, 0x20, 0x21, 0x22, 0x23, 0x24, 0x25, 0x26, 0x3F, 0x40, 0xD2):
+    _IMMEDIATES[_op] = _U32
+for _op in (0x11, 0x13):  # call_indirect return_call_indirect
+    _IMMEDIATES[_op] = _U32_U32
+for _op in range(0x28, 0x3F):  # load / store
+    _IMMEDIATES[_op] = _MEMARG
+_IMMEDIATES[0x0E] = _BR_TABLE
+_IMMEDIATES[0x1C] = _SELECT_T
+_IMMEDIATES[0x41] = _I32
+_IMMEDIATES[0x42] = _I64
+_IMMEDIATES[0x43] = _F32
+_IMMEDIATES[0x44] = _F64
+_IMMEDIATES[0xD0] = _BYTE  # ref.null
+_IMMEDIATES[0xFC] = _PREFIX_FC
+_IMMEDIATES[0xFD] = _PREFIX_FD
+
+# 0xFC 前缀：饱和截断、bulk memory、table 指令，子操作码 -> 其后 u32 立即数的个数
+_FC_U32_COUNT = {0: 0, 1: 0, 2: 0, 3: 0, 4: 0, 5: 0, 6: 0, 7: 0, 8: 2, 9: 1, 10: 2, 11: 1,
+                 12: 2, 13: 1, 14: 2, 15: 1, 16: 1, 17: 1}
+# 0xFD 前缀（SIMD）中带立即数的子操作码，其余没有立即数
+_FD_MEMARG = set(range(0, 12)) | {92, 93}
+_FD_BYTES16 = {12, 13}  # v128.const i8x16.shuffle
+_FD_LANE = set(range(21, 35))
+_FD_MEMARG_LANE = set(range(84, 92))
+
+
+class WasmDecodeError(Exception):
+    """
+    输入不是 wasm 二进制，或者用到了解码器不认识的指令
+    """
+
+
+class _Reader:
+    __slots__ = ("buf", "pos", "end")
+
+    def __init__(self, buf, pos=0, end=None):
+        self.buf = buf
+        self.pos = pos
+        self.end = len(buf) if end is None else end
+
+    def byte(self):
+        if self.pos >= self.end:
+            raise WasmDecodeError(f"unexpected end of data at offset {self.pos}")
+        b = self.buf[self.pos]
+        self.pos += 1
+        return b
+
+    def u32(self):
+        result = 0
+        shift = 0
+        buf = self.buf
+        pos = self.pos
+        while True:
+            if pos >= self.end:
+                raise WasmDecodeError(f"unexpected end of data at offset {pos}")
+            b = buf[pos]
+            pos += 1
+            result |= (b & 0x7F) << shift
+            if b < 0x80:
+                self.pos = pos
+                return result
+            shift += 7
+
+    def skip_leb(self):
+        self.pos = _skip_leb(self.buf, self.pos)
+
+    def name(self):
+        n = self.u32()
+        start = self.pos
+        self.pos += n
+        return bytes(self.buf[start:self.pos]).decode("utf-8", errors="replace")
+
+
+def _skip_limits(reader):
+    flags = reader.byte()
+    reader.skip_leb()
+    if flags & 1:
+        reader.skip_leb()
+
+
+def _count_imported_functions(reader):
+    functions = 0
+    for _ in range(reader.u32()):
+        reader.name()
+        reader.name()
+        kind = reader.byte()
+        if kind == 0:  # func
+            reader.skip_leb()
+            functions += 1
+        elif kind == 1:  # table
+            reader.byte()
+            _skip_limits(reader)
+        elif kind == 2:  # memory
+            _skip_limits(reader)
+        elif kind == 3:  # global
+            reader.byte()
+            reader.byte()
+        elif kind == 4:  # tag
+            reader.byte()
+            reader.skip_leb()
+        else:
+            raise WasmDecodeError(f"unknown import kind {kind}")
+    return functions
+
+
+def _read_exports(reader):
+    names = {}
+    for _ in range(reader.u32()):
+        name = reader.name()
+        kind = reader.byte()
+        index = reader.u32()
+        if kind == 0:
+            names.setdefault(index, name)
+    return names
+
+
+def _read_function_names(reader):
+    # name 自定义段的函数名子段；其余子段跳过
+    names = {}
+    while reader.pos < reader.end:
+        subsection = reader.byte()
+        size = reader.u32()
+        end = reader.pos + size
+        if subsection == NAME_SUBSECTION_FUNCTIONS:
+            for _ in range(reader.u32()):
+                index = reader.u32()
+                names[index] = reader.name()
+        reader.pos = end
+    return names
+
+
+def _skip_leb(buf, pos):
+    # 有符号、无符号的 LEB128 都一样跳过，返回其后的位置
+    while buf[pos] & 0x80:
+        pos += 1
+    return pos + 1
+
+
+def _read_u32(buf, pos):
+    result = 0
+    shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7F) << shift
+        if b < 0x80:
+            return result, pos
+        shift += 7
+
+
+def count_instructions(buf, pos, end):
+    """
+    函数体 buf[pos:end]（局部变量声明之后的表达式）中带编号的指令条数
+    位置用局部变量推进，这是整个解码器唯一的热循环
+    """
+    immediates = _IMMEDIATES
+    skip_leb = _skip_leb
+    count = 0
+    while pos < end:
+        op = buf[pos]
+        pos += 1
+        kind = immediates[op]
+        if kind == _NONE:
+            if op != 0x0B and op != 0x05:  # end、else 不编号
+                count += 1
+            continue
+        if kind is None:
+            raise WasmDecodeError(f"unsupported opcode 0x{op:02x} at offset {pos - 1}")
+        count += 1
+        if kind == _U32 or kind == _I32 or kind == _I64:
+            while buf[pos] & 0x80:
+                pos += 1
+            pos += 1
+        elif kind == _MEMARG:
+            align, pos = _read_u32(buf, pos)
+            if align & 0x40:  # multi-memory：对齐字段第 6 位表示其后还有内存下标
+                pos = skip_leb(buf, pos)
+            pos = skip_leb(buf, pos)
+        elif kind == _BLOCK:
+            blocktype = buf[pos]
+            if blocktype == 0x40 or 0x6F <= blocktype <= 0x7F:
+                pos += 1
+            else:
+                pos = skip_leb(buf, pos)
+        elif kind == _U32_U32:
+            pos = skip_leb(buf, skip_leb(buf, pos))
+        elif kind == _F32:
+            pos += 4
+        elif kind == _F64:
+            pos += 8
+        elif kind == _BYTE:
+            pos += 1
+        elif kind == _BR_TABLE:
+            targets, pos = _read_u32(buf, pos)
+            for _ in range(targets + 1):
+                pos = skip_leb(buf, pos)
+        elif kind == _SELECT_T:
+            types, pos = _read_u32(buf, pos)
+            pos += types
+        elif kind == _PREFIX_FC:
+            sub, pos = _read_u32(buf, pos)
+            if sub not in _FC_U32_COUNT:
+                raise WasmDecodeError(f"unsupported opcode 0xfc {sub} at offset {pos}")
+            for _ in range(_FC_U32_COUNT[sub]):
+                pos = skip_leb(buf, pos)
+        else:  # _PREFIX_FD
+            sub, pos = _read_u32(buf, pos)
+            if sub in _FD_MEMARG or sub in _FD_MEMARG_LANE:
+                align, pos = _read_u32(buf, pos)
+                if align & 0x40:
+                    pos = skip_leb(buf, pos)
+                pos = skip_leb(buf, pos)
+                if sub in _FD_MEMARG_LANE:
+                    pos += 1
+            elif sub in _FD_BYTES16:
+                pos += 16
+            elif sub in _FD_LANE:
+                pos += 1
+    if pos != end:
+        raise WasmDecodeError(f"function body overruns its size at offset {end}")
+    return count
+
+
+def read_functions(buf):
+    """
+    读取模块中定义的函数（不含导入），buf 为 bytes、mmap 等支持缓冲区协议的对象
+    :return: [{"index": str, "name": str, "count": int}]，与 generateMetadata 写出的格式相同；
+             index 为函数在函数下标空间中的位置（导入函数在前），name 取自 name 段，
+             没有时取导出名，再没有时为空串
+    """
+    if bytes(buf[:4]) != MAGIC:
+        raise WasmDecodeError("not a wasm binary")
+    try:
+        return _read_functions(buf)
+    except IndexError:
+        raise WasmDecodeError("truncated module") from None
+
+
+def _read_functions(buf):
+    reader = _Reader(buf, 8)
+    imported = 0
+    exports = {}
+    names = {}
+    bodies = []
+    while reader.pos < reader.end:
+        section = reader.byte()
+        size = reader.u32()
+        end = reader.pos + size
+        if end > reader.end:
+            raise WasmDecodeError(f"section {section} overruns the module")
+        if section == SECTION_IMPORT:
+            imported = _count_imported_functions(reader)
+        elif section == SECTION_EXPORT:
+            exports = _read_exports(reader)
+        elif section == SECTION_CODE:
+            for _ in range(reader.u32()):
+                body_size = reader.u32()
+                body_end = reader.pos + body_size
+                for _ in range(reader.u32()):  # 局部变量声明 (个数, 类型)
+                    reader.skip_leb()
+                    reader.byte()
+                bodies.append((reader.pos, body_end))
+                reader.pos = body_end
+        elif section == SECTION_CUSTOM:
+            sub = _Reader(buf, reader.pos, end)
+            if sub.name() == "name":
+                try:
+                    names = _read_function_names(sub)
+                except (WasmDecodeError, IndexError):
+                    names = {}  # 名字只是说明信息，损坏的 name 段不影响其余内容
+        reader.pos = end
+    functions = []
+    for i, (start, end) in enumerate(bodies):
+        index = imported + i
+        count = count_instructions(buf, start, end)
+        functions.append({"index": str(index), "name": names.get(index, exports.get(index, "")), "count": count})
+    return functions
+
+
+def read_functions_file(path):
+    """
+    把 wasm 文件映射到内存后读取，见 read_functions
+    """
+    with open(path, "rb") as f:
+        try:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            raise WasmDecodeError("empty file") from None
+        with buf:
+            return read_functions(buf)
@@ -0,0 +1,86 @@
+import random
+
+import pydot
+import pytest
+
+import dotparse
+import graph
+import synth
+
+
+def pydot_parse(text, mark):
+    # 与 graph.load_dot 的回退路径相同，只保留 dotparse 为该方言保存的属性
+    node_keep, edge_keep = dotparse.DIALECT_ATTRS[mark]
+    graph = pydot.graph_from_dot_data(text)[0]
+    nodes = [(node.get_name(), {k: v for k, v in node.get_attributes().items() if k in node_keep})
+             for node in graph.get_nodes()]
+    edges = [(edge.get_source(), edge.get_destination(),
+              {k: v for k, v in edge.get_attributes().items() if k in edge_keep})
+             for edge in graph.get_edges()]
+    return nodes, edges
+
+
+CASES = {
+    "chain": 'digraph g { abc -> bcd -> cde; x -> y -> z [label="w"] }',
+    "numeric": "digraph g {\n 12 -> 345 -> 6;\n 1.5 -> .5;\n 3 -> 7 [label=2]\n}",
+    "graph attributes": 'digraph "f" { rankdir=LR; label="title"\n a [label="x"]; a -> b }',
+    "comments": 'digraph g {\n // a -> b\n a /* inline */ [label="x"]; /* c -> d */ a -> e // tail\n}',
+    "trailing comments": 'digraph g { a; // x y\n b /* c */\n}',
+    "ports": 'digraph g { b0 [shape=record, label="{<i0>0: nop|<i1>1: drop}"]; b0:i1 -> b0:i0; }',
+    "repeated": 'digraph g { a [label="1"]; a [label="2"]; a -> b; a -> b [label="v"]; }',
+    "quoted": 'digraph g { "n 1" [label="say \\"hi\\""]; "n 1" -> "n 2" }',
+}
+
+
+@pytest.mark.parametrize("mark", sorted(dotparse.DIALECT_ATTRS))
+@pytest.mark.parametrize("case", sorted(CASES))
+def test_matches_pydot(case, mark):
+    assert dotparse.parse_dot(CASES[case], mark) == pydot_parse(CASES[case], mark)
+
+
+@pytest.mark.parametrize("mark", sorted(dotparse.DIALECT_ATTRS))
+def test_synthetic_outputs_match_pydot(mark):
+    spec = synth.Spec(instructions=300, locals=4, depth=2, loops=2, indirect=2, seed=3)
+    func = synth.generate_functions(spec)[0]
+    text = synth.to_dot(mark, func, spec, "s.wat")
+    assert dotparse.parse_dot(text, mark) == pydot_parse(text, mark)
+
+
+def test_file_and_bytes_agree(tmp_path):
+    path = tmp_path / "g.dot"
+    path.write_text(CASES["chain"])
+    assert dotparse.parse_dot_file(path, "wasma") == dotparse.parse_dot(CASES["chain"].encode(), "wasma")
+    empty = tmp_path / "empty.dot"
+    empty.write_bytes(b"")
+    with pytest.raises(dotparse.DotUnsupported):
+        dotparse.parse_dot_file(empty, "wasma")
+
+
+@pytest.mark.parametrize("text", [
+    "digraph g { node [shape=box]; a }",
+    "digraph g { subgraph s { a } }",
+    "graph g { a -- b }",
+    "digraph g { a:p:n -> b }",
+])
+def test_unsupported_syntax(text):
+    with pytest.raises(dotparse.DotUnsupported):
+        dotparse.parse_dot(text, "wassail")
+
+
+def test_load_dot_falls_back_to_pydot(tmp_path):
+    # node 默认属性不在快速解析器支持的子集内，由 pydot 解析
+    path = tmp_path / "g.dot"
+    path.write_text('digraph g { node [shape=box]; a [label="x"]; a -> b [label="v"] }')
+    with pytest.raises(dotparse.DotUnsupported):
+        dotparse.parse_dot_file(path, "wasma")
+    nodes, edges = graph.load_dot(path, "wasma")
+    assert ("a", {"label": '"x"'}) in nodes
+    assert edges == [("a", "b", {"label": '"v"'})]
+
+
+@pytest.mark.parametrize("mark", sorted(dotparse.DIALECT_ATTRS))
+def test_load_dot_fast_path(tmp_path, mark):
+    spec = synth.Spec(instructions=50, locals=2, seed=5)
+    path = tmp_path / "g.dot"
+    path.write_text(synth.to_dot(mark, synth.generate_functions(spec)[0], spec, "s.wat"))
+    assert graph.load_dot(path, mark) == dotparse.parse_dot_file(path, mark)
@@ -0,0 +1,55 @@
+import random
+
+import pytest
+
+import bench
+import graph
+
+
+def random_local_graph(n, seed):
+    # Locals, non-locals and locals without successors mixed, with cycles through locals
+    rng = random.Random(seed)
+    g = graph.Graph(n)
+    for i in range(n):
+        kind = rng.random()
+        if kind < 0.35:
+            g.add_node(i, "local.get {}".format(rng.randrange(4)))
+        elif kind < 0.7:
+            g.add_node(i, "local.set {}".format(rng.randrange(4)))
+        else:
+            g.add_node(i, "i32.add")
+    for i in range(n):
+        for _ in range(rng.randrange(4)):
+            g.add_edge(i, rng.randrange(n))
+    return g
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_matches_reference(seed):
+    g = random_local_graph(60, seed)
+    assert graph.merge_local_get_set(g).adj_list == bench.reference_merge(g).adj_list
+
+
+@pytest.mark.parametrize("chain", [1, 2, 7, None])
+def test_chains_match_reference(chain):
+    g = bench.local_chain_graph(300, chain)
+    assert graph.merge_local_get_set(g).adj_list == bench.reference_merge(g).adj_list
+
+
+def test_frozen_input():
+    g = random_local_graph(80, 99)
+    assert graph.merge_local_get_set(g.freeze()).adj_list == bench.reference_merge(g).adj_list
+
+
+def test_cycle_collapses_to_entry():
+    g = graph.Graph(4)
+    g.add_node(0, "i32.const 1")
+    for i in (1, 2, 3):
+        g.add_node(i, "local.get 0")
+    g.add_edge(0, 1)
+    g.add_edge(1, 2)
+    g.add_edge(2, 3)
+    g.add_edge(3, 1)
+    forward = graph.local_forwarding_table(g.freeze())
+    assert list(forward) == [-1, 1, 1, 1]
+    assert graph.merge_local_get_set(g).adj_list == bench.reference_merge(g).adj_list
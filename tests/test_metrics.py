@@ -0,0 +1,75 @@
+import itertools
+import math
+
+import networkx as nx
+import numpy as np
+import pytest
+
+import bench
+import graph
+
+
+def tool_graphs(n, seed):
+    # One function as three tools see it; a few ids beyond node_count are ignored by all metrics
+    g = bench.dependence_graph(n, seed=seed)
+    graphs = [g, bench.perturbed(g, 1), bench.perturbed(g, 2, rate=0.3)]
+    graphs[2].add_node(n + 1, "nop")
+    graphs[2].add_edge(0, n + 1)
+    return graphs
+
+
+def reference_metrics(graphs):
+    # The pairwise definitions on Python sets
+    edges = [{(u, v) for u, v in g.get_edges() if u < g.node_count and v < g.node_count} for g in graphs]
+    nodes = [{id for id in g.adj_list if id < g.node_count} for g in graphs]
+    ratio = lambda num, den: num / den if den else 1.0
+    ret = {name: np.zeros((len(graphs), len(graphs))) for name in graph.SIMILARITY_METRICS}
+    for i, j in itertools.product(range(len(graphs)), repeat=2):
+        common = len(edges[i] & edges[j])
+        ret["frobenius"][i, j] = math.sqrt(len(edges[i] ^ edges[j]))
+        ret["jaccard"][i, j] = ratio(common, len(edges[i] | edges[j]))
+        ret["precision"][i, j] = ratio(common, len(edges[i]))
+        ret["recall"][i, j] = ratio(common, len(edges[j]))
+        ret["node_coverage"][i, j] = ratio(len(nodes[i] & nodes[j]), len(nodes[j]))
+    return ret
+
+
+def keys(graphs):
+    return [graph.edge_keys(g) for g in graphs], [graph.node_keys(g) for g in graphs]
+
+
+def test_overlap_counts_match_sets():
+    groups = [[np.array(sorted(s), dtype=np.int64) for s in tools] for tools in (
+        [{1, 2, 3}, {2, 3, 4}, set()],
+        [set(), set(), set()],
+        [{5}, {5}, {5, 6}],
+    )]
+    counts = graph.overlap_counts(groups)
+    for g, tools in enumerate(groups):
+        for i, j in itertools.product(range(3), repeat=2):
+            assert counts[g, i, j] == len(set(tools[i]) & set(tools[j]))
+
+
+def test_overlap_counts_empty_batch():
+    assert graph.overlap_counts([]).shape == (0, 0, 0)
+    assert not graph.overlap_counts([[np.array([], dtype=np.int64)] * 2]).any()
+
+
+def test_batch_matches_reference():
+    functions = [tool_graphs(n, seed) for seed, n in enumerate([1, 5, 40, 300])]
+    results = graph.compareBatch([keys(graphs) for graphs in functions])
+    for k, graphs in enumerate(functions):
+        expected = reference_metrics(graphs)
+        for name in graph.SIMILARITY_METRICS:
+            np.testing.assert_allclose(results[name][k], expected[name], err_msg=name)
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_frobenius_matches_dense_matrices(seed):
+    # The original computation: norm of the difference of the networkx adjacency matrices
+    graphs = tool_graphs(60, seed)
+    dense = [nx.to_numpy_array(g.to_NetworkX(), nodelist=range(g.node_count)) for g in graphs]
+    expected = np.array([[np.linalg.norm(a - b, "fro") for b in dense] for a in dense])
+    np.testing.assert_allclose(graph.compareAdjacentMatrix(graphs), expected)
+    np.testing.assert_allclose(graph.compareAdjacentMatrix([g.freeze() for g in graphs]), expected)
+    np.testing.assert_allclose(graph.compareBatch([keys(graphs)], ["frobenius"])["frobenius"][0], expected)
@@ -0,0 +1,84 @@
+import random
+
+import networkx as nx
+import pytest
+
+import bench
+import graph
+
+
+def random_graph(n, seed, degree=3):
+    rng = random.Random(seed)
+    g = graph.Graph(n)
+    for i in range(n):
+        g.add_node(i, "i32.add")
+    for i in range(n):
+        for _ in range(rng.randrange(degree + 1)):
+            g.add_edge(i, rng.randrange(n))
+    return g
+
+
+def to_networkx(g):
+    ret = nx.DiGraph()
+    ret.add_nodes_from(g.adj_list)
+    ret.add_edges_from(g.get_edges())
+    return ret
+
+
+def reference_reduction(g):
+    # Edges inside a strongly connected component stay, an edge between components stays
+    # when its component pair is in the transitive reduction of the condensation
+    condensed = nx.condensation(to_networkx(g))
+    comp = condensed.graph["mapping"]
+    kept = set(nx.transitive_reduction(condensed).edges())
+    return {(u, v) for u, v in g.get_edges() if comp[u] == comp[v] or (comp[u], comp[v]) in kept}
+
+
+GRAPHS = [random_graph(40, seed) for seed in range(15)] + [
+    random_graph(200, 100, degree=1),
+    bench.dependence_graph(500, loops=0.05),
+    bench.local_chain_graph(200, 5),
+]
+
+
+@pytest.mark.parametrize("g", GRAPHS)
+def test_components_match_networkx(g):
+    frozen = g.freeze()
+    comp, count = graph.strongly_connected_components(frozen)
+    groups = {}
+    for id, c in zip(frozen.ids, comp):
+        groups.setdefault(c, set()).add(id)
+    assert len(groups) == count
+    assert sorted(map(sorted, groups.values())) == sorted(map(sorted, nx.strongly_connected_components(to_networkx(g))))
+    # Reverse topological numbering: an edge never goes to a component with a larger number
+    index = frozen.index
+    for u, v in g.get_edges():
+        assert comp[index[u]] >= comp[index[v]]
+
+
+def test_components_of_active_nodes():
+    g = random_graph(60, 7)
+    frozen = g.freeze()
+    active = [id % 3 != 0 for id in frozen.ids]
+    comp, count = graph.strongly_connected_components(frozen, active)
+    sub = to_networkx(g).subgraph([id for id, a in zip(frozen.ids, active) if a])
+    groups = {}
+    for id, c, a in zip(frozen.ids, comp, active):
+        assert (c == -1) == (not a)
+        if a:
+            groups.setdefault(c, set()).add(id)
+    assert len(groups) == count
+    assert sorted(map(sorted, groups.values())) == sorted(map(sorted, nx.strongly_connected_components(sub)))
+
+
+@pytest.mark.parametrize("g", GRAPHS)
+def test_reduction_matches_networkx(g):
+    reduced = graph.transitive_reduction(g.freeze())
+    assert set(reduced.get_edges()) == reference_reduction(g)
+    assert list(reduced.ids) == list(g.freeze().ids)
+
+
+def test_simplify_transitive_on_dag():
+    g = bench.dependence_graph(300, loops=0)
+    expected = set(nx.transitive_reduction(to_networkx(g)).edges())
+    assert set(g.simplify(transitive=True).get_edges()) == expected
@@ -0,0 +1,77 @@
+import pytest
+
+import cache
+import pool
+import process
+import results
+import synth
+
+
+class Interrupted(Exception):
+    pass
+
+
+@pytest.fixture
+def cases(tmp_path, monkeypatch):
+    # Three synthetic micro benchmarks with stored outputs, evaluated without the analyzers
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(process, "RUN_TOOLS", False)
+    monkeypatch.setattr(process, "COMPARE_BATCH", 2)
+    monkeypatch.setattr(cache, "ENABLED", False)
+    for k, name in enumerate(["c", "a", "b"]):
+        synth.write_case(name, synth.Spec(instructions=60, locals=3, functions=5, seed=k), dot=True)
+    yield tmp_path / process.DATA_MICRO_BENCHMARKS_PATH / results.RESULT_FILE
+    pool.shutdown()
+
+
+def records(path):
+    return list(results.readResults(path))
+
+
+def interrupt_after(monkeypatch, count):
+    # Stop the run as a crash would, right after count more function records
+    written = []
+    writeFunction = results.ResultWriter.writeFunction
+
+    def limited(self, case, record):
+        if len(written) == count:
+            raise Interrupted()
+        written.append(record)
+        writeFunction(self, case, record)
+
+    monkeypatch.setattr(results.ResultWriter, "writeFunction", limited)
+
+
+@pytest.mark.parametrize("stop", [1, 5, 7, 14])
+def test_resume_matches_uninterrupted_run(cases, monkeypatch, stop):
+    process.runBenchmark()
+    expected = records(cases)
+    assert [r["case"] for r in expected if r["type"] == "case"] == ["a", "b", "c"]
+    assert sum(r["type"] == "function" for r in expected) == 15
+
+    with monkeypatch.context() as m:
+        interrupt_after(m, stop)
+        with pytest.raises(Interrupted):
+            process.runBenchmark()
+    # A crash in the middle of a write leaves a partial line
+    with open(cases, "a") as f:
+        f.write('{"type": "function", "case": ')
+    process.runBenchmark(resume=True)
+    assert records(cases) == expected
+
+
+def test_resume_of_complete_stream_writes_nothing(cases):
+    process.runBenchmark()
+    before = cases.read_bytes()
+    process.runBenchmark(resume=True)
+    assert cases.read_bytes() == before
+
+
+def test_truncate_partial_line(tmp_path):
+    path = tmp_path / "r.jsonl"
+    path.write_bytes(b'{"a": 1}\n{"b": 2}\n{"c"')
+    results.truncatePartialLine(path)
+    assert path.read_bytes() == b'{"a": 1}\n{"b": 2}\n'
+    path.write_bytes(b'{"c"')
+    results.truncatePartialLine(path)
+    assert path.read_bytes() == b""